@@ -31,6 +31,12 @@ class Agent(object):
         """
         raise NotImplementedError("Override me")
 
+    def finish_experiment(self):
+        """
+        :description: releases any resources held by the agent once the experiment is over
+        """
+        pass
+
     def start_testing(self):
         pass
 
@@ -163,7 +169,7 @@ class NeuralAgent(Agent):
     :description: A class that wraps a network so it may more easily interact with an experiment. 
     """
 
-    def __init__(self, network, policy, replay_memory, log, state_adapter):
+    def __init__(self, network, policy, replay_memory, log, state_adapter, updates_per_step=1):
         """
         :type network: a network class (see e.g., qnetwork.py)
         :param network: the network the agent uses to evaluate states
@@ -173,16 +179,22 @@ class NeuralAgent(Agent):
 
         :type replay_memory: replay memory class (see replay_memory.py)
         :param replay_memory: replay memory used to store dataset as it is gathered.
+
+        :type updates_per_step: int
+        :param updates_per_step: number of minibatch updates performed per step, the 
+            minibatches of a step are sampled from the replay memory at once
         """
 
         self.network = network
         self.policy = policy
         self.replay_memory = replay_memory
+        self.updates_per_step = updates_per_step
         self.logger = log
-        self.logger.log_hyperparameters(network, policy, replay_memory)
+        self.logger.log_hyperparameters(network, policy, replay_memory, updates_per_step)
         self.state_adapter = state_adapter
 
         self.prev_state = None
+        self.prev_memory_state = None
         self.prev_action = None
         
     def step(self, next_state, reward):
@@ -199,10 +211,12 @@ class NeuralAgent(Agent):
         :param rval: returns the action to next be taken within the environment
         """
         # need to transform an external state format to an internal one
+        next_memory_state = memory_format(self.replay_memory, self.state_adapter, next_state)
         next_state = self.state_adapter.convert_state_to_agent_format(next_state)
 
         # store current (s,a,r,s') tuple
-        self.replay_memory.store((self.prev_state, self.prev_action, reward, next_state, 0))
+        self.replay_memory.store((self.prev_memory_state, self.prev_action, reward, 
+            next_memory_state, 0))
 
         # perform training
         self.train()
@@ -212,6 +226,7 @@ class NeuralAgent(Agent):
 
         # set previous values
         self.prev_state = next_state
+        self.prev_memory_state = next_memory_state
         self.prev_action = action
 
         # log information
@@ -222,18 +237,51 @@ class NeuralAgent(Agent):
 
     def train(self):
         """
-        :description: collects a minibatch of experiences and passes them to the network to train
+        :description: collects updates_per_step minibatches of experiences and passes them to 
+            the network to train
         """
         # wait until replay memory has samples
         if not self.replay_memory.is_full():
             return
 
-        # collect minibatch
-        states, actions, rewards, next_states, terminals = self.replay_memory.sample_batch()
+        # a network that trains on a stack of minibatches performs all the updates of a 
+        # step in a single call
+        if self.updates_per_step > 1 and hasattr(self.network, 'train_batches') \
+                and hasattr(self.replay_memory, 'sample_batches'):
+            self.train_batches()
+            return
+
+        # collect minibatches, which may include values beyond (s,a,r,s',t) such as 
+        # importance sampling weights depending on the replay memory
+        for minibatch in sample_minibatches(self.replay_memory, self.updates_per_step):
+            batch = dict(zip(self.replay_memory.batch_fields, minibatch))
+            indices = batch.pop('indices', None)
 
-        # pass to network to perform training
-        loss = self.network.train(states, actions, rewards, next_states, terminals)
-        self.logger.log_loss(loss)
+            # pass to network to perform training
+            loss = self.network.train(**batch)
+            self.logger.log_loss(loss)
+
+            # feed the td errors back to a prioritized replay memory
+            if indices is not None:
+                self.replay_memory.update_priorities(indices, self.network.td_errors)
+
+    def train_batches(self):
+        """
+        :description: samples the updates_per_step minibatches of a step stacked together and 
+            passes them to the network's train_batches at once
+        """
+        batch = dict(zip(self.replay_memory.batch_fields, 
+            self.replay_memory.sample_batches(self.updates_per_step)))
+        indices = batch.pop('indices', None)
+
+        losses = self.network.train_batches(**batch)
+        for loss in losses:
+            self.logger.log_loss(loss)
+
+        # the priorities are updated in the order of the minibatches, as with separate updates
+        if indices is not None:
+            for batch_indices, td_errors in zip(indices, self.network.td_errors):
+                self.replay_memory.update_priorities(batch_indices, td_errors)
 
     def get_action(self, state):
         """
@@ -250,6 +298,7 @@ class NeuralAgent(Agent):
         description: determines the first action to take and initializes internal variables
         """
         self.prev_state = self.state_adapter.convert_state_to_agent_format(state)
+        self.prev_memory_state = memory_format(self.replay_memory, self.state_adapter, state)
         self.prev_action = self.get_action(self.prev_state)
 
         self.logger.log_action(self.prev_action)
@@ -261,8 +310,9 @@ class NeuralAgent(Agent):
         """
 
         terminal = 1
-        next_state = self.state_adapter.convert_state_to_agent_format(next_state)
-        self.replay_memory.store((self.prev_state, self.prev_action, reward, next_state, terminal))
+        next_state = memory_format(self.replay_memory, self.state_adapter, next_state)
+        self.replay_memory.store((self.prev_memory_state, self.prev_action, reward, next_state, 
+            terminal))
         self.logger.log_reward(reward)
         self.logger.finish_episode()
 
@@ -271,6 +321,19 @@ class NeuralAgent(Agent):
         :description: perform tasks at the end of an epoch
         """
         self.logger.log_epoch(epoch, self.network, self.policy)
+        if hasattr(self.replay_memory, 'compression_ratio'):
+            self.logger.log_compression_ratio(epoch, self.replay_memory.compression_ratio())
+        if hasattr(self.replay_memory, 'collect_stats'):
+            self.logger.log_replay_stats(epoch, self.replay_memory.collect_stats())
+
+    def finish_experiment(self):
+        """
+        :description: shuts down the replay memory, e.g., stops a prefetching thread, and 
+            logs how the network's functions were compiled
+        """
+        close_replay_memory(self.replay_memory, self.logger)
+        if getattr(self.network, 'function_cache', None) is not None:
+            self.logger.log_function_cache(self.network.function_cache)
 
     def get_q_values(self, state):
         """
@@ -280,21 +343,38 @@ class NeuralAgent(Agent):
         q_values = self.network.get_q_values(state)
         return q_values
 
+    def get_q_values_batch(self, states):
+        """
+        :description: returns the q values of several states with a single forward pass, 
+            shape = (N, A). Used for printing out the values of every state in the mdp.
+        """
+        agent_states = np.array([self.state_adapter.convert_state_to_agent_format(state) 
+            for state in states])
+        return self.network.get_q_values_batch(agent_states)
+
 class RecurrentNeuralAgent(Agent):
     """
     :description: A class that wraps a recuurent network so it may more easily 
         interact with an experiment. 
     """
-    def __init__(self, network, policy, replay_memory, state_adapter, log):
+    def __init__(self, network, policy, replay_memory, state_adapter, log, updates_per_step=1):
         self.network = network
         self.policy = policy
         self.replay_memory = replay_memory
+        self.updates_per_step = updates_per_step
         self.logger = log
-        self.logger.log_hyperparameters(network, policy, replay_memory)
+        self.logger.log_hyperparameters(network, policy, replay_memory, updates_per_step)
         self.state_adapter = state_adapter
 
         self.prev_state = None
         self.prev_action = None
+        # with a network that trains from stored recurrent states, the agent acts one step at a 
+        # time and keeps the recurrent state before the previous state and after it
+        self.stored_state = getattr(network, 'stored_state', False)
+        self.prev_hidden = None
+        self.hidden = None
+        # otherwise it chooses actions from the last states of the episode kept by the agent
+        self.observations = ObservationWindow(network.sequence_length, (network.input_shape, ))
         
     def step(self, next_state, reward):
         """
@@ -309,17 +389,20 @@ class RecurrentNeuralAgent(Agent):
         :type rval: int
         :param rval: returns the action to next be taken within the environment
         """
-        # need to transform an external state format to an internal one
-        next_state = self.state_adapter.convert_state_to_agent_format(next_state)
+        # need to transform an external state format to the one held by the replay memory 
+        # and the one used by the network
+        agent_state = self.state_adapter.convert_state_to_agent_format(next_state)
+        next_state = memory_format(self.replay_memory, self.state_adapter, next_state, agent_state)
 
         # store current (s,a,r,s') tuple
-        self.replay_memory.store(self.prev_state, self.prev_action, reward, terminal=False)
+        self.replay_memory.store(self.prev_state, self.prev_action, reward, terminal=False, 
+            **self.hidden_kwargs())
 
         # perform training
         self.train()
 
         # retrieve an action
-        action = self.get_action(next_state)
+        action = self.get_action(agent_state)
 
         # set previous values
         self.prev_state = next_state
@@ -333,40 +416,70 @@ class RecurrentNeuralAgent(Agent):
 
     def train(self):
         """
-        :description: collects a minibatch of experiences and passes them to the network to train
+        :description: collects updates_per_step minibatches of experiences and passes them to 
+            the network to train
         """
         # wait until replay memory has samples
         if not self.replay_memory.is_full():
             return
 
-        # collect minibatch
-        states, actions, rewards, next_states, terminals = self.replay_memory.sample_batch()
+        # collect minibatches, which may include values beyond (s,a,r,s',t) such as 
+        # importance sampling weights depending on the replay memory
+        for minibatch in sample_minibatches(self.replay_memory, self.updates_per_step):
+            batch = dict(zip(self.replay_memory.batch_fields, minibatch))
+            indices = batch.pop('indices', None)
 
-        # pass to network to perform training
-        loss = self.network.train(states, actions, rewards, next_states, terminals)
-        self.logger.log_loss(loss)
+            # pass to network to perform training
+            loss = self.network.train(**batch)
+            self.logger.log_loss(loss)
+
+            # feed the td errors back to a prioritized replay memory
+            if indices is not None:
+                self.replay_memory.update_priorities(indices, self.network.td_errors)
 
     def get_action(self, state):
         """
         :description: gets an action given the current state. Defers to the network for selecting the action.
 
         :type state: numpy array
-        :param state: the state used to determine the action
+        :param state: the state used to determine the action, in the agent format
         """
-        # wait until agent starts learning to use network to decide action
-        if not self.replay_memory.is_full():
-            return self.policy.random_action()
+        if self.stored_state:
+            return self.get_stepped_action(state)
+
+        # the window of the episode's last states is passed to the network as is, so the 
+        # network can decide from the first step rather than once the replay memory is full
+        self.observations.push(state)
+        q_values = self.network.get_q_values(self.observations.window())
+        return self.policy.choose_action(q_values)
 
-        sequence = self.replay_memory.make_last_sequence(state)
-        q_values = self.network.get_q_values(sequence)
+    def get_stepped_action(self, state):
+        """
+        :description: advances the recurrent state of the network by one step and chooses 
+            an action from the q values of that step
+        """
+        self.prev_hidden = self.hidden
+        q_values, self.hidden = self.network.step(state, self.hidden)
         return self.policy.choose_action(q_values)
 
+    def hidden_kwargs(self):
+        """
+        :description: the recurrent state to store along with the previous state, if any
+        """
+        if not self.stored_state:
+            return {}
+        return {'hidden': self.prev_hidden}
+
     def start_episode(self, state):
         """
         description: determines the first action to take and initializes internal variables
         """
-        self.prev_state = self.state_adapter.convert_state_to_agent_format(state)
-        self.prev_action = self.get_action(self.prev_state)
+        if self.stored_state:
+            self.hidden = np.zeros(self.network.state_size, dtype=theano.config.floatX)
+        self.observations.reset()
+        agent_state = self.state_adapter.convert_state_to_agent_format(state)
+        self.prev_state = memory_format(self.replay_memory, self.state_adapter, state, agent_state)
+        self.prev_action = self.get_action(agent_state)
 
         self.logger.log_action(self.prev_action)
         return self.prev_action
@@ -377,7 +490,8 @@ class RecurrentNeuralAgent(Agent):
             because the previous state must have been a terminal one. It's in the method
             definition to stay consistent with the other replay memory implementation.
         """
-        self.replay_memory.store(self.prev_state, self.prev_action, reward, True)
+        self.replay_memory.store(self.prev_state, self.prev_action, reward, True, 
+            **self.hidden_kwargs())
         self.logger.log_reward(reward)
         self.logger.finish_episode()
 
@@ -386,6 +500,17 @@ class RecurrentNeuralAgent(Agent):
         :description: perform tasks at the end of an epoch
         """
         self.logger.log_epoch(epoch, self.network, self.policy)
+        if hasattr(self.replay_memory, 'collect_stats'):
+            self.logger.log_replay_stats(epoch, self.replay_memory.collect_stats())
+
+    def finish_experiment(self):
+        """
+        :description: shuts down the replay memory, e.g., stops a prefetching thread, and 
+            logs how the network's functions were compiled
+        """
+        close_replay_memory(self.replay_memory, self.logger)
+        if getattr(self.network, 'function_cache', None) is not None:
+            self.logger.log_function_cache(self.network.function_cache)
 
     def get_q_values(self, state):
         """
@@ -394,4 +519,78 @@ class RecurrentNeuralAgent(Agent):
         state = self.state_adapter.convert_state_to_agent_format(state)
         q_values = self.network.get_logging_q_values(state)
         return q_values
+
+    def get_q_values_batch(self, states):
+        """
+        :description: returns the q values of several states with a single forward pass, each 
+            state being a sequence of one step as in get_q_values, shape = (N, A)
+        """
+        agent_states = np.array([self.state_adapter.convert_state_to_agent_format(state) 
+            for state in states])
+        return self.network.get_q_values_batch(agent_states[:, np.newaxis])
         
+
+def memory_format(replay_memory, state_adapter, state, agent_state=None):
+    """
+    :description: converts an mdp state to the format held by the replay memory. Compact 
+        memories store the raw mdp state and convert it only when sampling, others store 
+        the agent format, which is reused if already converted as agent_state.
+    """
+    if getattr(replay_memory, 'stores_raw_states', False):
+        return np.asarray(state)
+    if agent_state is not None:
+        return agent_state
+    return state_adapter.convert_state_to_agent_format(state)
+
+class ObservationWindow(object):
+    """
+    :description: the last sequence_length states of the current episode, oldest first and 
+        zero before its first state, from which a recurrent agent chooses actions. Each state 
+        is written twice, to its slot in a ring of sequence_length slots and sequence_length 
+        slots after it, so that the window ending at the latest state is always a contiguous 
+        slice of the buffer. Pushing a state takes constant time and the window is a view 
+        shaped (1, sequence_length, D) as expected by the network.
+    """
+
+    def __init__(self, sequence_length, state_shape):
+        self.sequence_length = sequence_length
+        self.buffer = np.zeros((1, 2 * sequence_length) + tuple(state_shape), 
+            dtype=theano.config.floatX)
+        self.position = 0
+
+    def reset(self):
+        self.buffer[...] = 0
+        self.position = 0
+
+    def push(self, state):
+        self.buffer[0, self.position] = state
+        self.buffer[0, self.position + self.sequence_length] = state
+        self.position = (self.position + 1) % self.sequence_length
+
+    def window(self):
+        return self.buffer[:, self.position:self.position + self.sequence_length]
+
+def sample_minibatches(replay_memory, num_batches):
+    """
+    :description: samples the minibatches for num_batches updates, drawing several of them 
+        with a single call to the memory's sample_batches
+    """
+    if num_batches == 1:
+        return [replay_memory.sample_batch()]
+    if not hasattr(replay_memory, 'sample_batches'):
+        # e.g., shared and deduplicating memories, whose minibatches share buffers, so each 
+        # one is only sampled once the previous one has been used
+        return (replay_memory.sample_batch() for _ in xrange(num_batches))
+    batches = replay_memory.sample_batches(num_batches)
+    return [tuple(values[k] for values in batches) for k in xrange(num_batches)]
+
+def close_replay_memory(replay_memory, log):
+    """
+    :description: closes a replay memory that holds resources and reports how often the 
+        learner waited on a prefetching memory
+    """
+    if hasattr(replay_memory, 'num_stalls') and log.verbose:
+        print 'Prefetch stalls: {} of {} batches ({:.1f} seconds)'.format(
+            replay_memory.num_stalls, replay_memory.num_batches, replay_memory.stall_time)
+    if hasattr(replay_memory, 'close'):
+        replay_memory.close()
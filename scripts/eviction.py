@@ -0,0 +1,120 @@
+"""
+:description: policies deciding which slot of a full ReplayMemory a new transition overwrites.
+    Each one works directly on the memory's arrays and takes constant (amortized) time per
+    stored transition. Policies are chosen by name through EVICTION_POLICIES.
+"""
+
+import numpy as np
+import random
+
+# fraction of the slots that RewardedEpisodeEviction keeps from being overwritten
+MAX_PROTECTED_FRACTION = .5
+
+class EvictionPolicy(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+    def choose_slot(self, replay_memory):
+        """
+        :description: returns the slot the new transition overwrites, or None if the new
+            transition should be discarded instead
+        """
+        raise NotImplementedError("Override me")
+
+    def stored(self, replay_memory, index):
+        """
+        :description: called after a transition has been written to a slot
+        """
+        pass
+
+class FifoEviction(EvictionPolicy):
+    """
+    :description: overwrites the oldest transition, which is the one at the memory's top
+    """
+
+    def choose_slot(self, replay_memory):
+        index = replay_memory.top
+        replay_memory.top = (replay_memory.top + 1) % self.capacity
+        return index
+
+class RandomEviction(EvictionPolicy):
+    """
+    :description: overwrites a uniformly sampled transition
+    """
+
+    def choose_slot(self, replay_memory):
+        return random.randint(0, self.capacity - 1)
+
+class ReservoirEviction(EvictionPolicy):
+    """
+    :description: reservoir sampling, the t-th transition is kept with probability capacity / t
+        in place of a uniformly sampled one, so the memory always holds a uniform sample of
+        every transition stored so far rather than favoring recent ones
+    """
+
+    def choose_slot(self, replay_memory):
+        num_seen = replay_memory.last_index + 1
+        index = random.randint(0, num_seen - 1)
+        if index >= self.capacity:
+            return None
+        return index
+
+class RewardedEpisodeEviction(EvictionPolicy):
+    """
+    :description: clock eviction that keeps the transitions of episodes in which a positive 
+        reward was received. A hand sweeps the slots in order and overwrites the first one that 
+        is not protected. Slots are protected when their episode receives a positive reward. 
+        At most MAX_PROTECTED_FRACTION of the slots stay protected, beyond that the hand 
+        unprotects the protected slots it passes, oldest first. Since at least the remaining 
+        fraction of the slots is unprotected, each eviction skips a bounded number of slots 
+        on average.
+    """
+
+    def __init__(self, capacity):
+        super(RewardedEpisodeEviction, self).__init__(capacity)
+        self.hand = 0
+        self.protected = np.zeros(capacity, dtype='bool')
+        self.num_protected = 0
+        self.max_protected = int(MAX_PROTECTED_FRACTION * capacity)
+        # slots of the episode in progress, kept as a ring since an episode may outgrow the memory
+        self.episode_slots = np.zeros(capacity, dtype='int64')
+        self.episode_length = 0
+        self.episode_rewarded = False
+
+    def choose_slot(self, replay_memory):
+        while self.protected[self.hand]:
+            if self.num_protected > self.max_protected:
+                self.protected[self.hand] = False
+                self.num_protected -= 1
+            self.hand = (self.hand + 1) % self.capacity
+        index = self.hand
+        self.hand = (self.hand + 1) % self.capacity
+        return index
+
+    def stored(self, replay_memory, index):
+        self.episode_slots[self.episode_length % self.capacity] = index
+        self.episode_length += 1
+
+        if self.episode_rewarded:
+            self.protect(np.array([index]))
+        elif replay_memory.rewards[index, 0] > 0:
+            # protect the steps leading up to the reward as well
+            self.episode_rewarded = True
+            self.protect(np.unique(self.episode_slots[:min(self.episode_length, self.capacity)]))
+
+        if replay_memory.terminals[index, 0]:
+            self.episode_length = 0
+            self.episode_rewarded = False
+
+    def protect(self, slots):
+        slots = slots[~self.protected[slots]]
+        self.protected[slots] = True
+        self.num_protected += len(slots)
+
+EVICTION_POLICIES = {
+    'fifo': FifoEviction,
+    'random': RandomEviction,
+    'reservoir': ReservoirEviction,
+    'rewarded_episodes': RewardedEpisodeEviction
+}
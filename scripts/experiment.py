@@ -61,6 +61,8 @@ class Experiment(object):
                 self.run_epoch(self.test_epoch_length)
                 self.agent.finish_testing(epoch)
 
+        self.agent.finish_experiment()
+
     def run_epoch(self, epoch, epoch_length):
         """
         :description: runs a single epoch
@@ -131,9 +133,12 @@ class Experiment(object):
         :description: collect the necessary components to print a representation of the optimal value 
             of each state in the mdp.
         """
-        V = {}
-        for state in self.mdp.states:
-            V[state] = np.max(self.agent.get_q_values(state))
+        states = list(self.mdp.states)
+        if hasattr(self.agent, 'get_q_values_batch'):
+            q_values = self.agent.get_q_values_batch(states)
+        else:
+            q_values = [self.agent.get_q_values(state) for state in states]
+        V = dict((state, np.max(values)) for state, values in zip(states, q_values))
         value_string = self.mdp.get_value_string(V)
         self.agent.logger.log_value_string(value_string)
         self.agent.logger.log_values(V)
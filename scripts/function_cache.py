@@ -0,0 +1,223 @@
+"""
+:description: a cache of compiled theano functions, so that a network identical to one built
+    before, earlier in the same process or in a previous one, does not optimize and compile
+    its functions again. Within a process, the function compiled for the first network is
+    copied with the shared variables of the next one swapped in. Functions are also pickled
+    to a directory along with their optimized graph, which is not optimized again when loaded.
+    Networks also defer compiling each function until it is first called (see LazyFunctions).
+"""
+import collections
+import hashlib
+import os
+import pickle
+import sys
+import time
+import warnings
+
+import theano
+from theano.compile.sharedvalue import SharedVariable
+
+# pickling the graph of a function recurses once per node along its longest path
+PICKLE_RECURSION_LIMIT = 50000
+
+class CompiledFunctionCache(object):
+    """
+    :description: compiled functions keyed by the settings of the network they belong to, the
+        name of the function and the theano flags that affect compilation. Pass the same cache
+        to every network that may be identical to another, e.g., across the runs of a sweep.
+    """
+
+    def __init__(self, directory=None):
+        """
+        :type directory: string
+        :param directory: if provided, directory on local disk in which compiled functions
+            are persisted, created if missing
+        """
+        self.directory = directory
+        if directory is not None and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.functions = {}
+        # seconds spent obtaining each function by where it came from, 'compiled', 'memory' or 'disk'
+        self.times = collections.defaultdict(list)
+
+    def function(self, settings, name, inputs, outputs, updates=None, givens=None):
+        """
+        :description: returns a function equivalent to theano.function(inputs, outputs,
+            updates=updates, givens=givens), reusing a function compiled for the same settings
+            and name if there is one
+
+        :type settings: dict
+        :param settings: everything the graph of the function depends on besides the theano
+            flags, e.g., the shapes, network type and update rule of the network
+
+        :type name: string
+        :param name: name of the function within the network
+        """
+        updates = list(updates.items()) if isinstance(updates, dict) else list(updates or [])
+        givens = sorted((givens or {}).items(), key=lambda item: item[0].name)
+        variables = graph_shared_variables(outputs, updates, givens)
+        key = cache_key(settings, name)
+
+        start = time.time()
+        source = 'memory'
+        entry = self.functions.get(key)
+        if entry is None:
+            source = 'disk'
+            entry = self.load(key)
+        if entry is None:
+            fn = theano.function(inputs, outputs, updates=updates, givens=givens)
+            positions = shared_positions(fn, variables)
+            if positions is not None:
+                self.functions[key] = (fn, positions)
+                self.save(key, (fn, positions))
+            self.times['compiled'].append(time.time() - start)
+            return fn
+
+        self.functions[key] = entry
+        template, positions = entry
+        swap = dict((shared, variables[position])
+            for shared, position in zip(template.get_shared(), positions))
+        fn = template.copy(swap=swap)
+        # copying or unpickling a function drops whether it returns its single output as is
+        # rather than in a list, which theano.function decides from the type of outputs
+        fn.unpack_single = not isinstance(outputs, (list, tuple))
+        fn.return_none = outputs is None
+        self.times[source].append(time.time() - start)
+        return fn
+
+    def filepath(self, key):
+        return os.path.join(self.directory, '{}.pkl'.format(key))
+
+    def load(self, key):
+        """
+        :description: loads a function persisted to disk without optimizing its graph again,
+            or returns None if there is none
+        """
+        if self.directory is None or not os.path.exists(self.filepath(key)):
+            return None
+
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(self.filepath(key), 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            warnings.warn('unable to load compiled function {}: {}'.format(key, e))
+            return None
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
+
+    def save(self, key, entry):
+        """
+        :description: persists a function to disk, writing to a temporary file first so that
+            a concurrent load never reads a partial one
+        """
+        if self.directory is None:
+            return
+
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, PICKLE_RECURSION_LIMIT))
+        temp_filepath = '{}.{}.tmp'.format(self.filepath(key), os.getpid())
+        try:
+            with open(temp_filepath, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_filepath, self.filepath(key))
+        except Exception as e:
+            warnings.warn('unable to save compiled function {}: {}'.format(key, e))
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    def summary(self):
+        """
+        :description: the number of functions obtained and the seconds spent doing so, by
+            whether they were compiled, copied from memory or loaded from disk
+        """
+        return dict((source, (len(times), sum(times))) for source, times in self.times.items())
+
+    def report(self):
+        """
+        :description: a line comparing the time spent compiling with the time spent on cache hits
+        """
+        summary = self.summary()
+        return ', '.join('{} {} functions in {:.2f}s'.format(source, *summary.get(source, (0, 0.)))
+            for source in ('compiled', 'memory', 'disk'))
+
+class LazyFunctions(object):
+    """
+    :description: base class of the networks, whose theano functions are compiled the first time
+        they are called rather than when the network is built, so that, e.g., a network loaded
+        to render a value heat map never compiles its training function
+    """
+
+    def defer(self, attribute, compile_fn):
+        """
+        :description: sets the attribute to the function returned by compile_fn() when the
+            attribute is first accessed. Symbolic values that only compiled functions use, such
+            as the updates of training, may be deferred the same way.
+
+        :type compile_fn: function
+        :param compile_fn: takes no arguments and returns the compiled function
+        """
+        self.__dict__.setdefault('deferred_functions', {})[attribute] = compile_fn
+
+    def __getattr__(self, attribute):
+        # only called for attributes that are not set yet, which includes the deferred functions
+        deferred = self.__dict__.get('deferred_functions', {})
+        if attribute not in deferred:
+            raise AttributeError(attribute)
+        fn = deferred.pop(attribute)()
+        setattr(self, attribute, fn)
+        return fn
+
+    def compiled(self, attribute):
+        """
+        :description: whether the deferred function of the attribute has been compiled
+        """
+        return attribute in self.__dict__
+
+def compile_function(cache, settings, name, inputs, outputs, updates=None, givens=None):
+    """
+    :description: compiles a theano function through cache, or directly if cache is None
+    """
+    if cache is None:
+        return theano.function(inputs, outputs, updates=updates, givens=givens)
+    return cache.function(settings, name, inputs, outputs, updates, givens)
+
+def cache_key(settings, name):
+    """
+    :description: a digest of the settings, the name of the function and the theano flags and
+        version that affect the compiled function
+    """
+    flags = (theano.__version__, theano.config.floatX, theano.config.device, theano.config.mode,
+        theano.config.optimizer)
+    description = repr((sorted(settings.items()), name, flags))
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+def graph_shared_variables(outputs, updates, givens):
+    """
+    :description: the shared variables a function reads or updates, in an order that only
+        depends on how its graph was built, so that it is the same for identical networks
+    """
+    outputs = outputs if isinstance(outputs, (list, tuple)) else [outputs]
+    roots = list(outputs) + [value for _, value in updates] + [value for _, value in givens] \
+        + [variable for variable, _ in updates]
+    variables = []
+    for variable in theano.gof.graph.inputs(roots):
+        if isinstance(variable, SharedVariable) and not any(variable is v for v in variables):
+            variables.append(variable)
+    return variables
+
+def shared_positions(fn, variables):
+    """
+    :description: the position in variables of each shared variable of a compiled function,
+        or None if one of them is not among variables and the function cannot be reused
+    """
+    positions = []
+    for shared in fn.get_shared():
+        matches = [position for position, variable in enumerate(variables) if variable is shared]
+        if len(matches) == 0:
+            return None
+        positions.append(matches[0])
+    return positions
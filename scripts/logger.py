@@ -260,6 +260,8 @@ class NeuralLogger(Logger):
         self.weight_magnitudes = []
         self.weight_variances = []
         self.exploration_probs = []
+        self.compression_ratios = []
+        self.replay_stats = collections.defaultdict(lambda: [])
 
     def log_epoch(self, epoch, network, policy):
 
@@ -318,6 +320,59 @@ class NeuralLogger(Logger):
         self.weight_variances.append(np.mean(variances))
         self.record_stat('weight_variances', self.weight_variances, epoch)
 
+    def log_compression_ratio(self, epoch, compression_ratio):
+        """
+        :description: records how many transitions a deduplicating replay memory represents 
+            per unique transition it stores
+        """
+        if not self.logging:
+            return
+
+        self.compression_ratios.append(compression_ratio)
+        self.record_stat('compression_ratios', self.compression_ratios, epoch)
+        if self.verbose:
+            print 'Replay compression ratio: {:.2f}'.format(compression_ratio)
+
+    def log_replay_stats(self, epoch, stats):
+        """
+        :description: records the statistics of an instrumented replay memory for the epoch 
+            (see replay_stats.py). Scalars are saved and plotted across epochs, the histogram 
+            of sample ages is only saved.
+        """
+        if not self.logging:
+            return
+
+        for name, value in sorted(stats.items()):
+            self.replay_stats[name].append(value)
+            if name == 'age_histogram':
+                self.save_stat('replay_age_histograms', self.replay_stats[name], epoch)
+            else:
+                self.record_stat('replay_{}'.format(name), self.replay_stats[name], epoch)
+
+        if self.verbose:
+            print 'Replay fill: {:.2f} ({} bytes), sample time: {:.3f} ms (max {:.3f} ms)'.format(
+                stats['fill_level'], stats['bytes_used'], stats['mean_sample_ms'], 
+                stats['max_sample_ms'])
+            print 'Sampled terminal: {:.3f}, rewarded: {:.3f}'.format(stats['terminal_fraction'], 
+                stats['rewarded_fraction'])
+
+    def log_function_cache(self, function_cache):
+        """
+        :description: records the time spent compiling theano functions against the time spent 
+            on cache hits. Functions are compiled the first time they are called, so this is 
+            logged once the experiment is over rather than along with the hyperparameters.
+        """
+        if not self.logging:
+            return
+
+        if self.log_dir is None:
+            self.create_log_dir()
+        report = function_cache.report()
+        with open(os.path.join(self.log_dir, 'function_cache.txt'), 'wb') as f:
+            f.write('{}\n'.format(report))
+        if self.verbose:
+            print 'Function cache: {}'.format(report)
+
     def record_policy(self, epoch, policy):
         self.exploration_probs.append(policy.exploration_prob)
         self.record_stat('exploration_probs', self.exploration_probs, epoch)
@@ -326,7 +381,7 @@ class NeuralLogger(Logger):
         for trajectory in self.episode_actions:
             mdp.print_trajectory(trajectory)
 
-    def log_hyperparameters(self, network, policy, replay_memory):
+    def log_hyperparameters(self, network, policy, replay_memory, updates_per_step=1):
         if self.log_dir is None:
             self.create_log_dir()
 
@@ -341,6 +396,8 @@ class NeuralLogger(Logger):
         hyperparameters['regularization'] = network.regularization
         hyperparameters['update_rule'] = network.update_rule
         hyperparameters['freeze_interval'] = network.freeze_interval
+        if getattr(network, 'tau', None) is not None:
+            hyperparameters['tau'] = network.tau
         hyperparameters['replay_memory_capacity'] = replay_memory.capacity
         hyperparameters['actions_until_min'] = policy.actions_until_min
         hyperparameters['epsilon'] = policy.exploration_prob
@@ -348,6 +405,24 @@ class NeuralLogger(Logger):
             hyperparameters['network_type'] = network.network_type
         if hasattr(replay_memory, 'sequence_length'):
             hyperparameters['sequence_length'] = replay_memory.sequence_length
+        if getattr(network, 'stored_state', False):
+            hyperparameters['stored_state'] = True
+            hyperparameters['burn_in'] = network.burn_in
+        if getattr(network, 'target_cache', None) is not None:
+            hyperparameters['target_cache_size'] = network.target_cache.size
+        if hasattr(replay_memory, 'alpha'):
+            hyperparameters['priority_alpha'] = replay_memory.alpha
+            hyperparameters['priority_beta'] = replay_memory.beta
+        if hasattr(replay_memory, 'rare_fraction'):
+            hyperparameters['rare_fraction'] = replay_memory.rare_fraction
+        if hasattr(replay_memory, 'eviction'):
+            hyperparameters['eviction'] = replay_memory.eviction
+        if getattr(replay_memory, 'n_step', 1) > 1:
+            hyperparameters['n_step'] = replay_memory.n_step
+        if hasattr(replay_memory, 'queue_depth'):
+            hyperparameters['prefetch_queue_depth'] = replay_memory.queue_depth
+        if updates_per_step > 1:
+            hyperparameters['updates_per_step'] = updates_per_step
 
         with open(filepath, 'wb') as f:
             for k, v in hyperparameters.iteritems():
@@ -0,0 +1,158 @@
+import numpy as np
+import Queue
+import threading
+import time
+
+DEFAULT_QUEUE_DEPTH = 4
+# seconds the background thread waits on a full queue before checking whether to stop
+PUT_TIMEOUT = .1
+
+class PrefetchingReplayMemory(object):
+    """
+    :description: wraps a replay memory and samples minibatches from it in a background thread,
+        keeping a bounded queue of batches ready so that the learner does not wait on sampling.
+        The wrapped memory is guarded by a lock since the agent keeps storing into it while
+        batches are sampled. Batches are those returned by the wrapped memory's sample_batch,
+        so their states are already cast to floatX. A batch stays valid until the learner
+        takes the next one.
+    """
+
+    def __init__(self, replay_memory, queue_depth=DEFAULT_QUEUE_DEPTH):
+        """
+        :type replay_memory: replay memory class (see replay_memory.py)
+        :param replay_memory: the memory from which to sample minibatches
+
+        :type queue_depth: int
+        :param queue_depth: maximum number of minibatches sampled ahead of time
+        """
+        self.replay_memory = replay_memory
+        self.batch_fields = replay_memory.batch_fields
+        self.queue_depth = queue_depth
+        self.batches = Queue.Queue(maxsize=queue_depth)
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # batches are written to reusable buffers, so keep enough sets of them that the queued
+        # batches, the one being sampled and the one the learner trains on are all distinct
+        if hasattr(replay_memory, 'batch_buffers'):
+            replay_memory.batch_buffers.num_sets = queue_depth + 2
+
+        # how many batches the learner took and how often and how long it waited for one
+        self.num_batches = 0
+        self.num_stalls = 0
+        self.stall_time = 0.
+
+    def __getattr__(self, name):
+        # everything not defined by the prefetcher, e.g., capacity, is read from the wrapped memory
+        if name == 'replay_memory':
+            raise AttributeError(name)
+        return getattr(self.replay_memory, name)
+
+    def store(self, *args, **kwargs):
+        with self.lock:
+            return self.replay_memory.store(*args, **kwargs)
+
+    def is_full(self):
+        with self.lock:
+            return self.replay_memory.is_full()
+
+    def make_last_sequence(self, next_state):
+        with self.lock:
+            return self.replay_memory.make_last_sequence(next_state)
+
+    def update_priorities(self, indices, td_errors):
+        with self.lock:
+            self.replay_memory.update_priorities(indices, td_errors)
+
+    def start(self):
+        """
+        :description: starts the background sampling thread
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.prefetch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def prefetch(self):
+        """
+        :description: loop run by the background thread, samples batches until stopped. An
+            exception raised while sampling is passed through the queue to the learner.
+        """
+        while not self.stop_event.is_set():
+            try:
+                with self.lock:
+                    batch = self.replay_memory.sample_batch()
+            except Exception as e:
+                batch = e
+
+            while not self.stop_event.is_set():
+                try:
+                    self.batches.put(batch, timeout=PUT_TIMEOUT)
+                    break
+                except Queue.Full:
+                    pass
+
+            if isinstance(batch, Exception):
+                return
+
+    def sample_batch(self):
+        """
+        :description: returns the next prefetched minibatch, starting the background thread
+            on the first call and waiting if no batch is ready
+        """
+        if self.thread is None:
+            self.start()
+
+        try:
+            batch = self.batches.get_nowait()
+        except Queue.Empty:
+            self.num_stalls += 1
+            start = time.time()
+            batch = self.batches.get()
+            self.stall_time += time.time() - start
+
+        if isinstance(batch, Exception):
+            raise batch
+
+        self.num_batches += 1
+        return batch
+
+    def sample_batches(self, num_batches):
+        """
+        :description: takes the next num_batches prefetched minibatches and stacks each of their 
+            values along a new leading axis. Each minibatch is copied as soon as it is taken, 
+            since its buffers may be reused by the background thread once the next one is.
+        """
+        stacked = None
+        for k in range(num_batches):
+            batch = self.sample_batch()
+            if stacked is None:
+                stacked = [np.empty((num_batches, ) + np.shape(values), dtype=np.asarray(values).dtype) 
+                    for values in batch]
+            for values, stacked_values in zip(batch, stacked):
+                stacked_values[k] = values
+        return tuple(stacked)
+
+    def stall_fraction(self):
+        """
+        :description: fraction of minibatches for which the learner had to wait
+        """
+        if self.num_batches == 0:
+            return 0.
+        return self.num_stalls / float(self.num_batches)
+
+    def close(self):
+        """
+        :description: stops the background thread, discards the batches still queued and 
+            closes the wrapped memory if it holds resources of its own
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+            while not self.batches.empty():
+                self.batches.get_nowait()
+
+        if hasattr(self.replay_memory, 'close'):
+            self.replay_memory.close()
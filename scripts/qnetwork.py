@@ -4,17 +4,20 @@
     ConvQNetwork that implements the network with convolutional layers.
 """
 
+import collections
 import lasagne
 from lasagne.regularization import regularize_network_params, l2
 import numpy as np
 import theano
 import theano.tensor as T
 
+import function_cache
 import learning_utils
+import target_cache
 
-class QNetwork(object):
+class QNetwork(function_cache.LazyFunctions):
 
-    def __init__(self, input_shape, batch_size, num_hidden_layers, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, rng):
+    def __init__(self, input_shape, batch_size, num_hidden_layers, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, rng, target_cache_size=None, tau=None, function_cache=None, inference_only=False):
         """
         :type input_shape: int
         :param input_shape: the dimension of the input representation of the state
@@ -49,6 +52,25 @@ class QNetwork(object):
         :type rng: rng
         :param rng: rng for running deterministically, o/w just leave as None
 
+        :type target_cache_size: int
+        :param target_cache_size: if provided, the bootstrapped values of the target network are 
+            cached in this many entries between target resets, keyed by the transition ids of 
+            the minibatches, which requires a replay memory created with transition_ids=True
+
+        :type tau: float
+        :param tau: if provided, the target network tracks the network with the soft update 
+            theta_target <- tau * theta + (1 - tau) * theta_target applied by every training 
+            update, instead of being reset every freeze_interval updates
+
+        :type function_cache: CompiledFunctionCache (see function_cache.py)
+        :param function_cache: if provided, the theano functions are reused from identical 
+            networks built before rather than compiled again
+
+        :type inference_only: bool
+        :param inference_only: if True, only the function getting q values is built, without 
+            the target network, the training inputs or the optimizer state, e.g., to evaluate 
+            a policy from saved params. Such a network cannot be trained.
+
         :example call: 
         network = qnetwork.QNetwork(input_shape=20, batch_size=64, num_hidden_layers=2, num_actions=4, 
             num_hidden=4, discount=1, learning_rate=1e-3, regularization=1e-4, 
@@ -66,10 +88,21 @@ class QNetwork(object):
         self.update_rule = update_rule
         self.freeze_interval = freeze_interval
         self.rng = rng if rng else np.random.RandomState()
+        self.tau = tau
+        self.function_cache = function_cache
+        self.inference_only = inference_only
+        self.target_cache = None
+        if target_cache_size is not None:
+            if inference_only:
+                raise ValueError('an inference only network has no target network to cache')
+            if tau is not None:
+                raise ValueError('a target cache requires a frozen target network, not soft updates')
+            self.target_cache = target_cache.TargetValueCache(target_cache_size)
         self.initialize_network()
         self.update_counter = 0
 
-    def train(self, states, actions, rewards, next_states, terminals):
+    def train(self, states, actions, rewards, next_states, terminals, weights=None, discounts=None, 
+            transition_ids=None):
         """
         :description: Perform a q-learning update using the (s,a,r,s') tuples provided
 
@@ -90,6 +123,21 @@ class QNetwork(object):
         :param terminals: whether the corresponding state was a terminal state. If so, this
                             will cause the max_a' Q(s',a') term to be zero in the q-learning loss.
 
+        :type weights: np.array(dtype=theano.config.floatX)
+        :param weights: optional importance sampling weights scaling the loss of each sample, 
+                        shape = (N,1). The absolute td error of each sample is kept in 
+                        self.td_errors so that a prioritized replay memory can be updated.
+
+        :type discounts: np.array(dtype=theano.config.floatX)
+        :param discounts: optional discount applied to the bootstrapped value of each sample, 
+                        shape = (N,1), e.g., discount ** n for n-step returns. Defaults to 
+                        self.discount for every sample.
+
+        :type transition_ids: np.array(dtype='int64')
+        :param transition_ids: optional ids of the transitions whose next states are in 
+                        next_states, shape = (N,). With a target cache, only the next states 
+                        whose value is not cached are forwarded through the target network.
+
         :example call:
         states = np.array([[1,0],[0,1]])
         actions = np.array([1,1])
@@ -99,20 +147,107 @@ class QNetwork(object):
         network.train(states, actions, rewards, next_states, terminals)
 
         """
+        if self.inference_only:
+            raise ValueError('the network was built for inference only and cannot be trained')
 
-        if self.update_counter % self.freeze_interval == 0:
+        if self.tau is None and self.update_counter % self.freeze_interval == 0:
             self.reset_target_network()
         self.update_counter += 1
 
-        self.states_shared.set_value(states)
-        self.actions_shared.set_value(actions.astype('int32'))
-        self.rewards_shared.set_value(rewards)
-        self.next_states_shared.set_value(next_states)
-        self.terminals_shared.set_value(terminals.astype('int32'))
-
-        loss, q_values = self._train()
+        # the replay memories already provide floatX and int32 arrays of the expected shapes, 
+        # so the uploads below neither cast nor copy them
+        self.states_shared.set_value(states, borrow=True)
+        self.actions_shared.set_value(np.asarray(actions, dtype='int32'), borrow=True)
+        self.rewards_shared.set_value(rewards, borrow=True)
+        if self.target_cache is not None:
+            self.next_values_shared.set_value(self.get_next_values(next_states, transition_ids), 
+                borrow=True)
+        else:
+            self.next_states_shared.set_value(next_states, borrow=True)
+        self.terminals_shared.set_value(np.asarray(terminals, dtype='int32'), borrow=True)
+        self.weights_shared.set_value(weights if weights is not None else self.unit_weights, 
+            borrow=True)
+        self.discounts_shared.set_value(discounts if discounts is not None else self.unit_discounts, 
+            borrow=True)
+
+        loss, q_values, self.td_errors = self._train()
         return loss
 
+    def train_batches(self, states, actions, rewards, next_states, terminals, weights=None, 
+            discounts=None, transition_ids=None):
+        """
+        :description: Perform one q-learning update per minibatch of a stack of K minibatches, 
+                        e.g., as returned by a replay memory's sample_batches, in a single call 
+                        to a compiled scan over the minibatches rather than K calls to train. 
+                        The updates and target resets are those of K calls to train. Returns 
+                        the loss of each update, shape = (K,), and keeps the absolute td errors 
+                        of each minibatch in self.td_errors, shape = (K,N).
+
+        :type states: np.array(dtype=theano.config.floatX)
+        :param states: minibatches of states, shape (K,N,D); the other values are those of 
+                        train with the same leading axis of K minibatches
+
+        :example call:
+        batch = dict(zip(rm.batch_fields, rm.sample_batches(8)))
+        batch.pop('indices', None)
+        losses = network.train_batches(**batch)
+        """
+        if self.inference_only:
+            raise ValueError('the network was built for inference only and cannot be trained')
+
+        num_batches = len(states)
+        actions = np.asarray(actions, dtype='int32')
+        terminals = np.asarray(terminals, dtype='int32')
+        if weights is None:
+            weights = np.ones((num_batches,) + self.unit_weights.shape, dtype=theano.config.floatX)
+        if discounts is None:
+            discounts = np.tile(self.unit_discounts, (num_batches, 1, 1))
+
+        # the minibatches are split where the target network is reset, i.e., before the 
+        # updates whose count is a multiple of freeze_interval
+        losses, td_errors = [], []
+        start = 0
+        while start < num_batches:
+            end = num_batches
+            if self.tau is None:
+                if self.update_counter % self.freeze_interval == 0:
+                    self.reset_target_network()
+                # freeze_interval may be given as a float, e.g., 1e5
+                remaining = int(self.freeze_interval - self.update_counter % self.freeze_interval)
+                end = min(end, start + remaining)
+            self.update_counter += end - start
+
+            if self.target_cache is not None:
+                # the target network is fixed until the next reset, so the bootstrapped values 
+                # of all the minibatches before it are looked up at once
+                ids = transition_ids[start:end].reshape(-1) if transition_ids is not None else None
+                next_values = self.get_next_values(
+                    next_states[start:end].reshape((-1,) + next_states.shape[2:]), ids)
+                next_inputs = next_values.reshape((end - start, -1, 1))
+            else:
+                next_inputs = next_states[start:end]
+
+            segment_losses, segment_td_errors = self._train_batches(states[start:end], 
+                actions[start:end], rewards[start:end], next_inputs, terminals[start:end], 
+                weights[start:end], discounts[start:end])
+            losses.append(segment_losses)
+            td_errors.append(segment_td_errors)
+            start = end
+
+        self.td_errors = np.concatenate(td_errors)
+        return np.concatenate(losses)
+
+    def get_next_values(self, next_states, transition_ids=None):
+        """
+        :description: Returns the bootstrapped values max_a' Q_target(s',a') of a batch of next 
+                        states as a (N,1) column. Values cached since the last target reset are 
+                        reused if transition_ids are provided.
+        """
+        if transition_ids is None:
+            return self._next_values(next_states)
+        return self.target_cache.get(transition_ids, 
+            lambda misses: self._next_values(next_states[misses]))
+
     def get_q_values(self, state):
         """
         :description: Returns the q_values associated with a single state for the purposes of 
@@ -125,17 +260,29 @@ class QNetwork(object):
         state = np.array([1,2])
         network.get_q_values(state)
         """
-        # create a fake batch
-        states = np.zeros((self.batch_size, self.input_shape), dtype=theano.config.floatX)
-
-        # set the first item in that batch to the passed in state and set the shared variables
-        states[0] = state
-        self.states_shared.set_value(states)
-
-        # do a forward pass using the theano function 'get_q_values' and index and return the first item
+        # a batch of one state is passed through the inference input, which leaves the 
+        # training inputs untouched
+        self.single_state[0] = state
+        self.inference_states_shared.set_value(self.single_state, borrow=True)
         q_values = self._get_q_values()[0]
         return q_values
 
+    def get_q_values_batch(self, states):
+        """
+        :description: Returns the q_values of any number of states at once, e.g., to evaluate 
+                        a whole state space for logging.
+
+        :type states: np.array(dtype=theano.config.floatX)
+        :param states: states to compute q_values for, shape = (N,D)
+
+        :example call:
+        states = np.array([[1,2],[2,1]])
+        network.get_q_values_batch(states)
+        """
+        self.inference_states_shared.set_value(np.asarray(states, dtype=theano.config.floatX), 
+            borrow=True)
+        return self._get_q_values()
+
     def get_params(self):
         """
         :description: Return a numpy array containing all of the parameters of the network. 
@@ -149,14 +296,16 @@ class QNetwork(object):
                     loading saved weights.
         """
         lasagne.layers.set_all_param_values(self.l_out, params)
-        self.reset_target_network()
+        if not self.inference_only:
+            self.reset_target_network()
 
     def reset_target_network(self):
         """
         :description: Set the target weights to the current weights.
         """
-        all_params = lasagne.layers.helper.get_all_param_values(self.l_out)
-        lasagne.layers.helper.set_all_param_values(self.next_l_out, all_params)
+        self._reset_target_network()
+        if self.target_cache is not None:
+            self.target_cache.invalidate()
 
     def finish_episode(self):
         pass
@@ -167,78 +316,153 @@ class QNetwork(object):
 
     def initialize_network(self):
         """
-        :description: this method initializes the network, updates, and theano functions for training and 
-            retrieving q values. Here's an outline: 
-
-            1. build the q network and target q network
-            2. initialize theano symbolic variables used for compiling functions
-            3. initialize the theano numeric variables used as input to functions
-            4. formulate the symbolic loss 
-            5. formulate the symbolic updates 
-            6. compile theano functions for training and for getting q_values
+        :description: this method initializes the network, updates, and theano functions for training and
+            retrieving q values. Each theano function is only compiled the first time it is called
+            (see function_cache.LazyFunctions). Here's an outline:
+
+            1. build the q network and the function for getting q_values
+            2. unless the network is inference only, build the target q network
+            3. initialize theano symbolic variables used for compiling functions
+            4. initialize the theano numeric variables used as input to functions
+            5. formulate the symbolic loss
+            6. formulate the symbolic updates and the training function, when it is first called
+            7. formulate the training function performing several updates in one call
         """
         batch_size, input_shape = self.batch_size, self.input_shape
         lasagne.random.set_rng(self.rng)
 
-        # 1. build the q network and target q network
+        # 1. build the q network and the function for getting q_values
         self.l_out = self.build_network(input_shape, self.num_actions, batch_size)
+        states = T.matrix('states')
+        # input of the inference function, whose batch dimension is symbolic, and the batch
+        # of one reused to get the q values of a single state
+        self.inference_states_shared = theano.shared(np.zeros((1, input_shape),
+            dtype=theano.config.floatX))
+        self.single_state = np.zeros((1, input_shape), dtype=theano.config.floatX)
+        q_vals = lasagne.layers.get_output(self.l_out, states)
+        self.defer('_get_q_values', lambda: self.compile_function('get_q_values', [], q_vals,
+            givens={states: self.inference_states_shared}))
+        if self.inference_only:
+            return
+
+        # 2. build the target q network, starting from a copy of the weights that is made on
+        # the host since no function has been compiled yet. Later resets assign the target
+        # weights on the device, without a round trip through the host
         self.next_l_out = self.build_network(input_shape, self.num_actions, batch_size)
-        self.reset_target_network()
+        lasagne.layers.set_all_param_values(self.next_l_out, self.get_params())
+        self.defer('_reset_target_network', lambda: self.compile_function('reset_target_network',
+            [], [], updates=target_network_updates(self.l_out, self.next_l_out)))
 
-        # 2. initialize theano symbolic variables used for compiling functions
-        states = T.matrix('states')
+        # 3. initialize theano symbolic variables used for compiling functions
         actions = T.icol('actions')
         rewards = T.col('rewards')
         next_states = T.matrix('next_states')
         # terminals are used to indicate a terminal state in the episode and hence a mask over the future
         # q values i.e., Q(s',a')
         terminals = T.icol('terminals')
-
-        # 3. initialize the theano numeric variables used as input to functions
+        # importance sampling weights scaling the loss of each sample
+        weights = T.col('weights')
+        # discount of the bootstrapped value of each sample, which depends on its number of steps
+        discounts = T.col('discounts')
+        # max_a' Q(s',a') of each sample, passed in when it is looked up in the target cache
+        next_values = T.col('next_values')
+
+        # 4. initialize the theano numeric variables used as input to functions
         self.states_shared = theano.shared(np.zeros((batch_size, input_shape), dtype=theano.config.floatX))
         self.next_states_shared = theano.shared(np.zeros((batch_size, input_shape), dtype=theano.config.floatX))
-        self.rewards_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX), 
+        self.rewards_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX),
             broadcastable=(False, True))
         self.actions_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
             broadcastable=(False, True))
         self.terminals_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
             broadcastable=(False, True))
+        self.unit_weights = np.ones((batch_size, 1), dtype=theano.config.floatX)
+        self.weights_shared = theano.shared(self.unit_weights, broadcastable=(False, True))
+        self.unit_discounts = np.ones((batch_size, 1), dtype=theano.config.floatX) * self.discount
+        self.discounts_shared = theano.shared(self.unit_discounts, broadcastable=(False, True))
+        self.next_values_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX),
+            broadcastable=(False, True))
 
-        # 4. formulate the symbolic loss 
-        q_vals = lasagne.layers.get_output(self.l_out, states)
+        # 5. formulate the symbolic loss
         next_q_vals = lasagne.layers.get_output(self.next_l_out, next_states)
+        max_next_q_vals = T.max(next_q_vals, axis=1, keepdims=True)
+        # with a target cache, the forward pass of the target network happens outside of training
+        bootstrapped_values = next_values if self.target_cache is not None else max_next_q_vals
         target = (rewards +
                  (T.ones_like(terminals) - terminals) *
-                  self.discount * T.max(next_q_vals, axis=1, keepdims=True))
+                  discounts * bootstrapped_values)
         # reshape((-1,)) == 'make a row vector', reshape((-1, 1) == 'make a column vector'
         diff = target - q_vals[T.arange(batch_size), actions.reshape((-1,))].reshape((-1, 1))
 
         # a lot of the recent work clips the td error at 1 so we do that here
         # the problem is that gradient backpropagating through this minimum node
         # will be zero if diff is larger then 1.0 (because changing params before
-        # the minimum does not impact the output of the minimum). To account for 
+        # the minimum does not impact the output of the minimum). To account for
         # this we take the part of the td error (magnitude) greater than 1.0 and simply
         # add it to the loss, which allows gradient to backprop but just linearly
         # in the td error rather than quadratically
         quadratic_part = T.minimum(abs(diff), 1.0)
         linear_part = abs(diff) - quadratic_part
         loss = 0.5 * quadratic_part ** 2 + linear_part
-        loss = T.sum(loss) + self.regularization * regularize_network_params(self.l_out, l2)
-        
-        # 5. formulate the symbolic updates 
-        params = lasagne.layers.helper.get_all_params(self.l_out)  
-        updates = self.initialize_updates(self.update_rule, loss, params, self.learning_rate)
+        loss = T.sum(weights * loss) + self.regularization * regularize_network_params(self.l_out, l2)
+        td_errors = abs(diff).reshape((-1,))
 
-        # 6. compile theano functions for training and for getting q_values
+        # takes any number of next states, e.g., only those missing from the target cache
+        self.defer('_next_values', lambda: self.compile_function('next_values', [next_states],
+            max_next_q_vals))
+
+        # 6. formulate the symbolic updates and the training function, when it is first called,
+        # so that the optimizer state is only allocated once training starts
         givens = {
             states: self.states_shared,
-            next_states: self.next_states_shared,
             rewards: self.rewards_shared,
             actions: self.actions_shared,
-            terminals: self.terminals_shared
+            terminals: self.terminals_shared,
+            weights: self.weights_shared,
+            discounts: self.discounts_shared
         }
-        self._train = theano.function([], [loss, q_vals], updates=updates, givens=givens)
-        self._get_q_values = theano.function([], q_vals, givens={states: self.states_shared})
+        if self.target_cache is not None:
+            givens[next_values] = self.next_values_shared
+        else:
+            givens[next_states] = self.next_states_shared
+
+        def formulate_updates():
+            params = lasagne.layers.helper.get_all_params(self.l_out)
+            updates = self.initialize_updates(self.update_rule, loss, params, self.learning_rate)
+            if self.tau is not None:
+                updates.update(target_network_updates(self.l_out, self.next_l_out, self.tau))
+            return updates
+        self.defer('train_updates', formulate_updates)
+        self.defer('_train', lambda: self.compile_function('train', [], [loss, q_vals, td_errors],
+            updates=self.train_updates, givens=givens))
+
+        # 7. the function training on a stack of minibatches scans over them with the same 
+        # updates and optimizer state, also compiled when it is first called
+        minibatch = [states, actions, rewards, 
+            next_values if self.target_cache is not None else next_states, 
+            terminals, weights, discounts]
+        self.defer('_train_batches', lambda: self.compile_function('train_batches', 
+            *scan_updates(minibatch, [loss, td_errors], self.train_updates)))
+
+    def compile_function(self, name, inputs, outputs, updates=None, givens=None):
+        """
+        :description: compiles one of the theano functions of the network, through the function 
+            cache if the network has one
+        """
+        return function_cache.compile_function(self.function_cache, self.function_settings(), name, 
+            inputs, outputs, updates, givens)
+
+    def function_settings(self):
+        """
+        :description: the settings that the graphs of the theano functions depend on, which 
+            identify them in a function cache
+        """
+        return {'network': 'QNetwork', 'input_shape': self.input_shape, 
+            'batch_size': self.batch_size, 'num_hidden_layers': self.num_hidden_layers, 
+            'num_actions': self.num_actions, 'num_hidden': self.num_hidden, 
+            'discount': self.discount, 'learning_rate': self.learning_rate, 
+            'regularization': self.regularization, 'update_rule': self.update_rule, 
+            'tau': self.tau, 'target_cache': self.target_cache is not None}
 
     def initialize_updates(self, update_rule, loss, params, learning_rate):
         """
@@ -295,7 +519,7 @@ class ConvQNetwork(object):
                 layers and therefore requires some different input shape details. 
     """
 
-    def __init__(self, input_shape, batch_size, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, rng):
+    def __init__(self, input_shape, batch_size, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, rng, tau=None):
         self.input_shape = input_shape
         self.batch_size = batch_size
         self.num_actions = num_actions
@@ -306,36 +530,57 @@ class ConvQNetwork(object):
         self.update_rule = update_rule
         self.freeze_interval = freeze_interval
         self.rng = rng if rng else np.random.RandomState()
+        # see QNetwork for the soft update of the target network with tau
+        self.tau = tau
         self.initialize_network()
         self.update_counter = 0
 
-    def train(self, states, actions, rewards, next_states, terminals):
-        if self.update_counter % self.freeze_interval == 0:
+    def train(self, states, actions, rewards, next_states, terminals, weights=None, discounts=None, 
+            transition_ids=None):
+        """
+        :description: Perform a q-learning update, see QNetwork.train. The network has no target 
+                        cache, so transition_ids are accepted for the replay memories that 
+                        include them but not used.
+        """
+        if self.tau is None and self.update_counter % self.freeze_interval == 0:
             self.reset_target_network()
         self.update_counter += 1
 
-        self.states_shared.set_value(states)
-        self.actions_shared.set_value(actions.astype('int32'))
-        self.rewards_shared.set_value(rewards)
-        self.next_states_shared.set_value(next_states)
-        self.terminals_shared.set_value(terminals.astype('int32'))
-
-        loss, q_values = self._train()
+        # the replay memories already provide floatX and int32 arrays of the expected shapes, 
+        # so the uploads below neither cast nor copy them
+        self.states_shared.set_value(states, borrow=True)
+        self.actions_shared.set_value(np.asarray(actions, dtype='int32'), borrow=True)
+        self.rewards_shared.set_value(rewards, borrow=True)
+        self.next_states_shared.set_value(next_states, borrow=True)
+        self.terminals_shared.set_value(np.asarray(terminals, dtype='int32'), borrow=True)
+        self.weights_shared.set_value(weights if weights is not None else self.unit_weights, 
+            borrow=True)
+        self.discounts_shared.set_value(discounts if discounts is not None else self.unit_discounts, 
+            borrow=True)
+
+        loss, q_values, self.td_errors = self._train()
         return loss
 
     def get_q_values(self, state):
-        states = np.zeros(self.states_shape, dtype=theano.config.floatX)
-        states[0] = state
-        self.states_shared.set_value(states)
+        self.single_state[0] = state
+        self.inference_states_shared.set_value(self.single_state, borrow=True)
         q_values = self._get_q_values()[0]
         return q_values
 
+    def get_q_values_batch(self, states):
+        """
+        :description: Returns the q_values of any number of states at once, shape = (N,A)
+        """
+        states = np.asarray(states, dtype=theano.config.floatX)
+        self.inference_states_shared.set_value(states.reshape((len(states), 1) + self.input_shape), 
+            borrow=True)
+        return self._get_q_values()
+
     def get_params(self):
         return lasagne.layers.helper.get_all_param_values(self.l_out)
 
     def reset_target_network(self):
-        all_params = lasagne.layers.helper.get_all_param_values(self.l_out)
-        lasagne.layers.helper.set_all_param_values(self.next_l_out, all_params)
+        self._reset_target_network()
 
     ##########################################################################################
     #### Network and Learning Initialization below
@@ -356,9 +601,12 @@ class ConvQNetwork(object):
         batch_size, input_shape = self.batch_size, self.input_shape
         lasagne.random.set_rng(self.rng)
 
-        # 1. build the q network and target q network
-        self.l_out = self.build_network(input_shape, self.num_actions, batch_size)
-        self.next_l_out = self.build_network(input_shape, self.num_actions, batch_size)
+        # 1. build the q network and target q network, leaving the batch dimension unspecified 
+        # so that the convolutions also accept the batches of the inference function
+        self.l_out = self.build_network(input_shape, self.num_actions, None)
+        self.next_l_out = self.build_network(input_shape, self.num_actions, None)
+        self._reset_target_network = theano.function([], [], 
+            updates=target_network_updates(self.l_out, self.next_l_out))
         self.reset_target_network()
 
         # 2. initialize theano symbolic variables used for compiling functions
@@ -369,24 +617,35 @@ class ConvQNetwork(object):
         # terminals are used to indicate a terminal state in the episode and hence a mask over the future
         # q values i.e., Q(s',a')
         terminals = T.icol('terminals')
+        # importance sampling weights scaling the loss of each sample
+        weights = T.col('weights')
+        # discount of the bootstrapped value of each sample, which depends on its number of steps
+        discounts = T.col('discounts')
 
         # 3. initialize the theano numeric variables used as input to functions
         self.states_shape = (batch_size,) + (1,) + input_shape
         self.states_shared = theano.shared(np.zeros(self.states_shape, dtype=theano.config.floatX))
         self.next_states_shared = theano.shared(np.zeros(self.states_shape, dtype=theano.config.floatX))
+        self.inference_states_shared = theano.shared(np.zeros((1, 1) + input_shape, 
+            dtype=theano.config.floatX))
+        self.single_state = np.zeros((1, 1) + input_shape, dtype=theano.config.floatX)
         self.rewards_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX), 
             broadcastable=(False, True))
         self.actions_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
             broadcastable=(False, True))
         self.terminals_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
             broadcastable=(False, True))
+        self.unit_weights = np.ones((batch_size, 1), dtype=theano.config.floatX)
+        self.weights_shared = theano.shared(self.unit_weights, broadcastable=(False, True))
+        self.unit_discounts = np.ones((batch_size, 1), dtype=theano.config.floatX) * self.discount
+        self.discounts_shared = theano.shared(self.unit_discounts, broadcastable=(False, True))
 
         # 4. formulate the symbolic loss 
         q_vals = lasagne.layers.get_output(self.l_out, states)
         next_q_vals = lasagne.layers.get_output(self.next_l_out, next_states)
         target = (rewards +
                  (T.ones_like(terminals) - terminals) *
-                  self.discount * T.max(next_q_vals, axis=1, keepdims=True))
+                  discounts * T.max(next_q_vals, axis=1, keepdims=True))
         # reshape((-1,)) == 'make a row vector', reshape((-1, 1) == 'make a column vector'
         diff = target - q_vals[T.arange(batch_size), actions.reshape((-1,))].reshape((-1, 1))
 
@@ -401,11 +660,14 @@ class ConvQNetwork(object):
         quadratic_part = T.minimum(abs(diff), 1.0)
         linear_part = abs(diff) - quadratic_part
         loss = 0.5 * quadratic_part ** 2 + linear_part
-        loss = T.mean(loss) + self.regularization * regularize_network_params(self.l_out, l2)
+        loss = T.mean(weights * loss) + self.regularization * regularize_network_params(self.l_out, l2)
+        td_errors = abs(diff).reshape((-1,))
 
         # 5. formulate the symbolic updates 
         params = lasagne.layers.helper.get_all_params(self.l_out)  
         updates = self.initialize_updates(self.update_rule, loss, params, self.learning_rate)
+        if self.tau is not None:
+            updates.update(target_network_updates(self.l_out, self.next_l_out, self.tau))
 
         # 6. compile theano functions for training and for getting q_values
         givens = {
@@ -413,10 +675,12 @@ class ConvQNetwork(object):
             next_states: self.next_states_shared,
             rewards: self.rewards_shared,
             actions: self.actions_shared,
-            terminals: self.terminals_shared
+            terminals: self.terminals_shared,
+            weights: self.weights_shared,
+            discounts: self.discounts_shared
         }
-        self._train = theano.function([], [loss, q_vals], updates=updates, givens=givens)
-        self._get_q_values = theano.function([], q_vals, givens={states: self.states_shared})
+        self._train = theano.function([], [loss, q_vals, td_errors], updates=updates, givens=givens)
+        self._get_q_values = theano.function([], q_vals, givens={states: self.inference_states_shared})
 
     def initialize_updates(self, update_rule, loss, params, learning_rate):
         if update_rule == 'adam':
@@ -457,3 +721,41 @@ class ConvQNetwork(object):
 
         return l_out
 
+def target_network_updates(l_out, next_l_out, tau=None):
+    """
+    :description: the updates assigning the parameters of a network to the corresponding 
+        parameters of its target network in place, or with tau, moving each target parameter 
+        a fraction tau of the way towards the parameter, i.e., 
+        theta_target <- tau * theta + (1 - tau) * theta_target
+    """
+    params = lasagne.layers.helper.get_all_params(l_out)
+    target_params = lasagne.layers.helper.get_all_params(next_l_out)
+    if tau is None:
+        return list(zip(target_params, params))
+
+    tau = np.cast[theano.config.floatX](tau)
+    return [(target_param, tau * param + (1 - tau) * target_param) 
+        for param, target_param in zip(params, target_params)]
+
+def scan_updates(inputs, outputs, updates):
+    """
+    :description: the graph performing one update per minibatch of a stack of minibatches, in 
+        order within a single theano.scan, so that a function compiled from it leaves the 
+        shared variables, e.g., the params and optimizer state, as one call per minibatch of a 
+        function with the given updates would. Returns the stacked inputs, the outputs of each 
+        update stacked along a leading axis, and the updates of the scan.
+
+    :type inputs: list of theano variables
+    :param inputs: the symbolic inputs of one minibatch that outputs and updates depend on
+    """
+    variables = list(updates.keys())
+
+    def update(*minibatch):
+        values = theano.clone(list(outputs) + [updates[variable] for variable in variables], 
+            replace=dict(zip(inputs, minibatch)))
+        return values[:len(outputs)], collections.OrderedDict(zip(variables, values[len(outputs):]))
+
+    stacked_inputs = [T.TensorType(variable.dtype, (False,) + variable.broadcastable)(
+        'stacked_{}'.format(variable.name)) for variable in inputs]
+    stacked_outputs, stacked_updates = theano.scan(update, sequences=stacked_inputs)
+    return stacked_inputs, stacked_outputs, stacked_updates
@@ -10,11 +10,14 @@ import sys
 import theano
 import theano.tensor as T
 
+import function_cache
 import learning_utils
+import qnetwork
+import target_cache
 
-class RecurrentQNetwork(object):
+class RecurrentQNetwork(function_cache.LazyFunctions):
 
-    def __init__(self, input_shape, sequence_length, batch_size, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, network_type, rng):
+    def __init__(self, input_shape, sequence_length, batch_size, num_actions, num_hidden, discount, learning_rate, regularization, update_rule, freeze_interval, network_type, rng, burn_in=0, stored_state=False, target_cache_size=None, tau=None, function_cache=None, inference_only=False):
         """
         :type input_shape: int
         :param input_shape: the dimension of the input representation of the state
@@ -52,6 +55,41 @@ class RecurrentQNetwork(object):
         :type rng: rng
         :param rng: rng for running deterministically, o/w just leave as None
 
+        :type burn_in: int
+        :param burn_in: number of steps preceding each training window that are only used to 
+                        compute the recurrent state the window starts from, without gradient. 
+                        Windows passed to train then have burn_in + sequence_length steps.
+
+        :type stored_state: bool
+        :param stored_state: whether training windows start from the recurrent states stored 
+                        in the replay memory instead of zero, in which case actions are chosen 
+                        one step at a time with step. Supported by the single_layer_rnn, 
+                        single_layer_gru and single_layer_lstm network types. The recurrent 
+                        state of an lstm is its hidden state followed by its cell state, so 
+                        the replay memory is created with hidden_size=network.state_size.
+
+        :type target_cache_size: int
+        :param target_cache_size: if provided, the bootstrapped values of the target network are 
+                        cached in this many entries between target resets, keyed by the transition 
+                        ids of the minibatches, which requires a replay memory created with 
+                        transition_ids=True. This saves the forward pass through the target 
+                        network for every next window whose value is cached.
+
+        :type tau: float
+        :param tau: if provided, the target network tracks the network with the soft update 
+                        theta_target <- tau * theta + (1 - tau) * theta_target applied by every 
+                        training update, instead of being reset every freeze_interval updates
+
+        :type function_cache: CompiledFunctionCache (see function_cache.py)
+        :param function_cache: if provided, the theano functions are reused from identical 
+                        networks built before rather than compiled again, which saves the most 
+                        for the stacked and clockwork lstm networks
+
+        :type inference_only: bool
+        :param inference_only: if True, only the functions getting q values are built, without 
+                        the target network, the training inputs or the optimizer state, e.g., 
+                        to evaluate a policy from saved params. Such a network cannot be trained.
+
         :example call: 
         network = qnetwork.QNetwork(input_shape=20, batch_size=64, num_hidden_layers=2, num_actions=4, 
             num_hidden=4, discount=1, learning_rate=1e-3, regularization=1e-4, 
@@ -70,10 +108,27 @@ class RecurrentQNetwork(object):
         self.freeze_interval = freeze_interval
         self.network_type = network_type
         self.rng = rng if rng else np.random.RandomState()
+        self.burn_in = burn_in
+        self.stored_state = stored_state
+        # size of the recurrent state passed to and returned by step and stored in the replay memory
+        self.state_size = 2 * num_hidden if network_type == 'single_layer_lstm' else num_hidden
+        if burn_in > 0 and not stored_state:
+            raise ValueError('burn_in requires stored_state')
+        self.tau = tau
+        self.function_cache = function_cache
+        self.inference_only = inference_only
+        self.target_cache = None
+        if target_cache_size is not None:
+            if inference_only:
+                raise ValueError('an inference only network has no target network to cache')
+            if tau is not None:
+                raise ValueError('a target cache requires a frozen target network, not soft updates')
+            self.target_cache = target_cache.TargetValueCache(target_cache_size)
         self.initialize_network()
         self.update_counter = 0
 
-    def train(self, states, actions, rewards, next_states, terminals):
+    def train(self, states, actions, rewards, next_states, terminals, weights=None, discounts=None, 
+            hid_init=None, next_hid_init=None, transition_ids=None):
         """
         :description: Perform a q-learning update using the (s,a,r,s') tuples provided
 
@@ -94,8 +149,33 @@ class RecurrentQNetwork(object):
         :param terminals: whether the corresponding state was a terminal state. If so, this
                             will cause the max_a' Q(s',a') term to be zero in the q-learning loss.
 
+        :type weights: np.array(dtype=theano.config.floatX)
+        :param weights: optional importance sampling weights scaling the loss of each sample, 
+                        shape = (N,1). The absolute td error of each sample is kept in 
+                        self.td_errors so that a prioritized replay memory can be updated.
+
+        :type discounts: np.array(dtype=theano.config.floatX)
+        :param discounts: optional discount applied to the bootstrapped value of each sample, 
+                        shape = (N,1), e.g., discount ** n for n-step returns. Defaults to 
+                        self.discount for every sample.
+
+        :type hid_init: np.array(dtype=theano.config.floatX)
+        :param hid_init: with stored_state, the recurrent state before the first step of each 
+                        window in states, shape = (N,state_size). Defaults to zero.
+
+        :type next_hid_init: np.array(dtype=theano.config.floatX)
+        :param next_hid_init: the same for next_states
+
+        :type transition_ids: np.array(dtype='int64')
+        :param transition_ids: optional ids of the transitions whose next windows are in 
+                        next_states, shape = (N,). With a target cache, only the next windows 
+                        whose value is not cached are forwarded through the target network.
+
         """
-        if self.update_counter % self.freeze_interval == 0:
+        if self.inference_only:
+            raise ValueError('the network was built for inference only and cannot be trained')
+
+        if self.tau is None and self.update_counter % self.freeze_interval == 0:
             self.reset_target_network()
 
         # cur_learning_rate = self.sym_learning_rate.get_value()
@@ -105,15 +185,62 @@ class RecurrentQNetwork(object):
 
         self.update_counter += 1
 
-        self.states_shared.set_value(states)
-        self.actions_shared.set_value(actions.astype('int32'))
-        self.rewards_shared.set_value(rewards)
-        self.next_states_shared.set_value(next_states)
-        self.terminals_shared.set_value(terminals.astype('int32'))
-
-        loss, q_values = self._train()
+        # the replay memories already provide floatX and int32 arrays of the expected shapes, 
+        # so the uploads below neither cast nor copy them
+        self.states_shared.set_value(states, borrow=True)
+        self.actions_shared.set_value(np.asarray(actions, dtype='int32'), borrow=True)
+        self.rewards_shared.set_value(rewards, borrow=True)
+        if self.target_cache is not None:
+            self.next_values_shared.set_value(self.get_next_values(next_states, next_hid_init, 
+                transition_ids), borrow=True)
+        else:
+            self.next_states_shared.set_value(next_states, borrow=True)
+        self.terminals_shared.set_value(np.asarray(terminals, dtype='int32'), borrow=True)
+        self.weights_shared.set_value(weights if weights is not None else self.unit_weights, 
+            borrow=True)
+        self.discounts_shared.set_value(discounts if discounts is not None else self.unit_discounts, 
+            borrow=True)
+        if self.stored_state:
+            self.hid_init_shared.set_value(hid_init if hid_init is not None else self.zero_hid_init, 
+                borrow=True)
+            self.next_hid_init_shared.set_value(next_hid_init if next_hid_init is not None 
+                else self.zero_hid_init, borrow=True)
+
+        loss, q_values, self.td_errors = self._train()
         return loss
 
+    def get_next_values(self, next_states, next_hid_init=None, transition_ids=None):
+        """
+        :description: Returns the bootstrapped values max_a' Q_target(s',a') of a batch of next 
+                        windows as a (N,1) column. Values cached since the last target reset are 
+                        reused if transition_ids are provided.
+        """
+        inputs = [next_states]
+        if self.stored_state:
+            inputs.append(next_hid_init if next_hid_init is not None 
+                else np.zeros((len(next_states), self.state_size), dtype=theano.config.floatX))
+
+        if transition_ids is None:
+            return self._next_values(*inputs)
+        return self.target_cache.get(transition_ids, 
+            lambda misses: self._next_values(*[values[misses] for values in inputs]))
+
+    def step(self, state, hidden):
+        """
+        :description: with stored_state, returns the q values of a single state given the 
+                        recurrent state before it, along with the recurrent state after it
+
+        :type state: np.array(dtype=theano.config.floatX)
+        :param state: the state, shape = (D,)
+
+        :type hidden: np.array(dtype=theano.config.floatX)
+        :param hidden: the recurrent state before state, shape = (state_size,)
+        """
+        self.logging_states[0, 0, :] = state
+        self.step_hidden[0, :] = hidden
+        q_values, next_hidden = self._step(self.logging_states, self.step_hidden)
+        return q_values[0], next_hidden[0]
+
     def get_q_values(self, sequence):
         """
         :description: Returns the q_values resultant from forward propagating
@@ -128,12 +255,38 @@ class RecurrentQNetwork(object):
                                 or sequence.shape[-2] != self.sequence_length:
             raise ValueError('invalid sequence passed to get_q_values. State: {}, shape: {}'.format(sequence, sequence.shape))
 
-        states = np.zeros((1, self.sequence_length, self.input_shape), dtype=theano.config.floatX)
-        states[0, :, :] = sequence
-        self.states_shared.set_value(states)
+        # a floatX sequence of the expected shape, e.g., the agent's observation window, is 
+        # uploaded as is, anything else is first copied into the reused input
+        if sequence.shape == self.sequence_states.shape and sequence.dtype == self.sequence_states.dtype:
+            states = sequence
+        else:
+            self.sequence_states[0, :, :] = sequence
+            states = self.sequence_states
+        self.inference_states_shared.set_value(states, borrow=True)
         q_values = self._get_q_values()[0]
         return q_values
 
+    def get_q_values_batch(self, sequences, hid_init=None):
+        """
+        :description: Returns the q_values after the last step of any number of sequences at 
+                        once, shape = (N,A)
+
+        :type sequences: np.array(dtype=theano.config.floatX)
+        :param sequences: sequences of states, shape = (N,T,D) for any length T
+
+        :type hid_init: np.array(dtype=theano.config.floatX)
+        :param hid_init: with stored_state, the recurrent state before the first step of each 
+                        sequence, shape = (N,state_size). Defaults to zero.
+        """
+        sequences = np.asarray(sequences, dtype=theano.config.floatX)
+        if self.stored_state:
+            if hid_init is None:
+                hid_init = np.zeros((len(sequences), self.state_size), dtype=theano.config.floatX)
+            return self._step(sequences, np.asarray(hid_init, dtype=theano.config.floatX))[0]
+
+        self.inference_states_shared.set_value(sequences, borrow=True)
+        return self._get_q_values()[0]
+
     def get_logging_q_values(self, state):
         # this method should only be called within agent.get_q_values
         # or more generally with a single timestep of the state
@@ -141,9 +294,11 @@ class RecurrentQNetwork(object):
             raise ValueError('invalid state passed to get_logging_q_values. \
                     State: {}, shape: {}'.format(state, state.shape))
 
-        states = np.zeros((1, 1, self.input_shape), dtype=theano.config.floatX)
-        states[0, 0, :] = state
-        self.states_shared.set_value(states)
+        if self.stored_state:
+            return self.step(state, np.zeros(self.state_size))[0]
+
+        self.logging_states[0, 0, :] = state
+        self.inference_states_shared.set_value(self.logging_states, borrow=True)
         q_values = self._get_q_values()[0]
         return q_values
 
@@ -160,14 +315,16 @@ class RecurrentQNetwork(object):
                     loading saved weights.
         """
         lasagne.layers.set_all_param_values(self.l_out, params)
-        self.reset_target_network()
+        if not self.inference_only:
+            self.reset_target_network()
     
     def reset_target_network(self):
         """
         :description: Set the target weights to the current weights.
         """
-        all_params = lasagne.layers.helper.get_all_param_values(self.l_out)
-        lasagne.layers.helper.set_all_param_values(self.next_l_out, all_params)
+        self._reset_target_network()
+        if self.target_cache is not None:
+            self.target_cache.invalidate()
 
     ##########################################################################################
     #### Network and Learning Initialization below
@@ -175,83 +332,218 @@ class RecurrentQNetwork(object):
 
     def initialize_network(self):
         """
-        :description: this method initializes the network, updates, and theano functions for training and 
-            retrieving q values. Here's an outline: 
-
-            1. build the q network and target q network
-            2. initialize theano symbolic variables used for compiling functions
-            3. initialize the theano numeric variables used as input to functions
-            4. formulate the symbolic loss 
-            5. formulate the symbolic updates 
-            6. compile theano functions for training and for getting q_values
+        :description: this method initializes the network, updates, and theano functions for training and
+            retrieving q values. Each theano function is only compiled the first time it is called
+            (see function_cache.LazyFunctions). Here's an outline:
+
+            1. build the q network and the function for getting q_values
+            2. unless the network is inference only, build the target q network
+            3. initialize theano symbolic variables used for compiling functions
+            4. initialize the theano numeric variables used as input to functions
+            5. formulate the symbolic loss
+            6. formulate the symbolic updates and the training function, when it is first called
         """
         build_network = self.get_build_network()
         batch_size, input_shape = self.batch_size, self.input_shape
         lasagne.random.set_rng(self.rng)
 
-        # 1. build the q network and target q network
-        self.l_out = build_network(input_shape, self.sequence_length, batch_size, self.num_actions)
-        self.next_l_out = build_network(input_shape, self.sequence_length, batch_size, self.num_actions)
-        self.reset_target_network()
-
-        # 2. initialize theano symbolic variables used for compiling functions
+        # 1. build the q network and the function for getting q_values and hid init
+        window_length = self.burn_in + self.sequence_length
+        self.l_out = build_network(input_shape, window_length, batch_size, self.num_actions)
         states = T.tensor3('states')
+        # recurrent states the windows start from when they are stored in the replay memory
+        hid_init = T.matrix('hid_init')
+        # input of the inference function, whose batch and time dimensions are symbolic, and
+        # the inputs reused to get the q values of a single sequence or state
+        self.inference_states_shared = theano.shared(np.zeros((1, self.sequence_length, input_shape),
+            dtype=theano.config.floatX))
+        self.sequence_states = np.zeros((1, self.sequence_length, input_shape), dtype=theano.config.floatX)
+        self.logging_states = np.zeros((1, 1, input_shape), dtype=theano.config.floatX)
+        self.step_hidden = np.zeros((1, self.state_size), dtype=theano.config.floatX)
+        q_vals = self.get_window_output(self.l_out, states, hid_init)
+        if self.stored_state:
+            step_outputs = [lasagne.layers.get_output(self.l_out, 
+                self.window_inputs(self.l_out, states, hid_init)),
+                self.get_final_state(self.l_out, states, hid_init)]
+            self.defer('_step', lambda: self.compile_function('step', [states, hid_init],
+                step_outputs))
+        else:
+            self.defer('_get_q_values', lambda: self.compile_function('get_q_values', [], [q_vals],
+                givens={states: self.inference_states_shared}))
+        if self.inference_only:
+            return
+
+        # 2. build the target q network, starting from a copy of the weights that is made on
+        # the host since no function has been compiled yet. Later resets assign the target
+        # weights on the device, without a round trip through the host
+        self.next_l_out = build_network(input_shape, window_length, batch_size, self.num_actions)
+        lasagne.layers.set_all_param_values(self.next_l_out, self.get_params())
+        self.defer('_reset_target_network', lambda: self.compile_function('reset_target_network',
+            [], [], updates=qnetwork.target_network_updates(self.l_out, self.next_l_out)))
+
+        # 3. initialize theano symbolic variables used for compiling functions
         actions = T.icol('actions')
         rewards = T.col('rewards')
         next_states = T.tensor3('next_states')
         # terminals are used to indicate a terminal state in the episode and hence a mask over the future
         # q values i.e., Q(s',a')
         terminals = T.icol('terminals')
-
-        # 3. initialize the theano numeric variables used as input to functions or in functions
-        self.states_shape = (batch_size,) + (self.sequence_length,) + (self.input_shape, )
+        # importance sampling weights scaling the loss of each sample
+        weights = T.col('weights')
+        # discount of the bootstrapped value of each sample, which depends on its number of steps
+        discounts = T.col('discounts')
+        next_hid_init = T.matrix('next_hid_init')
+        # max_a' Q(s',a') of each sample, passed in when it is looked up in the target cache
+        next_values = T.col('next_values')
+
+        # 4. initialize the theano numeric variables used as input to functions or in functions
+        self.states_shape = (batch_size,) + (window_length,) + (self.input_shape, )
         self.states_shared = theano.shared(np.zeros(self.states_shape, dtype=theano.config.floatX))
         self.next_states_shared = theano.shared(np.zeros(self.states_shape, dtype=theano.config.floatX))
-        self.rewards_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX), 
+        self.rewards_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX),
             broadcastable=(False, True))
         self.actions_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
             broadcastable=(False, True))
         self.terminals_shared = theano.shared(np.zeros((batch_size, 1), dtype='int32'),
-            broadcastable=(False, True))        
+            broadcastable=(False, True))
+        self.unit_weights = np.ones((batch_size, 1), dtype=theano.config.floatX)
+        self.weights_shared = theano.shared(self.unit_weights, broadcastable=(False, True))
+        self.unit_discounts = np.ones((batch_size, 1), dtype=theano.config.floatX) * self.discount
+        self.discounts_shared = theano.shared(self.unit_discounts, broadcastable=(False, True))
+        self.zero_hid_init = np.zeros((batch_size, self.state_size), dtype=theano.config.floatX)
+        self.hid_init_shared = theano.shared(self.zero_hid_init)
+        self.next_hid_init_shared = theano.shared(self.zero_hid_init)
+        self.next_values_shared = theano.shared(np.zeros((batch_size, 1), dtype=theano.config.floatX),
+            broadcastable=(False, True))
 
-        # 4. formulate the symbolic loss 
-        q_vals = lasagne.layers.get_output(self.l_out, states)
-        next_q_vals = lasagne.layers.get_output(self.next_l_out, next_states)
+        # 5. formulate the symbolic loss
+        next_q_vals = self.get_window_output(self.next_l_out, next_states, next_hid_init)
+        max_next_q_vals = T.max(next_q_vals, axis=1, keepdims=True)
+        # with a target cache, the forward pass of the target network happens outside of training
+        bootstrapped_values = next_values if self.target_cache is not None else max_next_q_vals
         target = (rewards +
                  (T.ones_like(terminals) - terminals) *
-                  self.discount * T.max(next_q_vals, axis=1, keepdims=True))
+                  discounts * bootstrapped_values)
         # reshape((-1,)) == 'make a row vector', reshape((-1, 1) == 'make a column vector'
         diff = target - q_vals[T.arange(batch_size), actions.reshape((-1,))].reshape((-1, 1))
 
         # a lot of the recent work clips the td error at 1 so we do that here
         # the problem is that gradient backpropagating through this minimum node
         # will be zero if diff is larger then 1.0 (because changing params before
-        # the minimum does not impact the output of the minimum). To account for 
+        # the minimum does not impact the output of the minimum). To account for
         # this we take the part of the td error (magnitude) greater than 1.0 and simply
         # add it to the loss, which allows gradient to backprop but just linearly
         # in the td error rather than quadratically
         quadratic_part = T.minimum(abs(diff), 1.0)
         linear_part = abs(diff) - quadratic_part
         loss = 0.5 * quadratic_part ** 2 + linear_part
-        loss = T.sum(loss)
+        loss = T.sum(weights * loss)
+        td_errors = abs(diff).reshape((-1,))
 
-        # 5. formulate the symbolic updates 
-        params = lasagne.layers.helper.get_all_params(self.l_out)  
-        updates = self.initialize_updates(self.update_rule, loss, params, self.learning_rate)
+        # takes any number of next windows, e.g., only those missing from the target cache
+        next_inputs = [next_states, next_hid_init] if self.stored_state else [next_states]
+        self.defer('_next_values', lambda: self.compile_function('next_values', next_inputs,
+            max_next_q_vals))
 
-        # 6. compile theano functions for training and for getting q_values and hid init
+        # 6. formulate the symbolic updates and the training function, when it is first called,
+        # so that the optimizer state is only allocated once training starts
         givens = {
             states: self.states_shared,
-            next_states: self.next_states_shared,
             rewards: self.rewards_shared,
             actions: self.actions_shared,
-            terminals: self.terminals_shared
+            terminals: self.terminals_shared,
+            weights: self.weights_shared,
+            discounts: self.discounts_shared
         }
-        self._train = theano.function([], [loss, q_vals], updates=updates, givens=givens)
-        self._get_q_values = theano.function([], [q_vals], givens={states: self.states_shared})
+        if self.stored_state:
+            givens[hid_init] = self.hid_init_shared
+        if self.target_cache is not None:
+            givens[next_values] = self.next_values_shared
+        else:
+            givens[next_states] = self.next_states_shared
+            if self.stored_state:
+                givens[next_hid_init] = self.next_hid_init_shared
+
+        def compile_train():
+            params = lasagne.layers.helper.get_all_params(self.l_out)
+            updates = self.initialize_updates(self.update_rule, loss, params, self.learning_rate)
+            if self.tau is not None:
+                updates.update(qnetwork.target_network_updates(self.l_out, self.next_l_out, self.tau))
+            return self.compile_function('train', [], [loss, q_vals, td_errors], updates=updates,
+                givens=givens)
+        self.defer('_train', compile_train)
+
+    def compile_function(self, name, inputs, outputs, updates=None, givens=None):
+        """
+        :description: compiles one of the theano functions of the network, through the function 
+            cache if the network has one
+        """
+        return function_cache.compile_function(self.function_cache, self.function_settings(), name, 
+            inputs, outputs, updates, givens)
+
+    def function_settings(self):
+        """
+        :description: the settings that the graphs of the theano functions depend on, which 
+            identify them in a function cache
+        """
+        return {'network': 'RecurrentQNetwork', 'input_shape': self.input_shape, 
+            'sequence_length': self.sequence_length, 'batch_size': self.batch_size, 
+            'num_actions': self.num_actions, 'num_hidden': self.num_hidden, 
+            'discount': self.discount, 'learning_rate': self.learning_rate, 
+            'regularization': self.regularization, 'update_rule': self.update_rule, 
+            'network_type': self.network_type, 'burn_in': self.burn_in, 
+            'stored_state': self.stored_state, 'tau': self.tau, 
+            'target_cache': self.target_cache is not None}
+
+    def get_window_output(self, l_out, states, hid_init):
+        """
+        :description: the symbolic q values of a batch of windows. With stored_state, the 
+            windows start from hid_init and the burn-in steps at their beginning advance the 
+            recurrent state without passing gradient, leaving only the rest to backpropagate 
+            through.
+        """
+        if not self.stored_state:
+            return lasagne.layers.get_output(l_out, states)
+
+        if self.burn_in > 0:
+            hid_init = theano.gradient.disconnected_grad(self.get_final_state(l_out, 
+                states[:, :self.burn_in], hid_init))
+            states = states[:, self.burn_in:]
+        return lasagne.layers.get_output(l_out, self.window_inputs(l_out, states, hid_init))
+
+    def window_inputs(self, l_out, states, hid_init):
+        """
+        :description: the inputs of a network built by build_stored_state_network for a batch 
+            of windows that start from the recurrent states hid_init, which for an lstm are 
+            split into the initial hidden and cell states
+        """
+        l_in, l_recurrent = recurrent_layers(l_out)
+        inputs = {l_in: states}
+        inputs[l_recurrent.input_layers[l_recurrent.hid_init_incoming_index]] = \
+            hid_init[:, :self.num_hidden]
+        if self.network_type == 'single_layer_lstm':
+            inputs[l_recurrent.input_layers[l_recurrent.cell_init_incoming_index]] = \
+                hid_init[:, self.num_hidden:]
+        return inputs
+
+    def get_final_state(self, l_out, states, hid_init):
+        """
+        :description: the symbolic recurrent state after the last step of a batch of windows 
+            that start from hid_init, in the format of hid_init
+        """
+        _, l_recurrent = recurrent_layers(l_out)
+        if self.network_type == 'single_layer_lstm':
+            return lstm_final_state(l_recurrent, states, hid_init[:, :self.num_hidden], 
+                hid_init[:, self.num_hidden:])
+        return lasagne.layers.get_output(l_recurrent, self.window_inputs(l_out, states, hid_init))
 
     def get_build_network(self):
-        if self.network_type == 'single_layer_rnn':
+        if self.stored_state:
+            if self.network_type not in ('single_layer_rnn', 'single_layer_gru', 'single_layer_lstm'):
+                raise ValueError("Stored state is not supported by network_type: {}".format(
+                    self.network_type))
+            return self.build_stored_state_network
+        elif self.network_type == 'single_layer_rnn':
             return self.build_single_layer_rnn_network
         elif self.network_type == 'single_layer_lstm':
             return self.build_single_layer_lstm_network
@@ -343,6 +635,75 @@ class RecurrentQNetwork(object):
 
         return l_out
 
+    def build_stored_state_network(self, input_shape, sequence_length, batch_size, output_shape):
+        """
+        :description: single layer rnn, gru or lstm whose initial recurrent state is an input 
+            layer, as is the initial cell state of the lstm. The batch size and sequence length 
+            are left variable so that the same network processes burn-in steps, training 
+            windows and single steps while acting.
+        """
+        l_in = lasagne.layers.InputLayer(
+            shape=(None, None, input_shape)
+        )
+
+        l_hid = lasagne.layers.InputLayer(
+            shape=(None, self.num_hidden)
+        )
+
+        if self.network_type == 'single_layer_rnn':
+            l_recurrent = lasagne.layers.RecurrentLayer(
+                l_in,
+                num_units=self.num_hidden,
+                W_in_to_hid=lasagne.init.HeNormal(),
+                W_hid_to_hid=lasagne.init.HeNormal(),
+                b=lasagne.init.Constant(0.),
+                nonlinearity=lasagne.nonlinearities.tanh,
+                hid_init=l_hid,
+                grad_clipping=2,
+                only_return_final=True
+            )
+        elif self.network_type == 'single_layer_gru':
+            l_recurrent = lasagne.layers.GRULayer(
+                l_in, 
+                num_units=self.num_hidden, 
+                hid_init=l_hid,
+                grad_clipping=2,
+                only_return_final=True
+            )
+        else:
+            l_cell = lasagne.layers.InputLayer(
+                shape=(None, self.num_hidden)
+            )
+            default_gate = lasagne.layers.recurrent.Gate(
+                W_in=lasagne.init.HeNormal(), W_hid=lasagne.init.HeNormal(),
+                b=lasagne.init.Constant(0.))
+            forget_gate = lasagne.layers.recurrent.Gate(
+                W_in=lasagne.init.HeNormal(), W_hid=lasagne.init.HeNormal(),
+                b=lasagne.init.Constant(2.))
+            l_recurrent = lasagne.layers.LSTMLayer(
+                l_in, 
+                num_units=self.num_hidden, 
+                nonlinearity=lasagne.nonlinearities.tanh,
+                cell=default_gate,
+                ingate=default_gate,
+                outgate=default_gate,
+                forgetgate=forget_gate,
+                hid_init=l_hid,
+                cell_init=l_cell,
+                grad_clipping=2,
+                only_return_final=True
+            )
+
+        l_out = lasagne.layers.DenseLayer(
+            l_recurrent,
+            num_units=output_shape,
+            nonlinearity=None,
+            W=lasagne.init.HeNormal(),
+            b=lasagne.init.Constant(0)
+        )
+
+        return l_out
+
     def build_single_layer_lstm_network(self, input_shape, sequence_length, batch_size, output_shape):
 
         l_in = lasagne.layers.InputLayer(
@@ -821,3 +1182,42 @@ class RecurrentQNetwork(object):
         )
 
         return l_out
+
+def recurrent_layers(l_out):
+    """
+    :description: the sequence input layer and the recurrent layer of a network built by 
+        build_stored_state_network
+    """
+    l_recurrent = l_out.input_layer
+    return l_recurrent.input_layers[0], l_recurrent
+
+def lstm_final_state(l_lstm, states, hid_init, cell_init):
+    """
+    :description: the hidden state followed by the cell state of an lstm layer after the last 
+        step of a batch of sequences. LSTMLayer only outputs its hidden state, so this repeats 
+        its computation with the parameters of l_lstm, without gradient clipping or masks.
+    """
+    num_units = l_lstm.num_units
+    W_in = T.concatenate([l_lstm.W_in_to_ingate, l_lstm.W_in_to_forgetgate, 
+        l_lstm.W_in_to_cell, l_lstm.W_in_to_outgate], axis=1)
+    W_hid = T.concatenate([l_lstm.W_hid_to_ingate, l_lstm.W_hid_to_forgetgate, 
+        l_lstm.W_hid_to_cell, l_lstm.W_hid_to_outgate], axis=1)
+    b = T.concatenate([l_lstm.b_ingate, l_lstm.b_forgetgate, l_lstm.b_cell, l_lstm.b_outgate])
+
+    def step(state, cell_previous, hid_previous):
+        gates = T.dot(state, W_in) + b + T.dot(hid_previous, W_hid)
+        ingate, forgetgate, cell_input, outgate = [gates[:, idx * num_units:(idx + 1) * num_units] 
+            for idx in range(4)]
+        if l_lstm.peepholes:
+            ingate += cell_previous * l_lstm.W_cell_to_ingate
+            forgetgate += cell_previous * l_lstm.W_cell_to_forgetgate
+        cell = l_lstm.nonlinearity_forgetgate(forgetgate) * cell_previous \
+            + l_lstm.nonlinearity_ingate(ingate) * l_lstm.nonlinearity_cell(cell_input)
+        if l_lstm.peepholes:
+            outgate += cell * l_lstm.W_cell_to_outgate
+        hid = l_lstm.nonlinearity_outgate(outgate) * l_lstm.nonlinearity(cell)
+        return cell, hid
+
+    (cells, hids), _ = theano.scan(step, sequences=states.dimshuffle(1, 0, 2), 
+        outputs_info=[cell_init, hid_init])
+    return T.concatenate([hids[-1], cells[-1]], axis=1)
@@ -1,101 +1,309 @@
-
+import multiprocessing
 import numpy as np
+import os
 import random
 import theano
+import threading
+
+import eviction
 
 DEFAULT_CAPACITY = 10000
+EVICTION_POLICIES = eviction.EVICTION_POLICIES
+# dtype of the arrays holding raw mdp states when a memory is given a state adapter
+RAW_STATE_DTYPE = 'int32'
+# number of transitions written per chunk of a snapshot
+SNAPSHOT_CHUNK_SIZE = 4096
 
 class ReplayMemory(object):
+    """
+    :description: stores (s,a,r,s',t) tuples in preallocated ring buffers. The buffers are 
+        allocated on the first call to store because the shape of the states is not known before.
+    """
+
+    # names of the values returned by sample_batch, in order, as accepted by network.train
+    batch_fields = ('states', 'actions', 'rewards', 'next_states', 'terminals')
+    # names of the buffers written to a snapshot
+    snapshot_fields = ('states', 'actions', 'rewards', 'next_states', 'terminals')
+
+    def __init__(self, batch_size, capacity=DEFAULT_CAPACITY, eviction='random', state_adapter=None, 
+            n_step=1, discount=None, transition_ids=False):
+        """
+        :type batch_size: int
+        :param batch_size: the size of a minibatch
+
+        :type capacity: int
+        :param capacity: maximum number of transitions held in the replay memory
+
+        :type eviction: string
+        :param eviction: name of the policy deciding which transition to overwrite once the 
+            memory is full, one of EVICTION_POLICIES. 'random' overwrites a uniformly 
+            sampled one, 'fifo' the oldest one, 'reservoir' keeps a uniform sample of all 
+            transitions stored so far and 'rewarded_episodes' prefers to keep the transitions 
+            of episodes with a positive reward
+
+        :type state_adapter: an adapter class (see state_adapters.py)
+        :param state_adapter: if provided, the memory stores raw mdp states (e.g., maze 
+            coordinates) in compact integer arrays and applies this adapter only to the 
+            sampled minibatch. The agent must then pass raw states to store.
+
+        :type n_step: int
+        :param n_step: number of steps summed into the sampled rewards before bootstrapping. 
+            For n_step > 1, transitions must be stored in the order they occur and evicted in 
+            fifo order, and minibatches include the discount of each bootstrapped value.
+
+        :type discount: float
+        :param discount: discount factor used to sum the n-step rewards
+
+        :type transition_ids: bool
+        :param transition_ids: whether minibatches include the id of the transition whose next 
+            state is bootstrapped, e.g., to look up cached target values (see target_cache.py)
+        """
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError("Unrecognized eviction: {}".format(eviction))
+        if n_step > 1 and eviction != 'fifo':
+            raise ValueError('n-step returns require fifo eviction, got {}'.format(eviction))
 
-    def __init__(self, batch_size, capacity=DEFAULT_CAPACITY):
-        self.memory = {}
         self.batch_size = batch_size
+        self.capacity = capacity
+        self.eviction = eviction
+        self.eviction_policy = EVICTION_POLICIES[eviction](capacity)
+        self.state_adapter = state_adapter
+        self.stores_raw_states = state_adapter is not None
+        initialize_n_step(self, n_step, discount)
+        initialize_transition_ids(self, transition_ids)
+        self.batch_buffers = BatchBuffers()
+        self.agent_state_shape = None
         self.first_index = -1
         self.last_index = -1
-        self.capacity = capacity
         self.terminal_count = 0
+        self.size = 0
+        self.top = 0
+        self.states = None
+
+    def initialize_buffers(self, state_shape):
+        """
+        :description: allocates the circular buffers. Actions, rewards and terminals are kept 
+            as (capacity, 1) columns so that gathering from them directly yields the (N, 1) 
+            layout expected by the networks.
+        """
+        self.state_shape = state_shape
+        states_dtype = RAW_STATE_DTYPE if self.stores_raw_states else theano.config.floatX
+        self.states = np.zeros((self.capacity,) + state_shape, dtype=states_dtype)
+        self.actions = np.zeros((self.capacity, 1), dtype='int32')
+        self.rewards = np.zeros((self.capacity, 1), dtype=theano.config.floatX)
+        self.next_states = np.zeros((self.capacity,) + state_shape, dtype=states_dtype)
+        self.terminals = np.zeros((self.capacity, 1), dtype='int32')
 
     def store(self, sars_tuple):
-        self.terminal_count += sars_tuple[-1]
+        state, action, reward, next_state, terminal = sars_tuple
+        if self.states is None:
+            self.initialize_buffers(np.shape(state))
+
         if self.first_index == -1:
             self.first_index = 0
         self.last_index += 1
-        self.memory[self.last_index] = sars_tuple   
-        if (self.last_index + 1 - self.first_index) > self.capacity:
-            self.discard_sample()
+
+        if self.size == self.capacity:
+            index = self.discard_sample()
+            # the eviction policy may discard the new transition instead
+            if index is None:
+                return None
+        else:
+            index = self.size
+            self.size += 1
+            self.top = self.size % self.capacity
+
+        self.states[index] = state
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.next_states[index] = next_state
+        self.terminals[index] = terminal
+        self.terminal_count += terminal
+        assign_transition_ids(self, index)
+        self.eviction_policy.stored(self, index)
+        return index
 
     def is_full(self):
-        return self.last_index + 1 - self.first_index >= self.capacity
+        return self.size >= self.capacity
 
     def is_empty(self):
-        return self.first_index == -1
+        return self.size == 0
 
     def discard_sample(self):
-        rand_index = random.randint(self.first_index, self.last_index)
-        first_tuple = self.memory[self.first_index]
-        del self.memory[rand_index]
-        if rand_index != self.first_index:
-            del self.memory[self.first_index]
-            self.memory[rand_index] = first_tuple
+        """
+        :description: discards a single transition in O(1) according to the eviction policy 
+            and returns the slot it occupied so that it may be overwritten, or None if the 
+            policy discards the transition about to be stored instead
+        """
+        index = self.eviction_policy.choose_slot(self)
+        if index is not None:
+            self.terminal_count -= self.terminals[index, 0]
         self.first_index += 1
+        return index
 
     def sample(self):
         if self.is_empty():
             raise Exception('Unable to sample from replay memory when empty')
-        rand_sample_index = random.randint(self.first_index, self.last_index)
-        return self.memory[rand_sample_index]
+        index = random.randint(0, self.size - 1)
+        return self.states[index], self.actions[index, 0], self.rewards[index, 0], \
+            self.next_states[index], self.terminals[index, 0]
 
     def sample_batch(self):
         # must insert data into replay memory before sampling
         if self.is_empty():
             raise Exception('Unable to sample from replay memory when empty')
 
-        # determine shape of states
-        state_shape = np.shape(self.memory.values()[0][0])
-        states_shape = (self.batch_size,) + state_shape
-
-        states = np.empty(states_shape)
-        actions = np.empty((self.batch_size, 1))
-        rewards = np.empty((self.batch_size, 1))
-        next_states = np.empty(states_shape)
-        terminals = np.empty((self.batch_size, 1))
-
-        # sample batch_size times from the memory
-        for idx in range(self.batch_size):
-            state, action, reward, next_state, terminal = self.sample()
-            states[idx] = state
-            actions[idx] = action
-            rewards[idx] = reward
-            next_states[idx] = next_state
-            terminals[idx] = terminal
-
-        return states.astype(theano.config.floatX), actions, \
-            rewards.astype(theano.config.floatX), \
-            next_states.astype(theano.config.floatX), terminals
+        # draw every index of the minibatch at once and gather with fancy indexing
+        indices = np.random.randint(0, self.size, self.batch_size)
+        return self.gather(indices)
+
+    def sample_batches(self, num_batches):
+        """
+        :description: samples num_batches minibatches with a single draw and gather, e.g., for 
+            several updates per step. Each returned value has a leading axis of num_batches, 
+            so value[k] is that value for the k-th minibatch.
+        """
+        if self.is_empty():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        indices = np.random.randint(0, self.size, num_batches * self.batch_size)
+        return stack_batches(self.gather(indices), num_batches)
+
+    def gather(self, indices):
+        """
+        :description: gathers the transitions at the given indices, converting the states 
+            to the agent format if raw states are stored. For n-step returns, the rewards of 
+            the following transitions are summed and the next state, terminal and discount 
+            are those of the last transition summed, as is the transition id if minibatches 
+            include them. The arrays returned are the memory's batch buffers, reused by later 
+            calls.
+        """
+        # kept so that instrumentation can look up the sampled transitions (see replay_stats.py)
+        self.sampled_indices = indices
+        if self.n_step == 1:
+            return take_transitions(self, indices)
+
+        # transitions are stored in order, so those following a slot are the next slots 
+        # up to the most recently stored one
+        offsets = np.arange(self.n_step)
+        step_indices = (indices[:, np.newaxis] + offsets) % self.capacity
+        oldest = self.top if self.is_full() else 0
+        available = (indices[:, np.newaxis] - oldest) % self.capacity + offsets < self.size
+        returns, num_steps = n_step_returns(self.rewards[step_indices, 0], 
+            self.terminals[step_indices, 0], available, self.discount)
+        last_indices = step_indices[np.arange(len(indices)), num_steps - 1]
+
+        transitions = take_transitions(self, indices, last_indices)
+        transitions[2][...] = returns
+        return transitions[:5] + (n_step_discounts(num_steps, self.discount), ) + transitions[5:]
+
+    def batch_layout(self, batch_size):
+        if self.agent_state_shape is None:
+            self.agent_state_shape = agent_state_shape(self.state_adapter, self.states)
+        layout = batch_layout(batch_size, self.agent_state_shape)
+        if self.stored_ids is not None:
+            layout.append(((batch_size, ), 'int64'))
+        return layout
+
+    def save(self, filepath):
+        """
+        :description: writes a snapshot of the memory to filepath (see snapshot_writer)
+        """
+        save_snapshot(self, filepath)
+
+    def load(self, filepath):
+        """
+        :description: replaces the contents of the memory with the snapshot in filepath
+        """
+        load_snapshot(self, filepath)
+
+    def snapshot_order(self):
+        """
+        :description: the slots holding transitions, oldest first under fifo eviction, which 
+            is the order they are written to a snapshot
+        """
+        return (self.top + np.arange(self.size)) % self.capacity if self.is_full() \
+            else np.arange(self.size)
+
+    def snapshot_pointers(self):
+        return {'size': self.size, 'top': self.top, 'first_index': self.first_index, 
+            'last_index': self.last_index}
+
+    def restore_pointers(self, pointers):
+        """
+        :description: sets the pointers after a snapshot has been loaded into the first slots
+        """
+        self.size = pointers['size']
+        self.top = self.size % self.capacity
+        self.first_index = pointers['first_index']
+        self.last_index = pointers['last_index']
+        self.terminal_count = int(np.sum(self.terminals[:self.size])) if self.size > 0 else 0
+        assign_transition_ids(self, np.arange(self.size))
+        # the state of the eviction policy is not part of a snapshot
+        self.eviction_policy = EVICTION_POLICIES[self.eviction](self.capacity)
 
 class SequenceReplayMemory(object):
     """
     :description: this is from https://github.com/spragunr/deep_q_rl
     """
+
+    batch_fields = ReplayMemory.batch_fields
+    snapshot_fields = ('states', 'actions', 'rewards', 'terminals')
     
-    def __init__(self, input_shape, sequence_length, batch_size, capacity):
+    def __init__(self, input_shape, sequence_length, batch_size, capacity, state_adapter=None, 
+            n_step=1, discount=None, hidden_size=None, transition_ids=False):
         """
         :type input_shape: int or tuple 
-        :param: the shape of the state input to the network
+        :param: the shape of the state input to the network, or of the raw mdp 
+            state if a state_adapter is provided
 
         :type sequence_length: int
-        :param sequence_length: the length of the sequence used by the network
+        :param sequence_length: the length of the sequence used by the network, including 
+            any burn-in steps
 
         :type batch_size: int
         :param batch_size: the size of a minibatch
 
         :type capacity: int
         :param capacity: maximum size of the replay memory
+
+        :type state_adapter: an adapter class (see state_adapters.py)
+        :param state_adapter: if provided, the memory stores raw mdp states and applies this 
+            adapter only to sampled windows and to the sequences made for action selection
+
+        :type n_step: int
+        :param n_step: number of steps summed into the sampled rewards before bootstrapping, 
+            for n_step > 1 minibatches include the discount of each bootstrapped value
+
+        :type discount: float
+        :param discount: discount factor used to sum the n-step rewards
+
+        :type hidden_size: int
+        :param hidden_size: if provided, the memory also stores the recurrent state the acting 
+            network had before each step, and minibatches include the one before the first 
+            step of each window and of each next window as hid_init and next_hid_init, e.g., 
+            the state_size of a RecurrentQNetwork with stored_state
+
+        :type transition_ids: bool
+        :param transition_ids: whether minibatches include the id of the last step of each 
+            next window, e.g., to look up cached target values (see target_cache.py)
         """
         self.input_shape = input_shape
         self.sequence_length = sequence_length
         self.batch_size = batch_size
         self.capacity = capacity
+        self.state_adapter = state_adapter
+        self.stores_raw_states = state_adapter is not None
+        initialize_n_step(self, n_step, discount)
+        self.hidden_size = hidden_size
+        if hidden_size is not None:
+            num_fields = len(ReplayMemory.batch_fields) + (self.n_step > 1)
+            self.batch_fields = self.batch_fields[:num_fields] + ('hid_init', 'next_hid_init') \
+                + self.batch_fields[num_fields:]
+            self.snapshot_fields = self.snapshot_fields + ('hiddens', )
+        initialize_transition_ids(self, transition_ids)
+        self.batch_buffers = BatchBuffers()
+        self.agent_state_shape = None
         self.bottom = 0
         self.top = 0
         self.size = 0
@@ -103,19 +311,85 @@ class SequenceReplayMemory(object):
         if type(self.input_shape) is int:
             self.input_shape = (self.input_shape, )   
 
-        if self.sequence_length == 1:
-            self.sequence_shape = self.input_shape
-        else:         
-            self.sequence_shape = (self.sequence_length,) + self.input_shape
+        self.sequence_shape = (self.sequence_length,) + self.input_shape
         self.batch_shape = (self.batch_size, ) + self.sequence_shape
 
-        # Allocate the circular buffers
-        self.states = np.zeros(((self.capacity, ) + self.input_shape), dtype='int32')
+        # the first slots are repeated after the last one so that every window is contiguous
+        self.mirror_length = self.sequence_length + self.n_step - 1
+        self.mirrored_states = None
+        self.initialize_buffers()
+        self.hiddens = None
+        if hidden_size is not None:
+            self.hiddens = np.zeros((self.capacity, hidden_size), dtype=theano.config.floatX)
+        self.initialize_valid_ends()
+
+    def initialize_buffers(self):
+        """
+        :description: allocates the circular buffers, the states followed by their mirrored tail
+        """
+        self.mirrored_states = np.zeros(((self.capacity + self.mirror_length, ) + self.input_shape), 
+            dtype=RAW_STATE_DTYPE)
+        self.states = self.mirrored_states[:self.capacity]
         self.actions = np.zeros(self.capacity, dtype='int32')
         self.rewards = np.zeros(self.capacity, dtype=theano.config.floatX)
         self.terminals = np.zeros(self.capacity, dtype='bool')
 
-    def store(self, state, action, reward, terminal):
+    def initialize_valid_ends(self):
+        """
+        :description: allocates the index of valid windows. A window is identified by the slot 
+            of its last step and is valid if the step after it has been stored, it lies entirely 
+            within the memory, and none but its last step is terminal. The valid slots are kept 
+            densely in valid_ends and valid_positions maps a slot to its position there (or -1), 
+            so that adding, removing and drawing uniformly are all O(1).
+        """
+        self.valid_ends = np.zeros(self.capacity, dtype='int64')
+        self.valid_positions = -np.ones(self.capacity, dtype='int64')
+        self.num_valid = 0
+        # number of consecutive nonterminal steps ending just before the most recent one
+        self.nonterminal_run = 0
+        if self.size > 0:
+            self.rebuild_valid_ends()
+
+    def add_valid_end(self, index):
+        self.valid_ends[self.num_valid] = index
+        self.valid_positions[index] = self.num_valid
+        self.num_valid += 1
+
+    def remove_valid_end(self, index):
+        position = self.valid_positions[index]
+        if position < 0:
+            return
+        # move the last valid slot into the position being vacated
+        self.num_valid -= 1
+        last = self.valid_ends[self.num_valid]
+        self.valid_ends[position] = last
+        self.valid_positions[last] = position
+        self.valid_positions[index] = -1
+
+    def rebuild_valid_ends(self):
+        """
+        :description: recomputes the index of valid windows from the buffers, e.g., after 
+            they were loaded rather than filled through store
+        """
+        self.valid_positions[:] = -1
+        offsets = np.arange(self.size)
+        terminals = self.terminals[(self.bottom + offsets) % self.capacity]
+
+        # preceding[i] is the number of terminal steps before offset i
+        preceding = np.concatenate(([0], np.cumsum(terminals)))
+        end_offsets = offsets[self.sequence_length - 1:self.size - 1]
+        crossing = preceding[end_offsets] - preceding[end_offsets - self.sequence_length + 1]
+        valid = (self.bottom + end_offsets[crossing == 0]) % self.capacity
+
+        self.num_valid = len(valid)
+        self.valid_ends[:self.num_valid] = valid
+        self.valid_positions[valid] = np.arange(self.num_valid)
+
+        terminal_offsets = np.flatnonzero(terminals[:self.size - 1])
+        last_terminal = terminal_offsets[-1] if len(terminal_offsets) > 0 else -1
+        self.nonterminal_run = max(self.size - 2 - last_terminal, 0)
+
+    def store(self, state, action, reward, terminal, hidden=None):
         """
         :description: stores a state, the action taken in that state, and the reward received for 
             for being the state (i.e., we use r(s) not r(s,a)) in the replay memory
@@ -128,46 +402,73 @@ class SequenceReplayMemory(object):
 
         :type reward: float 
         :param reward: the reward received for being in state
+
+        :type hidden: np.array
+        :param hidden: the recurrent state of the acting network before it processed state, 
+            required if the memory was given a hidden_size
         """
 
         self.states[self.top] = state
+        if self.mirrored_states is not None and self.top < self.mirror_length:
+            self.mirrored_states[self.capacity + self.top] = state
         self.actions[self.top] = action
         self.rewards[self.top] = reward
         self.terminals[self.top] = terminal
+        if self.hiddens is not None:
+            self.hiddens[self.top] = hidden
+        index = self.top
+        assign_transition_ids(self, index)
 
         if self.size == self.capacity:
             self.bottom = (self.bottom + 1) % self.capacity
+            # the overwritten slot and the window that started at the old bottom are gone
+            self.remove_valid_end(index)
+            self.remove_valid_end((self.bottom + self.sequence_length - 2) % self.capacity)
         else:
             self.size += 1
 
         self.top = (self.top + 1) % self.capacity
 
+        # the previous slot now has a next state, so check whether a valid window ends there
+        if self.size > 1:
+            prev_index = (index - 1) % self.capacity
+            offset = (prev_index - self.bottom) % self.capacity
+            if offset >= self.sequence_length - 1 and self.nonterminal_run >= self.sequence_length - 1:
+                self.add_valid_end(prev_index)
+            self.nonterminal_run = 0 if self.terminals[prev_index] else self.nonterminal_run + 1
+
+        return index
+
     def make_last_sequence(self, next_state):
         """
         :description: given a state, this method creates a sequence of sequence_length where
             the last state in that sequence is passed in state. This is used to get an action
 
         :type next_state: np.array
-        :param next_state: the next state to be inserted last into the sequence
+        :param next_state: the next state to be inserted last into the sequence, in raw 
+            format if the memory stores raw states
         """
 
-        # take states from the memory
-        sequence = np.zeros(self.sequence_shape, dtype=theano.config.floatX)
+        # take states from the memory and set current states value in sequence
         indexes = np.arange(self.top - self.sequence_length + 1, self.top)
-        sequence[0:self.sequence_length - 1] = self.states.take(indexes, axis=0, mode='wrap')
-
-        # set current states value in sequence
-        sequence[-1] = next_state
+        if self.mirrored_states is None:
+            previous_states = self.states.take(indexes, axis=0, mode='wrap')
+        elif self.sequence_length > 1:
+            previous_states = self.window_views(self.sequence_length - 1)[indexes[0] % self.capacity]
+        else:
+            # a sequence of one step has no previous states
+            previous_states = np.zeros((0, ) + self.mirrored_states.shape[1:],
+                dtype=self.mirrored_states.dtype)
+        sequence = np.concatenate((previous_states, [next_state]))
+        sequence = decode_states(self.state_adapter, sequence)
 
-        # take the same terminal values from the memory
-        terminals = self.terminals.take(indexes, axis=0, mode='wrap')
-        
-        # if any of those terminals are true, then set indexes of the 
-        # sequence up to and including the index to zero
-        true_terminals = np.argwhere(terminals == True)
+        # steps before the first one of the current episode are set to zero, these are 
+        # either slots not yet filled or those up to and including the last terminal one
+        start = max(self.sequence_length - 1 - self.size, 0)
+        true_terminals = np.flatnonzero(self.terminals.take(indexes, mode='wrap'))
         if len(true_terminals) > 0:
-            real_start = true_terminals[-1] + 1
-            sequence[:real_start] = 0
+            start = max(start, true_terminals[-1] + 1)
+        sequence[:start] = 0
 
         return sequence
 
@@ -186,44 +487,1366 @@ class SequenceReplayMemory(object):
         if not self.is_full():
             raise Exception('Unable to sample from replay memory when empty')
 
-        # allocate batch containers
-        states = np.empty(self.batch_shape)
-        actions = np.empty((self.batch_size, 1))
-        rewards = np.empty((self.batch_size, 1))
-        next_states = np.empty(self.batch_shape)
-        terminals = np.empty((self.batch_size, 1))
-
-        # sample batch_size times from the memory
-        count = 0 
-        while count < self.batch_size:
-
-            index = np.random.randint(self.bottom, self.bottom + self.size - self.sequence_length)
-            initial_indices = np.arange(index, index + self.sequence_length)
-            transition_indices = initial_indices + 1
-            end_index = index + self.sequence_length - 1
-            
-            # original quote:
-            # "Check that the initial state corresponds entirely to a
-            # single episode, meaning none but the last frame may be
-            # terminal. If the last frame of the initial state is
-            # terminal, then the last frame of the transitioned state
-            # will actually be the first frame of a new episode, which
-            # the Q learner recognizes and handles correctly during
-            # training by zeroing the discounted future reward estimate."
-            if np.any(self.terminals.take(initial_indices[:-1], mode='wrap')):
-                continue
-
-            # Add the state transition to the response.
-            states[count] = self.states.take(initial_indices, axis=0, mode='wrap')
-            actions[count] = self.actions.take([end_index], mode='wrap')[0]
-            rewards[count] = self.rewards.take([end_index], mode='wrap')[0]
-            terminals[count] = self.terminals.take([end_index], mode='wrap')[0]
-            next_states[count] = self.states.take(transition_indices, axis=0, mode='wrap')
-            count += 1
-
-        return states.astype(theano.config.floatX), \
-               actions, \
-               rewards.astype(theano.config.floatX), \
-               next_states.astype(theano.config.floatX), \
-               terminals
+        return self.gather_windows(self.sample_start_indices())
+
+    def sample_batches(self, num_batches):
+        """
+        :description: samples num_batches minibatches with a single draw and gather, each 
+            returned value has a leading axis of num_batches
+        """
+        if not self.is_full():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        start_indices = self.sample_start_indices(num_batches * self.batch_size)
+        return stack_batches(self.gather_windows(start_indices), num_batches)
+
+    def sample_start_indices(self, num_samples=None):
+        """
+        :description: draws the first index of num_samples valid windows at once, batch_size 
+            windows by default
+        """
+        if self.num_valid == 0:
+            raise Exception('Unable to sample from replay memory without a complete sequence')
+
+        num_samples = self.batch_size if num_samples is None else num_samples
+        positions = np.random.randint(0, self.num_valid, num_samples)
+        return self.valid_ends[positions] - self.sequence_length + 1
+
+    def gather_windows(self, start_indices):
+        """
+        :description: gathers the windows of sequence_length + n_step steps beginning at the 
+            given indices, reading each stored state once, and returns states and next_states 
+            as views of them. The action, reward and terminal of each sample are those of the 
+            last step of its window.
+
+            If the last step of a window is terminal, then the last step of next_states is 
+            actually the first step of a new episode, which the Q learner handles correctly 
+            by zeroing the discounted future reward estimate.
+
+            For n-step returns, next_states is the window shifted by the number of steps summed 
+            into the reward, which stops after a terminal step or at the most recently stored 
+            one, and is copied out of the gathered windows since the shift differs per sample.
+
+            With stored recurrent states, the state before the first step of each window and 
+            of each next window follow the other values, and the transition ids come last.
+        """
+        start_indices = start_indices % self.capacity
+        end_indices = (start_indices + self.sequence_length - 1) % self.capacity
+        self.sampled_indices = end_indices
+
+        # write into reusable buffers in the layout of batch_layout
+        buffers = self.batch_buffers.get(self.batch_layout(len(start_indices)))
+        windows, actions, rewards, terminals = buffers[:4]
+        self.take_windows(start_indices, windows)
+        states = windows[:, :self.sequence_length]
+        np.take(self.actions, end_indices, out=actions.reshape(-1), mode='clip')
+
+        if self.n_step == 1:
+            np.take(self.rewards, end_indices, out=rewards.reshape(-1), mode='clip')
+            terminals.reshape(-1)[...] = self.terminals[end_indices]
+            next_end_indices = (end_indices + 1) % self.capacity
+            return (states, actions, rewards, windows[:, 1:], terminals) + \
+                self.take_hiddens(start_indices, (start_indices + 1) % self.capacity, buffers[4:]) + \
+                self.take_ids(next_end_indices, buffers)
+
+        # a step may be summed if the step after it has been stored. The offsets of the steps 
+        # from the oldest one are not taken modulo the capacity, so that a step wrapping 
+        # around to the oldest slot of a full memory is not available
+        offsets = np.arange(self.n_step)
+        step_indices = (end_indices[:, np.newaxis] + offsets) % self.capacity
+        step_offsets = ((end_indices - self.bottom) % self.capacity)[:, np.newaxis] + offsets
+        available = step_offsets < self.size - 1
+        returns, num_steps = n_step_returns(self.rewards[step_indices], 
+            self.terminals[step_indices], available, self.discount)
+        rows = np.arange(len(start_indices))
+        next_states = buffers[4]
+        next_states[...] = windows[rows[:, np.newaxis], 
+            num_steps[:, np.newaxis] + np.arange(self.sequence_length)]
+
+        rewards[...] = returns
+        terminals.reshape(-1)[...] = self.terminals[step_indices[rows, num_steps - 1]]
+        next_end_indices = (end_indices + num_steps) % self.capacity
+        return (states, actions, rewards, next_states, terminals, 
+            n_step_discounts(num_steps, self.discount)) + \
+            self.take_hiddens(start_indices, (start_indices + num_steps) % self.capacity, buffers[5:]) + \
+            self.take_ids(next_end_indices, buffers)
+
+    def take_windows(self, start_indices, out):
+        """
+        :description: gathers the windows of out.shape[1] steps beginning at the given slots 
+            into out in the agent format. With a mirrored tail, each window is a strided view 
+            of the buffer, otherwise the slots of the windows are computed modulo the capacity.
+        """
+        width = out.shape[1]
+        if self.mirrored_states is None:
+            window_indices = (start_indices[:, np.newaxis] + np.arange(width)) % self.capacity
+            return take_states(self.state_adapter, self.states, window_indices, out)
+        return take_states(self.state_adapter, self.window_views(width), start_indices, out)
+
+    def window_views(self, width):
+        """
+        :description: a view of shape (capacity, width) + state shape in which entry i is the 
+            window of width steps beginning at slot i, which is contiguous thanks to the 
+            mirrored tail
+        """
+        if width > self.mirror_length + 1:
+            raise ValueError('windows of {} steps exceed the mirrored tail'.format(width))
+        strides = self.mirrored_states.strides
+        return np.lib.stride_tricks.as_strided(self.mirrored_states, 
+            shape=(self.capacity, width) + self.mirrored_states.shape[1:],
+            strides=(strides[0], ) + strides)
+
+    def take_hiddens(self, start_indices, next_start_indices, buffers):
+        """
+        :description: gathers the stored recurrent states before the first step of the windows 
+            and of the next windows into the given buffers, if the memory stores them
+        """
+        if self.hiddens is None:
+            return ()
+        hid_init, next_hid_init = buffers[:2]
+        np.take(self.hiddens, start_indices, axis=0, out=hid_init, mode='clip')
+        np.take(self.hiddens, next_start_indices, axis=0, out=next_hid_init, mode='clip')
+        return hid_init, next_hid_init
+
+    def take_ids(self, indices, buffers):
+        """
+        :description: gathers the transition ids at the given slots into the last of the 
+            buffers, if minibatches include them
+        """
+        if self.stored_ids is None:
+            return ()
+        np.take(self.stored_ids, indices, out=buffers[-1], mode='clip')
+        return (buffers[-1], )
+
+    def batch_layout(self, batch_size):
+        """
+        :description: the buffers a minibatch is gathered into, the windows from which states 
+            and next_states are taken, the actions, rewards and terminals, then the n-step 
+            next_states, the recurrent states and the transition ids if needed
+        """
+        if self.agent_state_shape is None:
+            self.agent_state_shape = agent_state_shape(self.state_adapter, self.states)
+        windows, actions, rewards, next_states, terminals = batch_layout(batch_size, 
+            (self.sequence_length, ) + self.agent_state_shape)
+        windows = ((batch_size, self.sequence_length + self.n_step) + self.agent_state_shape, 
+            theano.config.floatX)
+        layout = [windows, actions, rewards, terminals]
+        if self.n_step > 1:
+            layout.append(next_states)
+        if self.hiddens is not None:
+            layout += [((batch_size, self.hidden_size), theano.config.floatX)] * 2
+        if self.stored_ids is not None:
+            layout.append(((batch_size, ), 'int64'))
+        return layout
+
+    def save(self, filepath):
+        """
+        :description: writes a snapshot of the memory to filepath (see snapshot_writer)
+        """
+        save_snapshot(self, filepath)
+
+    def load(self, filepath):
+        """
+        :description: replaces the contents of the memory with the snapshot in filepath
+        """
+        load_snapshot(self, filepath)
+
+    def snapshot_order(self):
+        return (self.bottom + np.arange(self.size)) % self.capacity
+
+    def snapshot_pointers(self):
+        return {'size': self.size, 'bottom': self.bottom, 'top': self.top}
+
+    def restore_pointers(self, pointers):
+        """
+        :description: sets the pointers after a snapshot has been loaded into the first slots 
+            and rebuilds the index of valid windows
+        """
+        self.size = pointers['size']
+        self.bottom = 0
+        self.top = self.size % self.capacity
+        # the episode in progress when the snapshot was taken will not be continued
+        if self.size > 0:
+            self.terminals[(self.top - 1) % self.capacity] = True
+        if self.mirrored_states is not None:
+            self.mirrored_states[self.capacity:] = self.states[:self.mirror_length]
+        assign_transition_ids(self, np.arange(self.size))
+        self.rebuild_valid_ends()
+
+class MemmapSequenceReplayMemory(SequenceReplayMemory):
+    """
+    :description: sequence replay memory whose circular buffers and ring pointers live in 
+        np.memmap files within a directory (e.g., one inside the run's log directory), so its 
+        capacity is bounded by disk rather than RAM. Constructing it on a directory that already 
+        holds a memory of the same capacity and input shape reopens that memory as it was when 
+        the previous process stopped, without having to refill it.
+    """
+
+    def __init__(self, input_shape, sequence_length, batch_size, capacity, directory, 
+            state_adapter=None, n_step=1, discount=None):
+        """
+        :type directory: string
+        :param directory: directory holding the memory mapped files, created if missing
+        """
+        self.directory = directory
+        super(MemmapSequenceReplayMemory, self).__init__(input_shape, sequence_length, 
+            batch_size, capacity, state_adapter, n_step, discount)
+
+    def initialize_buffers(self):
+        """
+        :description: opens the circular buffers, either creating new files or mapping the 
+            files of an existing memory in which case the ring pointers are restored as well
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        layout_filepath = os.path.join(self.directory, 'layout.npz')
+        reopen = os.path.exists(layout_filepath)
+        if reopen:
+            with np.load(layout_filepath) as layout:
+                capacity = int(layout['capacity'])
+                input_shape = tuple(int(dim) for dim in layout['input_shape'])
+            if capacity != self.capacity or input_shape != self.input_shape:
+                raise ValueError('replay memory in {} has capacity {} and input shape {}, not {} and {}'.format(
+                    self.directory, capacity, input_shape, self.capacity, self.input_shape))
+
+        mode = 'r+' if reopen else 'w+'
+        self.states = self.open_buffer('states', (self.capacity, ) + self.input_shape, RAW_STATE_DTYPE, mode)
+        self.actions = self.open_buffer('actions', (self.capacity, ), 'int32', mode)
+        self.rewards = self.open_buffer('rewards', (self.capacity, ), theano.config.floatX, mode)
+        self.terminals = self.open_buffer('terminals', (self.capacity, ), 'bool', mode)
+        # bottom, top and size, written on every store so they always match the buffers
+        self.pointers = self.open_buffer('pointers', (3, ), 'int64', mode)
+
+        if reopen:
+            self.bottom, self.top, self.size = [int(value) for value in self.pointers]
+            # the episode in progress when the previous process stopped did not finish, so 
+            # end it to keep windows from continuing across the restart
+            if self.size > 0:
+                self.terminals[(self.top - 1) % self.capacity] = True
+        else:
+            np.savez(layout_filepath, capacity=self.capacity, input_shape=self.input_shape)
+
+    def open_buffer(self, name, shape, dtype, mode):
+        filepath = os.path.join(self.directory, '{}.dat'.format(name))
+        return np.memmap(filepath, dtype=dtype, mode=mode, shape=shape)
+
+    def store(self, state, action, reward, terminal):
+        index = super(MemmapSequenceReplayMemory, self).store(state, action, reward, terminal)
+        self.pointers[:] = (self.bottom, self.top, self.size)
+        return index
+
+    def restore_pointers(self, pointers):
+        super(MemmapSequenceReplayMemory, self).restore_pointers(pointers)
+        self.pointers[:] = (self.bottom, self.top, self.size)
+
+    def sample_start_indices(self, num_samples=None):
+        """
+        :description: sorts the sampled windows of each minibatch by their position in the 
+            files so that the gather walks the pages of the memory map in order. Sorting within 
+            minibatches keeps those drawn together by sample_batches independent of each other.
+        """
+        indices = super(MemmapSequenceReplayMemory, self).sample_start_indices(num_samples)
+        indices = indices.reshape(-1, self.batch_size)
+        order = np.argsort(indices % self.capacity, axis=1)
+        return indices[np.arange(len(indices))[:, np.newaxis], order].reshape(-1)
+
+    def flush(self):
+        """
+        :description: writes any changes to the buffers back to disk
+        """
+        for buffer in (self.states, self.actions, self.rewards, self.terminals, self.pointers):
+            buffer.flush()
+
+    def close(self):
+        self.flush()
+
+class SharedReplayMemory(object):
+    """
+    :description: replay memory whose buffers live in shared memory so that several actor 
+        processes may store transitions while a learner process samples minibatches. Each 
+        writer owns an equal share of the slots, used as its own fifo ring, so storing takes 
+        no lock. Every slot carries a version, set to -1 while the slot is being written and to 
+        the writer's count of stored transitions once done. The sampler reads the versions 
+        before and after gathering and redraws any transition whose version changed or was 
+        -1, so a minibatch never contains a partially written transition.
+
+        The memory must be created before the actor processes are started and passed to them, 
+        each of which then calls attach_writer with its own id.
+    """
+
+    batch_fields = ReplayMemory.batch_fields
+
+    def __init__(self, batch_size, capacity, state_shape, num_writers, state_adapter=None):
+        """
+        :type batch_size: int
+        :param batch_size: the size of a minibatch
+
+        :type capacity: int
+        :param capacity: maximum number of transitions held, rounded down to a multiple of 
+            num_writers
+
+        :type state_shape: tuple
+        :param state_shape: shape of a stored state, which must be known in advance to 
+            allocate the shared buffers
+
+        :type num_writers: int
+        :param num_writers: number of actor processes storing transitions
+
+        :type state_adapter: an adapter class (see state_adapters.py)
+        :param state_adapter: if provided, raw mdp states are stored and converted when sampled
+        """
+        self.batch_size = batch_size
+        self.num_writers = num_writers
+        self.writer_capacity = capacity // num_writers
+        self.capacity = self.writer_capacity * num_writers
+        self.state_shape = tuple(state_shape)
+        self.state_adapter = state_adapter
+        self.stores_raw_states = state_adapter is not None
+        self.writer_id = None
+        self.raw_batch_buffers = BatchBuffers()
+        self.batch_buffers = BatchBuffers()
+        self.agent_state_shape = None
+
+        states_dtype = RAW_STATE_DTYPE if self.stores_raw_states else theano.config.floatX
+        self.layout = {
+            'states': ((self.capacity, ) + self.state_shape, states_dtype),
+            'actions': ((self.capacity, 1), 'int32'),
+            'rewards': ((self.capacity, 1), theano.config.floatX),
+            'next_states': ((self.capacity, ) + self.state_shape, states_dtype),
+            'terminals': ((self.capacity, 1), 'int32'),
+            'versions': ((self.capacity, ), 'int64'),
+            'counts': ((self.num_writers, ), 'int64')
+        }
+        self.raw_buffers = {}
+        for name, (shape, dtype) in self.layout.items():
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            self.raw_buffers[name] = multiprocessing.RawArray('b', nbytes)
+        self.initialize_views()
+        self.versions[:] = -1
+
+    def initialize_views(self):
+        """
+        :description: creates the numpy arrays viewing the shared buffers
+        """
+        for name, (shape, dtype) in self.layout.items():
+            view = np.frombuffer(self.raw_buffers[name], dtype=dtype).reshape(shape)
+            setattr(self, name, view)
+
+    def __getstate__(self):
+        # the shared buffers are passed to a child process but the views are recreated there
+        state = self.__dict__.copy()
+        for name in self.layout:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.initialize_views()
+
+    def attach_writer(self, writer_id):
+        """
+        :description: sets which share of the slots this process stores into
+        """
+        if not 0 <= writer_id < self.num_writers:
+            raise ValueError('writer_id must be in [0, {}), got {}'.format(self.num_writers, writer_id))
+        self.writer_id = writer_id
+
+    def store(self, sars_tuple):
+        if self.writer_id is None:
+            raise Exception('attach_writer must be called before storing in a shared replay memory')
+
+        state, action, reward, next_state, terminal = sars_tuple
+        count = self.counts[self.writer_id]
+        index = self.writer_id * self.writer_capacity + count % self.writer_capacity
+
+        self.versions[index] = -1
+        self.states[index] = state
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.next_states[index] = next_state
+        self.terminals[index] = terminal
+        self.versions[index] = count
+        self.counts[self.writer_id] = count + 1
+        return index
+
+    def writer_sizes(self):
+        return np.minimum(self.counts, self.writer_capacity)
+
+    def is_full(self):
+        return np.sum(self.writer_sizes()) >= self.capacity
+
+    def is_empty(self):
+        return np.sum(self.writer_sizes()) == 0
+
+    def sample_indices(self, num_samples, writer_sizes):
+        """
+        :description: draws slots uniformly among those stored across all writers
+        """
+        ends = np.cumsum(writer_sizes)
+        positions = np.random.randint(0, ends[-1], num_samples)
+        writers = np.searchsorted(ends, positions, side='right')
+        offsets = positions - (ends[writers] - writer_sizes[writers])
+        return writers * self.writer_capacity + offsets
+
+    def sample_batch(self):
+        writer_sizes = self.writer_sizes()
+        if np.sum(writer_sizes) == 0:
+            raise Exception('Unable to sample from replay memory when empty')
+
+        # without an adapter the gathered arrays are returned as they are, so they come from 
+        # the batch buffers that a prefetcher rotates, otherwise they are only converted from
+        indices = self.sample_indices(self.batch_size, writer_sizes)
+        buffers = self.batch_buffers if self.state_adapter is None else self.raw_batch_buffers
+        batch = buffers.get([((self.batch_size, ) + shape[1:], dtype) for shape, dtype in 
+            [self.layout[name] for name in self.batch_fields]])
+
+        # gather until every transition in the batch was read while no writer touched it
+        pending = np.arange(self.batch_size)
+        while len(pending) > 0:
+            versions = self.versions[indices]
+            for values, name in zip(batch, self.batch_fields):
+                values[pending] = getattr(self, name)[indices]
+            consistent = (versions >= 0) & (versions == self.versions[indices])
+            pending = pending[~consistent]
+            indices = self.sample_indices(len(pending), writer_sizes)
+
+        if self.state_adapter is None:
+            return tuple(batch)
+
+        raw_states, actions, rewards, raw_next_states, terminals = batch
+        if self.agent_state_shape is None:
+            self.agent_state_shape = agent_state_shape(self.state_adapter, self.states)
+        states, _, _, next_states, _ = self.batch_buffers.get(batch_layout(self.batch_size, 
+            self.agent_state_shape))
+        take_states(self.state_adapter, raw_states, np.arange(self.batch_size), states)
+        take_states(self.state_adapter, raw_next_states, np.arange(self.batch_size), next_states)
+        return states, actions, rewards, next_states, terminals
+
+class ConcurrentReplayMemory(object):
+    """
+    :description: replay memory shared by several actor threads and a learner thread. Each 
+        actor stores into its own shard, a ReplayMemory or SequenceReplayMemory guarded by a 
+        lock of its own, so actors never contend with each other and the windows of a sequence 
+        shard never mix the steps of two actors. The learner takes the locks of all shards in 
+        order while drawing and gathering a minibatch, so the minibatch reflects a single 
+        state of the memory. The number of samples drawn from each shard is proportional to 
+        the number of samples it holds.
+
+        Each actor thread calls attach_actor with its own id before storing. Prioritized 
+        shards are not supported since their indices do not identify the shard, nor are 
+        stratified and deduplicating shards, which are not sampled uniformly. To collect 
+        statistics, wrap the concurrent memory itself in an InstrumentedReplayMemory (see 
+        replay_stats.py) rather than its shards, which are not sampled through.
+    """
+
+    # settings that are the same on every shard, which are read from the first one
+    shard_settings = ('sequence_length', 'input_shape', 'hidden_size', 'n_step', 'discount', 
+        'eviction', 'state_adapter', 'stores_raw_states', 'snapshot_fields')
+
+    def __init__(self, shards):
+        """
+        :type shards: list of replay memories
+        :param shards: one memory per actor, all of the same type and batch size
+        """
+        if 'indices' in shards[0].batch_fields:
+            raise ValueError('Prioritized shards are not supported')
+        # shards are sampled uniformly through their slots, which would drop the strata and 
+        # weights of stratified shards, and deduplicating shards have no slots to gather
+        if isinstance(shards[0], (StratifiedReplayMemory, DeduplicatingReplayMemory)):
+            raise ValueError('Stratified and deduplicating shards are not supported')
+
+        self.shards = shards
+        self.locks = [threading.Lock() for _ in shards]
+        self.batch_fields = shards[0].batch_fields
+        self.batch_size = shards[0].batch_size
+        self.capacity = sum(shard.capacity for shard in shards)
+        self.batch_buffers = BatchBuffers()
+        self.actor = threading.local()
+        # slot indices are per shard, so sampled transitions cannot be looked up by index
+        self.sampled_indices = None
+
+    def __getattr__(self, name):
+        # anything describing the contents of the memory is aggregated over the shards below 
+        # instead, so that it is not mistaken for that of the first shard
+        if name not in ConcurrentReplayMemory.shard_settings or name == 'shards':
+            raise AttributeError(name)
+        return getattr(self.shards[0], name)
+
+    def attach_actor(self, actor_id):
+        """
+        :description: makes the calling thread store into the shard of actor_id
+        """
+        self.actor.id = actor_id
+
+    def actor_id(self):
+        actor_id = getattr(self.actor, 'id', None)
+        if actor_id is None:
+            raise Exception('Call attach_actor from the actor thread before storing')
+        return actor_id
+
+    def store(self, *args, **kwargs):
+        actor_id = self.actor_id()
+        with self.locks[actor_id]:
+            return self.shards[actor_id].store(*args, **kwargs)
+
+    def make_last_sequence(self, next_state):
+        actor_id = self.actor_id()
+        with self.locks[actor_id]:
+            return self.shards[actor_id].make_last_sequence(next_state)
+
+    def is_full(self):
+        return all(shard.is_full() for shard in self.shards)
+
+    def is_empty(self):
+        return all(shard.is_empty() for shard in self.shards)
+
+    @property
+    def size(self):
+        return sum(shard.size for shard in self.shards)
+
+    @property
+    def num_valid(self):
+        if not hasattr(self.shards[0], 'num_valid'):
+            raise AttributeError('num_valid')
+        return sum(shard.num_valid for shard in self.shards)
+
+    def bytes_used(self):
+        """
+        :description: number of bytes allocated for the transitions of all the shards
+        """
+        buffers = [getattr(shard, name, None) for shard in self.shards for name in shard.snapshot_fields]
+        return sum(buffer.nbytes for buffer in buffers if buffer is not None)
+
+    def close(self):
+        """
+        :description: closes every shard that holds resources, e.g., memory mapped files
+        """
+        for shard in self.shards:
+            if hasattr(shard, 'close'):
+                shard.close()
+
+    def sample_batch(self):
+        return self.gather_shards(self.batch_size)
+
+    def sample_batches(self, num_batches):
+        """
+        :description: samples num_batches minibatches at once, each returned value has a 
+            leading axis of num_batches
+        """
+        return stack_batches(self.gather_shards(num_batches * self.batch_size), num_batches)
+
+    def gather_shards(self, num_samples):
+        """
+        :description: draws num_samples samples across the shards and copies the values 
+            gathered from each shard into one set of batch buffers. Transition ids are 
+            interleaved across the shards so that they remain unique.
+        """
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            if not self.is_full():
+                raise Exception('Unable to sample from replay memory when empty')
+
+            sizes = np.array([getattr(shard, 'num_valid', shard.size) for shard in self.shards])
+            if np.sum(sizes) == 0:
+                raise Exception('Unable to sample from replay memory without a complete sequence')
+            counts = np.random.multinomial(num_samples, sizes / float(np.sum(sizes)))
+            batch = None
+            start = 0
+            for shard_index, (shard, count) in enumerate(zip(self.shards, counts)):
+                if count == 0:
+                    continue
+                if hasattr(shard, 'sample_start_indices'):
+                    values = shard.gather_windows(shard.sample_start_indices(count))
+                else:
+                    values = shard.gather(np.random.randint(0, shard.size, count))
+
+                if batch is None:
+                    batch = self.batch_buffers.get([((num_samples, ) + np.shape(value)[1:], 
+                        np.asarray(value).dtype) for value in values])
+                for value, out, name in zip(values, batch, self.batch_fields):
+                    if name == 'transition_ids':
+                        value = value * len(self.shards) + shard_index
+                    out[start:start + count] = value
+                start += count
+            return tuple(batch)
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
+class SumTree(object):
+    """
+    :description: a complete binary tree stored in a flat array in which every internal node 
+        holds the sum of its two children and the leaves hold priorities. Sampling proportional 
+        to priority and updating a priority are both O(log N). The batch methods walk all the 
+        requested leaves down (or up) the tree together, one level at a time.
+    """
+
+    def __init__(self, capacity):
+        """
+        :type capacity: int
+        :param capacity: number of leaves (i.e., replay memory slots) in the tree
+        """
+        self.capacity = capacity
+        self.num_leaves = 1
+        self.depth = 0
+        while self.num_leaves < capacity:
+            self.num_leaves *= 2
+            self.depth += 1
+        self.nodes = np.zeros(2 * self.num_leaves - 1, dtype='float64')
+
+    def total(self):
+        return self.nodes[0]
+
+    def get(self, indices):
+        return self.nodes[np.asarray(indices) + self.num_leaves - 1]
+
+    def update(self, index, priority):
+        """
+        :description: sets the priority of a single leaf and recomputes its ancestors
+        """
+        node = index + self.num_leaves - 1
+        self.nodes[node] = priority
+        while node > 0:
+            node = (node - 1) // 2
+            self.nodes[node] = self.nodes[2 * node + 1] + self.nodes[2 * node + 2]
+
+    def update_batch(self, indices, priorities):
+        """
+        :description: sets the priorities of many leaves at once. Ancestors are recomputed from 
+            their children rather than incremented so that no floating point error accumulates.
+        """
+        nodes = np.asarray(indices) + self.num_leaves - 1
+        self.nodes[nodes] = priorities
+        for level in range(self.depth):
+            nodes = np.unique((nodes - 1) // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes + 1] + self.nodes[2 * nodes + 2]
+
+    def find(self, values):
+        """
+        :description: for each value in [0, total) returns the index of the leaf whose 
+            prefix sum interval contains it. Subtrees with zero total are never entered so that 
+            leaves with zero priority cannot be returned.
+
+        :type values: np.array
+        :param values: values at which to search the cumulative priorities, shape = (N,)
+        """
+        values = np.array(values, dtype='float64')
+        nodes = np.zeros(len(values), dtype='int64')
+        for level in range(self.depth):
+            left = 2 * nodes + 1
+            left_sums = self.nodes[left]
+            go_right = ((values > left_sums) | (left_sums <= 0)) & (self.nodes[left + 1] > 0)
+            values -= left_sums * go_right
+            nodes = left + go_right
+        return nodes - (self.num_leaves - 1)
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    :description: replay memory that samples transitions proportional to their priority, 
+        p_i = (|td_error_i| + epsilon) ^ alpha, using a sum tree. New transitions are given the 
+        largest priority seen so far so that each is replayed at least once. The bias this 
+        introduces is corrected by the importance sampling weights (N * P(i)) ^ -beta, 
+        normalized by their maximum within the minibatch.
+    """
+
+    batch_fields = ReplayMemory.batch_fields + ('weights', 'indices')
+
+    def __init__(self, batch_size, capacity=DEFAULT_CAPACITY, eviction='random', alpha=.6, 
+            beta=.4, beta_increment=1e-5, epsilon=1e-6, state_adapter=None, n_step=1, 
+            discount=None, transition_ids=False):
+        """
+        :type alpha: float
+        :param alpha: how strongly to prioritize, zero is uniform sampling
+
+        :type beta: float
+        :param beta: initial strength of the importance sampling correction
+
+        :type beta_increment: float
+        :param beta_increment: amount beta is annealed towards 1 after every minibatch
+
+        :type epsilon: float
+        :param epsilon: added to td errors so that no transition has zero probability
+        """
+        super(PrioritizedReplayMemory, self).__init__(batch_size, capacity, eviction, state_adapter, 
+            n_step, discount, transition_ids)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.max_priority = 1.
+        self.tree = SumTree(capacity)
+
+    def store(self, sars_tuple):
+        index = super(PrioritizedReplayMemory, self).store(sars_tuple)
+        if index is not None:
+            self.tree.update(index, self.max_priority)
+        return index
+
+    def restore_pointers(self, pointers):
+        """
+        :description: priorities are not part of a snapshot, so every loaded transition starts 
+            out with the maximum priority
+        """
+        super(PrioritizedReplayMemory, self).restore_pointers(pointers)
+        self.tree.update_batch(np.arange(self.capacity), 0)
+        self.tree.update_batch(np.arange(self.size), self.max_priority)
+
+    def sample_batch(self):
+        """
+        :description: sample a minibatch of data using stratified sampling over the cumulative 
+            priorities. In addition to the usual values, returns the importance sampling weights 
+            shape = (N, 1) and the indices of the sampled transitions to pass to update_priorities
+        """
+        if self.is_empty():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        indices = sample_proportional(self.tree, self.batch_size)
+        weights = importance_sampling_weights(self.tree, indices, self.size, self.beta)
+        self.beta = min(1., self.beta + self.beta_increment)
+
+        return self.gather(indices) + (weights, indices)
+
+    def sample_batches(self, num_batches):
+        """
+        :description: samples num_batches stratified minibatches at once, each returned value 
+            has a leading axis of num_batches. The priorities are not updated between them.
+        """
+        if self.is_empty():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        indices, weights = sample_prioritized_batches(self, num_batches, self.size)
+        return stack_batches(self.gather(indices) + (weights, indices), num_batches)
+
+    def update_priorities(self, indices, td_errors):
+        """
+        :description: sets the priorities of sampled transitions from their absolute td errors
+
+        :type indices: np.array
+        :param indices: the indices returned alongside the minibatch by sample_batch
+
+        :type td_errors: np.array
+        :param td_errors: absolute td errors of those transitions, shape = (N,)
+        """
+        priorities = (np.abs(td_errors).reshape(-1) + self.epsilon) ** self.alpha
+        self.tree.update_batch(indices, priorities)
+        self.max_priority = max(self.max_priority, np.max(priorities))
+
+class PrioritizedSequenceReplayMemory(SequenceReplayMemory):
+    """
+    :description: sequence replay memory that samples windows proportional to the priority of 
+        the transition at their last step. A slot only has nonzero priority while it is in the 
+        index of valid windows, so sampling never has to reject a window.
+    """
+
+    batch_fields = SequenceReplayMemory.batch_fields + ('weights', 'indices')
+
+    def __init__(self, input_shape, sequence_length, batch_size, capacity, alpha=.6, beta=.4, 
+            beta_increment=1e-5, epsilon=1e-6, state_adapter=None, n_step=1, discount=None, 
+            hidden_size=None, transition_ids=False):
+        super(PrioritizedSequenceReplayMemory, self).__init__(input_shape, sequence_length, 
+            batch_size, capacity, state_adapter, n_step, discount, hidden_size, transition_ids)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.max_priority = 1.
+        self.tree = SumTree(capacity)
+
+    def add_valid_end(self, index):
+        super(PrioritizedSequenceReplayMemory, self).add_valid_end(index)
+        self.tree.update(index, self.max_priority)
+
+    def remove_valid_end(self, index):
+        super(PrioritizedSequenceReplayMemory, self).remove_valid_end(index)
+        self.tree.update(index, 0)
+
+    def rebuild_valid_ends(self):
+        super(PrioritizedSequenceReplayMemory, self).rebuild_valid_ends()
+        self.tree.update_batch(np.arange(self.capacity), 0)
+        self.tree.update_batch(self.valid_ends[:self.num_valid], self.max_priority)
+
+    def sample_batch(self):
+        """
+        :description: sample a minibatch of windows. In addition to the usual values, returns the 
+            importance sampling weights shape = (N, 1) and the indices of the last step of each 
+            window to pass to update_priorities
+        """
+        if not self.is_full():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        end_indices = sample_proportional(self.tree, self.batch_size)
+        weights = importance_sampling_weights(self.tree, end_indices, self.num_valid, self.beta)
+        self.beta = min(1., self.beta + self.beta_increment)
+
+        start_indices = end_indices - self.sequence_length + 1
+        return self.gather_windows(start_indices) + (weights, end_indices)
+
+    def sample_batches(self, num_batches):
+        """
+        :description: samples num_batches stratified minibatches of windows at once, each 
+            returned value has a leading axis of num_batches
+        """
+        if not self.is_full():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        end_indices, weights = sample_prioritized_batches(self, num_batches, self.num_valid)
+        start_indices = end_indices - self.sequence_length + 1
+        return stack_batches(self.gather_windows(start_indices) + (weights, end_indices), num_batches)
+
+    def update_priorities(self, indices, td_errors):
+        """
+        :description: sets the priorities of sampled windows from their absolute td errors. 
+            Windows that stopped being valid since they were sampled keep zero priority.
+        """
+        priorities = (np.abs(td_errors).reshape(-1) + self.epsilon) ** self.alpha
+        valid = self.valid_positions[indices] >= 0
+        self.tree.update_batch(indices[valid], priorities[valid])
+        self.max_priority = max(self.max_priority, np.max(priorities))
+
+class StratifiedReplayMemory(ReplayMemory):
+    """
+    :description: replay memory that fills a fixed fraction of each minibatch with rare 
+        transitions, those that are terminal or have a nonzero reward, and the rest with the 
+        other transitions. On sparse reward mazes this keeps the exit reward in every minibatch 
+        rather than in only some of them. The minibatch includes weights that correct for 
+        drawing the strata in different proportions than they occur in the memory, their 
+        mean is one. If the memory holds no transitions of one stratum, the whole minibatch 
+        is drawn from the other.
+
+        The slots are kept partitioned in order, the rare ones first and then the others, with 
+        positions mapping a slot to its place there, so that moving a slot from one stratum 
+        to the other is a single swap and each stratum is drawn from with one randint.
+    """
+
+    batch_fields = ReplayMemory.batch_fields + ('weights', )
+
+    def __init__(self, batch_size, capacity=DEFAULT_CAPACITY, eviction='random', rare_fraction=.25, 
+            state_adapter=None, n_step=1, discount=None, transition_ids=False):
+        """
+        :type rare_fraction: float
+        :param rare_fraction: fraction of each minibatch drawn from the rare transitions
+        """
+        super(StratifiedReplayMemory, self).__init__(batch_size, capacity, eviction, state_adapter, 
+            n_step, discount, transition_ids)
+        self.rare_fraction = rare_fraction
+        self.num_rare_samples = int(round(rare_fraction * batch_size))
+        self.order = np.arange(capacity)
+        self.positions = np.arange(capacity)
+        self.num_rare = 0
+
+    def store(self, sars_tuple):
+        index = super(StratifiedReplayMemory, self).store(sars_tuple)
+        if index is not None:
+            self.set_rare(index, self.is_rare(index))
+        return index
+
+    def is_rare(self, index):
+        return bool(self.terminals[index, 0]) or self.rewards[index, 0] != 0
+
+    def set_rare(self, index, rare):
+        """
+        :description: moves a slot to the rare stratum or out of it by swapping it with the 
+            slot at the boundary between the strata
+        """
+        position = self.positions[index]
+        if rare == (position < self.num_rare):
+            return
+        if not rare:
+            self.num_rare -= 1
+        boundary_index = self.order[self.num_rare]
+        self.order[position], self.order[self.num_rare] = boundary_index, index
+        self.positions[boundary_index], self.positions[index] = position, self.num_rare
+        if rare:
+            self.num_rare += 1
+
+    def restore_pointers(self, pointers):
+        """
+        :description: rebuilds the partition of the slots into strata after loading a snapshot
+        """
+        super(StratifiedReplayMemory, self).restore_pointers(pointers)
+        self.order[:] = np.arange(self.capacity)
+        self.positions[:] = np.arange(self.capacity)
+        self.num_rare = 0
+        for index in np.flatnonzero(self.terminals[:self.size, 0] | (self.rewards[:self.size, 0] != 0)):
+            self.set_rare(index, True)
+
+    def sample_batch(self):
+        """
+        :description: sample a minibatch with num_rare_samples rare transitions. In addition 
+            to the usual values, returns the correction weights shape = (N, 1)
+        """
+        indices, weights = self.sample_strata(1)
+        return self.gather(indices) + (weights, )
+
+    def sample_batches(self, num_batches):
+        indices, weights = self.sample_strata(num_batches)
+        return stack_batches(self.gather(indices) + (weights, ), num_batches)
+
+    def sample_strata(self, num_batches):
+        """
+        :description: draws the indices of num_batches minibatches from both strata at once 
+            and computes their correction weights, (stratum size / memory size) / (stratum 
+            samples / batch size) for each sample
+        """
+        if self.is_empty():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        num_rare_samples = self.num_rare_samples
+        if self.num_rare == 0:
+            num_rare_samples = 0
+        elif self.num_rare == self.size:
+            num_rare_samples = self.batch_size
+        num_common_samples = self.batch_size - num_rare_samples
+
+        positions = np.concatenate((
+            np.random.randint(0, max(self.num_rare, 1), (num_batches, num_rare_samples)), 
+            np.random.randint(self.num_rare, max(self.size, self.num_rare + 1), 
+                (num_batches, num_common_samples))), axis=1)
+        indices = self.order[positions.reshape(-1)]
+
+        weights = np.empty((num_batches, self.batch_size, 1), dtype=theano.config.floatX)
+        if num_rare_samples > 0:
+            weights[:, :num_rare_samples] = self.num_rare * self.batch_size / float(
+                self.size * num_rare_samples)
+        if num_common_samples > 0:
+            weights[:, num_rare_samples:] = (self.size - self.num_rare) * self.batch_size / float(
+                self.size * num_common_samples)
+        return indices, weights.reshape(-1, 1)
+
+class DeduplicatingReplayMemory(object):
+    """
+    :description: replay memory for deterministic mdps in which the same transitions recur 
+        many times. Each unique (s,a,r,s',t) tuple is stored once along with the number of 
+        times it occurs among the last capacity transitions stored, and minibatches are drawn 
+        in proportion to those counts. This gives the same distribution as a fifo ReplayMemory 
+        of the same capacity, which only holds the slot of each of those transitions. 
+        Alternatively, minibatches are drawn uniformly over the unique transitions.
+    """
+
+    batch_fields = ReplayMemory.batch_fields
+
+    def __init__(self, batch_size, capacity=DEFAULT_CAPACITY, weighting='count', max_unique=None, 
+            state_adapter=None):
+        """
+        :type batch_size: int
+        :param batch_size: the size of a minibatch
+
+        :type capacity: int
+        :param capacity: number of most recent transitions the counts are taken over
+
+        :type weighting: string
+        :param weighting: 'count' samples unique transitions in proportion to their counts, 
+            'uniform' samples them uniformly
+
+        :type max_unique: int
+        :param max_unique: maximum number of unique transitions held, defaults to capacity. If 
+            a new unique transition does not fit, the oldest transitions are dropped until 
+            one of the unique transitions no longer occurs.
+
+        :type state_adapter: an adapter class (see state_adapters.py)
+        :param state_adapter: if provided, raw mdp states are stored and converted when sampled
+        """
+        if weighting not in ('count', 'uniform'):
+            raise ValueError("Unrecognized weighting: {}".format(weighting))
+
+        self.batch_size = batch_size
+        self.capacity = capacity
+        self.weighting = weighting
+        self.max_unique = max_unique if max_unique is not None else capacity
+        self.state_adapter = state_adapter
+        self.stores_raw_states = state_adapter is not None
+        self.batch_buffers = BatchBuffers()
+        self.agent_state_shape = None
+        self.states = None
+
+        # maps each unique transition to its slot, and each slot back to its transition
+        self.slots = {}
+        self.keys = [None] * self.max_unique
+        self.counts = np.zeros(self.max_unique, dtype='int64')
+        self.free_slots = np.arange(self.max_unique)[::-1].copy()
+        self.num_free = self.max_unique
+        self.tree = SumTree(self.max_unique)
+
+        # the slots of the last capacity transitions stored, oldest first from window_start
+        self.window = np.zeros(capacity, dtype='int64')
+        self.window_start = 0
+        self.window_size = 0
+
+    def initialize_buffers(self, state_shape):
+        self.state_shape = state_shape
+        states_dtype = RAW_STATE_DTYPE if self.stores_raw_states else theano.config.floatX
+        self.states = np.zeros((self.max_unique,) + state_shape, dtype=states_dtype)
+        self.actions = np.zeros((self.max_unique, 1), dtype='int32')
+        self.rewards = np.zeros((self.max_unique, 1), dtype=theano.config.floatX)
+        self.next_states = np.zeros((self.max_unique,) + state_shape, dtype=states_dtype)
+        self.terminals = np.zeros((self.max_unique, 1), dtype='int32')
+
+    def store(self, sars_tuple):
+        state, action, reward, next_state, terminal = sars_tuple
+        if self.states is None:
+            self.initialize_buffers(np.shape(state))
+
+        # hash the transition as it would be stored so that equal transitions map to one key
+        state = np.asarray(state, dtype=self.states.dtype)
+        next_state = np.asarray(next_state, dtype=self.next_states.dtype)
+        key = (state.tobytes(), int(action), float(self.rewards.dtype.type(reward)), 
+            next_state.tobytes(), int(terminal))
+
+        if self.window_size == self.capacity:
+            self.drop_oldest()
+
+        index = self.slots.get(key)
+        if index is None:
+            while self.num_free == 0:
+                self.drop_oldest()
+            self.num_free -= 1
+            index = self.free_slots[self.num_free]
+            self.slots[key] = index
+            self.keys[index] = key
+            self.states[index] = state
+            self.actions[index] = action
+            self.rewards[index] = reward
+            self.next_states[index] = next_state
+            self.terminals[index] = terminal
+
+        self.window[(self.window_start + self.window_size) % self.capacity] = index
+        self.window_size += 1
+        self.change_count(index, 1)
+        return index
+
+    def drop_oldest(self):
+        """
+        :description: removes the oldest transition from the counts, freeing its slot if it 
+            no longer occurs
+        """
+        index = self.window[self.window_start]
+        self.window_start = (self.window_start + 1) % self.capacity
+        self.window_size -= 1
+        self.change_count(index, -1)
+
+        if self.counts[index] == 0:
+            del self.slots[self.keys[index]]
+            self.keys[index] = None
+            self.free_slots[self.num_free] = index
+            self.num_free += 1
+
+    def change_count(self, index, change):
+        self.counts[index] += change
+        if self.weighting == 'count':
+            self.tree.update(index, self.counts[index])
+        else:
+            self.tree.update(index, min(self.counts[index], 1))
+
+    def num_unique(self):
+        return self.max_unique - self.num_free
+
+    def compression_ratio(self):
+        """
+        :description: number of transitions represented per unique transition stored
+        """
+        if self.num_unique() == 0:
+            return 1.
+        return self.window_size / float(self.num_unique())
+
+    def is_full(self):
+        return self.window_size >= self.capacity
+
+    def is_empty(self):
+        return self.window_size == 0
+
+    def sample_batch(self):
+        if self.is_empty():
+            raise Exception('Unable to sample from replay memory when empty')
+
+        indices = self.tree.find(np.random.uniform(0, self.tree.total(), self.batch_size))
+        return take_transitions(self, indices)
+
+    def batch_layout(self, batch_size):
+        if self.agent_state_shape is None:
+            self.agent_state_shape = agent_state_shape(self.state_adapter, self.states)
+        return batch_layout(batch_size, self.agent_state_shape)
+
+def sample_proportional(tree, batch_size):
+    """
+    :description: draws batch_size leaf indices from the tree proportional to their priority, 
+        one from each of batch_size equal segments of the total priority
+    """
+    segment = tree.total() / batch_size
+    values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+    return tree.find(values)
+
+def sample_prioritized_batches(replay_memory, num_batches, size):
+    """
+    :description: draws the indices of num_batches minibatches from the memory's tree at once 
+        and computes their importance sampling weights, scaled within each minibatch. The 
+        segments of the total priority are dealt to the minibatches in turn, so each one 
+        is stratified over the whole memory. Beta is annealed once per minibatch.
+    """
+    batch_size = replay_memory.batch_size
+    indices = sample_proportional(replay_memory.tree, num_batches * batch_size)
+    indices = indices.reshape(batch_size, num_batches).T.reshape(-1)
+    weights = np.concatenate([importance_sampling_weights(replay_memory.tree, batch_indices, 
+        size, replay_memory.beta) for batch_indices in indices.reshape(num_batches, batch_size)])
+    replay_memory.beta = min(1., replay_memory.beta + num_batches * replay_memory.beta_increment)
+    return indices, weights
+
+def stack_batches(batch, num_batches):
+    """
+    :description: splits each value of a batch of num_batches * batch_size samples into 
+        num_batches minibatches stacked along a new leading axis, without copying
+    """
+    return tuple(values.reshape((num_batches, -1) + values.shape[1:]) for values in batch)
+
+def importance_sampling_weights(tree, indices, size, beta):
+    """
+    :description: computes the importance sampling weights (size * P(i)) ^ -beta of the sampled 
+        indices, scaled so the largest is one, as a (N, 1) column
+    """
+    probs = tree.get(indices) / tree.total()
+    weights = (size * probs) ** -beta
+    weights /= np.max(weights)
+    return weights.reshape(-1, 1).astype(theano.config.floatX)
+
+def decode_states(state_adapter, states):
+    """
+    :description: converts an array of stored states with an arbitrary number of leading 
+        dimensions to the agent format as floatX. Without an adapter, the states are already 
+        in agent format and only cast.
+    """
+    if state_adapter is None:
+        return states.astype(theano.config.floatX)
+
+    leading_shape = states.shape[:-1]
+    flat_states = states.reshape((-1, states.shape[-1]))
+    converted = state_adapter.convert_states_to_agent_format(flat_states, dtype=theano.config.floatX)
+    return converted.reshape(leading_shape + converted.shape[1:])
+
+def initialize_n_step(replay_memory, n_step, discount):
+    """
+    :description: sets the n-step settings of a replay memory. Minibatches of n-step memories 
+        hold the discount of each bootstrapped value right after the terminals.
+    """
+    if n_step < 1:
+        raise ValueError('n_step must be at least 1, got {}'.format(n_step))
+    if n_step > 1 and discount is None:
+        raise ValueError('a discount is required for n-step returns')
+
+    replay_memory.n_step = n_step
+    replay_memory.discount = discount
+    if n_step > 1:
+        num_fields = len(ReplayMemory.batch_fields)
+        replay_memory.batch_fields = replay_memory.batch_fields[:num_fields] + ('discounts', ) \
+            + replay_memory.batch_fields[num_fields:]
+
+def initialize_transition_ids(replay_memory, transition_ids):
+    """
+    :description: sets up the ids of the transitions of a replay memory. Every transition stored 
+        gets the next id, so an id is never reused even after its slot is overwritten. If 
+        minibatches include the ids, they come before the weights and indices of the 
+        prioritized and stratified memories.
+    """
+    replay_memory.stored_ids = None
+    replay_memory.next_transition_id = 0
+    if transition_ids:
+        replay_memory.stored_ids = np.zeros(replay_memory.capacity, dtype='int64')
+        num_fields = len([name for name in replay_memory.batch_fields 
+            if name not in ('weights', 'indices')])
+        replay_memory.batch_fields = replay_memory.batch_fields[:num_fields] + ('transition_ids', ) \
+            + replay_memory.batch_fields[num_fields:]
+
+def assign_transition_ids(replay_memory, indices):
+    """
+    :description: gives the transitions just written to the given slots new ids, in order
+    """
+    if replay_memory.stored_ids is None:
+        return
+    num_ids = np.size(indices)
+    replay_memory.stored_ids[indices] = replay_memory.next_transition_id + np.arange(num_ids).reshape(
+        np.shape(indices))
+    replay_memory.next_transition_id += num_ids
+
+def n_step_returns(rewards, terminals, available, discount):
+    """
+    :description: sums the discounted rewards of up to n steps for each sample, stopping after 
+        the first terminal step or at the last available one. The first step of each sample 
+        must be available.
+
+    :type rewards: np.array
+    :param rewards: rewards of the n steps following each sample, shape = (N, n)
+
+    :type terminals: np.array
+    :param terminals: whether each of those steps is terminal, shape = (N, n)
+
+    :type available: np.array(dtype=bool)
+    :param available: whether each of those steps may be summed, shape = (N, n), which must 
+        be true for a prefix of each row
+
+    :type rval: tuple
+    :param rval: the returns as a (N, 1) floatX column and the number of steps summed, shape = (N,)
+    """
+    # a step is summed if it is available and no earlier step was terminal
+    terminals = np.asarray(terminals, dtype='int64')
+    ended = np.cumsum(terminals, axis=1) - terminals > 0
+    included = available & ~ended
+    num_steps = np.sum(included, axis=1)
+    returns = np.sum(rewards * discount ** np.arange(rewards.shape[1]) * included, axis=1)
+    return returns.reshape(-1, 1).astype(theano.config.floatX), num_steps
+
+def n_step_discounts(num_steps, discount):
+    """
+    :description: the discount of the value bootstrapped after num_steps steps as a (N, 1) column
+    """
+    return (discount ** num_steps).reshape(-1, 1).astype(theano.config.floatX)
+
+class BatchBuffers(object):
+    """
+    :description: reusable arrays that minibatches are written to so that sampling does not 
+        allocate memory. Sets of arrays are handed out in rotation, so a minibatch stays intact 
+        until num_sets more minibatches have been sampled, e.g., while it waits in a prefetch 
+        queue. The networks upload these arrays without copying them.
+    """
+
+    def __init__(self, num_sets=1):
+        self.num_sets = num_sets
+        self.sets = []
+        self.position = -1
+
+    def get(self, layout):
+        """
+        :description: returns the next set of arrays, (re)allocating it if its layout differs
+
+        :type layout: list of tuples
+        :param layout: the (shape, dtype) of each array in the set
+        """
+        layout = [(tuple(shape), np.dtype(dtype)) for shape, dtype in layout]
+        if len(self.sets) < self.num_sets:
+            self.sets.append([])
+            self.position = len(self.sets) - 1
+        else:
+            self.position = (self.position + 1) % len(self.sets)
+
+        if [(values.shape, values.dtype) for values in self.sets[self.position]] != layout:
+            self.sets[self.position] = [np.empty(shape, dtype=dtype) for shape, dtype in layout]
+        return self.sets[self.position]
+
+def batch_layout(batch_size, state_shape):
+    """
+    :description: the (shape, dtype) of each array in a (s,a,r,s',t) minibatch as expected by 
+        the networks, with actions, rewards and terminals as (N, 1) columns
+    """
+    return [((batch_size, ) + tuple(state_shape), theano.config.floatX), 
+            ((batch_size, 1), 'int32'), 
+            ((batch_size, 1), theano.config.floatX), 
+            ((batch_size, ) + tuple(state_shape), theano.config.floatX), 
+            ((batch_size, 1), 'int32')]
+
+def agent_state_shape(state_adapter, states):
+    """
+    :description: the shape of one of the stored states once converted to the agent format
+    """
+    if state_adapter is None:
+        return states.shape[1:]
+    return state_adapter.convert_states_to_agent_format(states[:1]).shape[1:]
+
+def take_states(state_adapter, states, indices, out):
+    """
+    :description: gathers the stored states at indices into out, converting them to the 
+        agent format if raw states are stored. Indices may have any shape, out must have 
+        that shape followed by the shape of a state in agent format.
+    """
+    if state_adapter is not None:
+        raw_states = states.take(indices, axis=0)
+        state_adapter.convert_states_to_agent_format(raw_states.reshape(-1, raw_states.shape[-1]), 
+            dtype=out.dtype, out=out.reshape(-1, out.shape[-1]))
+    elif states.dtype == out.dtype:
+        np.take(states, indices, axis=0, out=out, mode='clip')
+    else:
+        out[...] = states.take(indices, axis=0)
+    return out
+
+def take_transitions(replay_memory, indices, next_indices=None):
+    """
+    :description: gathers the transitions of a flat replay memory at indices into its batch 
+        buffers. The next states and terminals are taken at next_indices if provided, as are 
+        the transition ids if the memory stores them.
+    """
+    next_indices = indices if next_indices is None else next_indices
+    buffers = replay_memory.batch_buffers.get(replay_memory.batch_layout(len(indices)))
+    states, actions, rewards, next_states, terminals = buffers[:5]
+    take_states(replay_memory.state_adapter, replay_memory.states, indices, states)
+    np.take(replay_memory.actions, indices, axis=0, out=actions, mode='clip')
+    np.take(replay_memory.rewards, indices, axis=0, out=rewards, mode='clip')
+    take_states(replay_memory.state_adapter, replay_memory.next_states, next_indices, next_states)
+    np.take(replay_memory.terminals, next_indices, axis=0, out=terminals, mode='clip')
+    if getattr(replay_memory, 'stored_ids', None) is None:
+        return states, actions, rewards, next_states, terminals
+
+    ids = buffers[5]
+    np.take(replay_memory.stored_ids, next_indices, out=ids, mode='clip')
+    return states, actions, rewards, next_states, terminals, ids
+
+def snapshot_writer(replay_memory, filepath, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """
+    :description: writes a snapshot of a replay memory one chunk at a time, yielding the 
+        number of transitions written after each chunk so that the actor may keep storing 
+        in between, e.g., by advancing the writer once per step. The file holds a record 
+        with the ring pointers followed by one record per buffer for every chunk, each in the 
+        .npy format, with transitions in snapshot order. Since that order is oldest first, 
+        a memory evicting in fifo order never overwrites a transition before it is written 
+        as long as at least one chunk is written per transition stored.
+
+    :type replay_memory: replay memory class
+    :param replay_memory: the memory to snapshot
+
+    :type filepath: string
+    :param filepath: file to write the snapshot to
+
+    :type chunk_size: int
+    :param chunk_size: number of transitions written per chunk
+    """
+    pointers = replay_memory.snapshot_pointers()
+    order = replay_memory.snapshot_order()
+    names = sorted(pointers.keys())
+    header = np.array([tuple(pointers[name] for name in names)], 
+        dtype=[(name, 'int64') for name in names])
+
+    with open(filepath, 'wb') as f:
+        np.lib.format.write_array(f, header)
+        for start in range(0, len(order), chunk_size):
+            indices = order[start:start + chunk_size]
+            for name in replay_memory.snapshot_fields:
+                np.lib.format.write_array(f, getattr(replay_memory, name).take(indices, axis=0))
+            yield start + len(indices)
+
+def save_snapshot(replay_memory, filepath, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """
+    :description: writes a complete snapshot of a replay memory at once
+    """
+    for _ in snapshot_writer(replay_memory, filepath, chunk_size):
+        pass
+
+def load_snapshot(replay_memory, filepath):
+    """
+    :description: reads a snapshot written by snapshot_writer into the first slots of the 
+        buffers of a replay memory of the same type and sets its pointers accordingly
+    """
+    with open(filepath, 'rb') as f:
+        header = np.lib.format.read_array(f)
+        pointers = dict((name, int(header[name][0])) for name in header.dtype.names)
+        size = pointers['size']
+        if size > replay_memory.capacity:
+            raise ValueError('snapshot in {} holds {} transitions, more than the capacity {}'.format(
+                filepath, size, replay_memory.capacity))
+
+        loaded = 0
+        while loaded < size:
+            chunk = [np.lib.format.read_array(f) for name in replay_memory.snapshot_fields]
+            if replay_memory.states is None:
+                replay_memory.initialize_buffers(chunk[0].shape[1:])
+            for name, values in zip(replay_memory.snapshot_fields, chunk):
+                getattr(replay_memory, name)[loaded:loaded + len(values)] = values
+            loaded += len(chunk[0])
 
+    replay_memory.restore_pointers(pointers)
@@ -0,0 +1,136 @@
+"""
+:description: opt-in instrumentation of a replay memory. Wrapping a memory in an 
+    InstrumentedReplayMemory collects occupancy, sampling time and statistics of the sampled 
+    transitions, which the agent passes to the logger at the end of each epoch. An unwrapped 
+    memory does none of this work.
+"""
+import numpy as np
+import time
+
+# sampled transitions are counted by age in buckets, bucket b holding ages a with 
+# 2^b <= a + 1 < 2^(b + 1), and the last bucket everything older
+NUM_AGE_BUCKETS = 32
+
+class InstrumentedReplayMemory(object):
+    """
+    :description: wraps a ReplayMemory or SequenceReplayMemory (or one of their subclasses) 
+        and records statistics about what is stored and sampled. The age of a sampled 
+        transition is the number of transitions stored after it. When combined with a 
+        PrefetchingReplayMemory, this wrapper goes inside the prefetcher so that each sampled 
+        batch is matched with the transitions it was gathered from.
+    """
+
+    def __init__(self, replay_memory):
+        """
+        :type replay_memory: replay memory class (see replay_memory.py)
+        :param replay_memory: the memory to instrument
+        """
+        self.replay_memory = replay_memory
+        self.batch_fields = replay_memory.batch_fields
+        # the number of transitions stored before the one in each slot
+        self.stored_steps = np.zeros(replay_memory.capacity, dtype='int64')
+        self.num_stored = 0
+        self.reset_stats()
+
+    def __getattr__(self, name):
+        # everything not defined by the wrapper, e.g., capacity, is read from the wrapped memory
+        if name == 'replay_memory':
+            raise AttributeError(name)
+        return getattr(self.replay_memory, name)
+
+    def reset_stats(self):
+        """
+        :description: clears the statistics of the sampled batches
+        """
+        self.num_batches = 0
+        self.num_samples = 0
+        self.sample_time = 0.
+        self.max_sample_time = 0.
+        self.num_terminal_samples = 0
+        self.num_rewarded_samples = 0
+        self.age_counts = np.zeros(NUM_AGE_BUCKETS, dtype='int64')
+
+    def store(self, *args, **kwargs):
+        index = self.replay_memory.store(*args, **kwargs)
+        if index is not None:
+            self.stored_steps[index] = self.num_stored
+        self.num_stored += 1
+        return index
+
+    def sample_batch(self):
+        start = time.time()
+        batch = self.replay_memory.sample_batch()
+        self.record_batch(batch, time.time() - start, 1)
+        return batch
+
+    def sample_batches(self, num_batches):
+        start = time.time()
+        batches = self.replay_memory.sample_batches(num_batches)
+        self.record_batch(batches, time.time() - start, num_batches)
+        return batches
+
+    def record_batch(self, batch, duration, num_batches):
+        """
+        :description: updates the statistics with a sampled batch, or num_batches of them 
+            stacked, that took duration seconds to sample
+        """
+        self.num_batches += num_batches
+        self.sample_time += duration
+        self.max_sample_time = max(self.max_sample_time, duration)
+
+        values = dict(zip(self.batch_fields, batch))
+        self.num_samples += values['rewards'].size
+        self.num_terminal_samples += np.count_nonzero(values['terminals'])
+        self.num_rewarded_samples += np.count_nonzero(values['rewards'] > 0)
+
+        indices = getattr(self.replay_memory, 'sampled_indices', None)
+        if indices is not None:
+            ages = self.num_stored - 1 - self.stored_steps[indices.reshape(-1)]
+            self.age_counts += np.bincount(age_buckets(ages), minlength=NUM_AGE_BUCKETS)
+
+    def fill_level(self):
+        """
+        :description: fraction of the capacity holding transitions
+        """
+        return self.replay_memory.size / float(self.replay_memory.capacity)
+
+    def bytes_used(self):
+        """
+        :description: number of bytes allocated for the transitions
+        """
+        # a concurrent memory adds up the buffers of its shards
+        if hasattr(self.replay_memory, 'bytes_used'):
+            return self.replay_memory.bytes_used()
+        buffers = [getattr(self.replay_memory, name, None) for name in self.replay_memory.snapshot_fields]
+        return sum(buffer.nbytes for buffer in buffers if buffer is not None)
+
+    def collect_stats(self):
+        """
+        :description: returns the statistics gathered since the last call as a dict and 
+            starts over. Sample times are in milliseconds.
+        """
+        num_batches = max(self.num_batches, 1)
+        num_samples = float(max(self.num_samples, 1))
+        stats = {
+            'fill_level': self.fill_level(),
+            'bytes_used': self.bytes_used(),
+            'batches': self.num_batches,
+            'mean_sample_ms': 1000 * self.sample_time / num_batches,
+            'max_sample_ms': 1000 * self.max_sample_time,
+            'terminal_fraction': self.num_terminal_samples / num_samples,
+            'rewarded_fraction': self.num_rewarded_samples / num_samples,
+            'age_histogram': self.age_counts
+        }
+        # a sequence memory samples only complete windows, every other stored step is skipped
+        if hasattr(self.replay_memory, 'num_valid'):
+            stats['invalid_windows'] = self.replay_memory.size - self.replay_memory.num_valid
+        self.reset_stats()
+        return stats
+
+def age_buckets(ages):
+    """
+    :description: the buckets of the histogram of sample ages that the given ages fall in. 
+        Transitions stored before the memory was wrapped count as age zero.
+    """
+    buckets = np.floor(np.log2(np.maximum(ages, 0) + 1)).astype('int64')
+    return np.minimum(buckets, NUM_AGE_BUCKETS - 1)
@@ -0,0 +1,74 @@
+"""
+:description: measures how the rate at which actor processes store transitions in a
+    SharedReplayMemory scales with the number of actors on a MazeMDP, while the main process
+    samples minibatches from it as a learner would.
+"""
+import multiprocessing
+import random
+import sys
+import time
+
+import mdps
+import replay_memory
+import state_adapters
+
+ROOM_SIZE = 5
+NUM_ROOMS = 2
+STEPS_PER_ACTOR = 50000
+CAPACITY = 100000
+BATCH_SIZE = 32
+
+def run_actor(memory, writer_id, num_steps):
+    """
+    :description: acts randomly in a maze and stores every transition in the shared memory
+    """
+    memory.attach_writer(writer_id)
+    random.seed(writer_id)
+    mdp = mdps.MazeMDP(room_size=ROOM_SIZE, num_rooms=NUM_ROOMS)
+    actions = mdp.get_actions()
+
+    state = mdp.get_start_state()
+    for step in xrange(num_steps):
+        action = random.randint(0, len(actions) - 1)
+        next_state, prob, reward = mdp.succ_prob_reward(state, actions[action])[0]
+        terminal = mdp.is_end_state(next_state)
+        memory.store((state, action, reward, next_state, terminal))
+        state = mdp.get_start_state() if terminal else next_state
+
+def run_trial(num_actors):
+    """
+    :description: runs num_actors actor processes to completion and returns the number of
+        transitions stored per second along with the number of minibatches sampled meanwhile
+    """
+    adapter = state_adapters.CoordinatesToRowColAdapter(room_size=ROOM_SIZE, num_rooms=NUM_ROOMS)
+    memory = replay_memory.SharedReplayMemory(BATCH_SIZE, CAPACITY, state_shape=(2, ),
+        num_writers=num_actors, state_adapter=adapter)
+    actors = [multiprocessing.Process(target=run_actor, args=(memory, idx, STEPS_PER_ACTOR))
+        for idx in range(num_actors)]
+
+    start = time.time()
+    for actor in actors:
+        actor.start()
+
+    num_batches = 0
+    while any(actor.is_alive() for actor in actors):
+        if not memory.is_empty():
+            memory.sample_batch()
+            num_batches += 1
+
+    for actor in actors:
+        actor.join()
+    duration = time.time() - start
+    return num_actors * STEPS_PER_ACTOR / duration, num_batches
+
+def run(max_actors):
+    print 'actors\ttransitions/s\tspeedup\tbatches sampled'
+    base_rate = None
+    for num_actors in range(1, max_actors + 1):
+        rate, num_batches = run_trial(num_actors)
+        base_rate = base_rate or rate
+        print '{}\t{:.0f}\t\t{:.2f}\t{}'.format(num_actors, rate, rate / base_rate, num_batches)
+
+if __name__ == '__main__':
+    max_actors = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    run(max_actors)
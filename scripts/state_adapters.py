@@ -28,6 +28,19 @@ class CoordinatesToSingleRoomRowColAdapter(object):
 
         return formatted_state
 
+    def convert_states_to_agent_format(self, states, dtype='float64', out=None):
+        """
+        Vectorized version of convert_state_to_agent_format for an array of 
+        states of shape (N, 2), returns an array of shape (N, 2 * room_size)
+        that is written to out if provided
+        """
+        states = np.asarray(states)
+        rows = np.arange(len(states))
+        formatted_states = allocate_or_clear(out, (len(states), 2 * self.room_size), dtype)
+        formatted_states[rows, states[:, 0] % self.room_size] = 1
+        formatted_states[rows, self.room_size + states[:, 1] % self.room_size] = 1
+        return formatted_states
+
 class CoordinatesToRowColAdapter(object):
 
     def __init__(self, room_size, num_rooms):
@@ -56,6 +69,20 @@ class CoordinatesToRowColAdapter(object):
 
         return formatted_state
 
+    def convert_states_to_agent_format(self, states, dtype='float64', out=None):
+        """
+        Vectorized version of convert_state_to_agent_format for an array of 
+        states of shape (N, 2), returns an array of shape (N, 2 * room_size * num_rooms)
+        that is written to out if provided
+        """
+        states = np.asarray(states)
+        rows = np.arange(len(states))
+        grid_size = self.room_size * self.num_rooms
+        formatted_states = allocate_or_clear(out, (len(states), 2 * grid_size), dtype)
+        formatted_states[rows, states[:, 0]] = 1
+        formatted_states[rows, grid_size + states[:, 1]] = 1
+        return formatted_states
+
 class CoordinatesToRowColRoomAdapter(object):
 
     def __init__(self, room_size, num_rooms):
@@ -80,8 +107,8 @@ class CoordinatesToRowColRoomAdapter(object):
         col = np.zeros(self.room_size)
         col[cidx % self.room_size] = 1
         room = np.zeros(self.num_rooms ** 2)
-        room_row = cidx / self.room_size
-        room_col = ridx / self.room_size
+        room_row = cidx // self.room_size
+        room_col = ridx // self.room_size
         room_idx = room_row * self.num_rooms + room_col
         room[room_idx] = 1
         # concat the three vectors
@@ -89,6 +116,23 @@ class CoordinatesToRowColRoomAdapter(object):
 
         return formatted_state
 
+    def convert_states_to_agent_format(self, states, dtype='float64', out=None):
+        """
+        Vectorized version of convert_state_to_agent_format for an array of 
+        states of shape (N, 2), returns an array of shape (N, 2 * room_size + num_rooms ** 2)
+        that is written to out if provided
+        """
+        states = np.asarray(states)
+        ridx, cidx = states[:, 0], states[:, 1]
+        rows = np.arange(len(states))
+        formatted_states = allocate_or_clear(out, (len(states), 2 * self.room_size + self.num_rooms ** 2), 
+            dtype)
+        formatted_states[rows, ridx % self.room_size] = 1
+        formatted_states[rows, self.room_size + cidx % self.room_size] = 1
+        room_idx = (cidx // self.room_size) * self.num_rooms + ridx // self.room_size
+        formatted_states[rows, 2 * self.room_size + room_idx] = 1
+        return formatted_states
+
 class CoordinatesToFlattenedGridAdapter(object):
 
     def __init__(self, room_size):
@@ -117,3 +161,22 @@ class IdentityAdapter(object):
         Returns the state as is. Exists to keep the interface consistent.
         """
         return state
+
+    def convert_states_to_agent_format(self, states, dtype='float64', out=None):
+        """
+        Returns the states as an array of the given dtype.
+        """
+        if out is None:
+            return np.asarray(states, dtype=dtype)
+        out[...] = states
+        return out
+
+def allocate_or_clear(out, shape, dtype):
+    """
+    Returns a zeroed array of the given shape to write converted states to, 
+    which is out if provided so that no memory is allocated
+    """
+    if out is None:
+        return np.zeros(shape, dtype=dtype)
+    out[...] = 0
+    return out
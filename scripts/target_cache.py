@@ -0,0 +1,78 @@
+"""
+:description: a cache of the bootstrapped values max_a' Q_target(s', a') computed by the target
+    network. The target network only changes when it is reset, so between resets the value of a
+    stored transition can be reused every time the transition is sampled again, and the networks
+    only forward the next states that missed the cache.
+"""
+import numpy as np
+import theano
+
+class TargetValueCache(object):
+    """
+    :description: direct mapped cache of bootstrapped values keyed by the transition ids that a
+        replay memory includes in its minibatches (see replay_memory.py). Id k is held in entry
+        k % size, which is the replay slot of the transition when size equals the capacity of a
+        memory evicting in fifo order. Every entry records the id it holds and the generation
+        of the target network its value was computed with, so resetting the target network
+        invalidates all entries at once by starting a new generation, and an entry whose slot
+        was overwritten by a newer transition no longer matches the id sampled.
+    """
+
+    def __init__(self, size):
+        """
+        :type size: int
+        :param size: number of entries, at least the capacity of the replay memory so that
+            the transitions it holds do not evict each other
+        """
+        self.size = size
+        self.ids = -np.ones(size, dtype='int64')
+        self.generations = -np.ones(size, dtype='int64')
+        self.values = np.zeros(size, dtype=theano.config.floatX)
+        self.generation = 0
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def invalidate(self):
+        """
+        :description: discards every cached value, called whenever the target network is reset
+        """
+        self.generation += 1
+
+    def get(self, ids, compute_values):
+        """
+        :description: returns the bootstrapped values of the transitions with the given ids as a
+            (N, 1) floatX column, computing those that are not cached
+
+        :type ids: np.array(dtype='int64')
+        :param ids: the transition_ids of a minibatch, shape = (N,)
+
+        :type compute_values: function
+        :param compute_values: given the positions in the minibatch of the values missing from
+            the cache, returns those values computed with the target network
+        """
+        ids = np.asarray(ids).reshape(-1)
+        entries = ids % self.size
+        hits = (self.ids[entries] == ids) & (self.generations[entries] == self.generation)
+        misses = np.flatnonzero(~hits)
+
+        # read the cached values before storing the computed ones, since two ids of the
+        # minibatch may share an entry
+        values = self.values[entries]
+        if len(misses) > 0:
+            values[misses] = np.asarray(compute_values(misses)).reshape(-1)
+            self.values[entries[misses]] = values[misses]
+            self.ids[entries[misses]] = ids[misses]
+            self.generations[entries[misses]] = self.generation
+
+        self.num_hits += len(ids) - len(misses)
+        self.num_misses += len(misses)
+        return values.reshape(-1, 1)
+
+    def hit_rate(self):
+        """
+        :description: fraction of the values requested so far that were cached
+        """
+        num_requests = self.num_hits + self.num_misses
+        if num_requests == 0:
+            return 0.
+        return self.num_hits / float(num_requests)
@@ -0,0 +1,70 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
+
+import eviction
+import replay_memory
+
+class TestReservoirEviction(unittest.TestCase):
+
+    def test_keeps_uniform_sample_of_all_transitions(self):
+        capacity = 100
+        num_transitions = 1000
+        counts = np.zeros(num_transitions)
+        for trial in range(100):
+            rm = replay_memory.ReplayMemory(batch_size=1, capacity=capacity, eviction='reservoir')
+            for idx in range(num_transitions):
+                rm.store((np.zeros(1), 0, idx, np.zeros(1), 0))
+            self.assertEquals(rm.size, capacity)
+            counts[rm.rewards[:, 0].astype(int)] += 1
+
+        # each transition is kept with probability capacity / num_transitions
+        first_half, second_half = counts[:500].sum(), counts[500:].sum()
+        self.assertTrue(abs(first_half - second_half) < .1 * (first_half + second_half))
+
+    def test_discarded_transition_not_stored(self):
+        rm = replay_memory.ReplayMemory(batch_size=1, capacity=2, eviction='reservoir')
+        indices = [rm.store((np.zeros(1), 0, idx, np.zeros(1), idx % 2)) for idx in range(100)]
+        self.assertTrue(None in indices)
+        self.assertEquals(rm.last_index, 99)
+        self.assertEquals(rm.terminal_count, int(rm.terminals.sum()))
+
+class TestRewardedEpisodeEviction(unittest.TestCase):
+
+    def store_episode(self, rm, length, final_reward, tag):
+        for step in range(length):
+            reward = final_reward if step == length - 1 else -.01
+            rm.store((np.ones(1) * tag, 0, reward, np.ones(1) * tag, step == length - 1))
+
+    def test_keeps_rewarded_episode_over_unrewarded_ones(self):
+        rm = replay_memory.ReplayMemory(batch_size=1, capacity=20, eviction='rewarded_episodes')
+        self.store_episode(rm, 5, 1, tag=1)
+        for episode in range(10):
+            self.store_episode(rm, 5, -.01, tag=2 + episode)
+        self.assertEquals(np.sum(rm.states[:, 0] == 1), 5)
+
+    def test_protects_at_most_half_of_the_memory(self):
+        rm = replay_memory.ReplayMemory(batch_size=1, capacity=10, eviction='rewarded_episodes')
+        self.store_episode(rm, 10, 1, tag=1)
+        for episode in range(10):
+            self.store_episode(rm, 5, -.01, tag=2 + episode)
+        self.assertEquals(np.sum(rm.states[:, 0] == 1), 5)
+        self.assertEquals(rm.eviction_policy.num_protected, 5)
+        self.assertEquals(rm.size, 10)
+
+class TestEvictionPolicies(unittest.TestCase):
+
+    def test_policies_choose_slots_in_range(self):
+        for name, policy_class in eviction.EVICTION_POLICIES.items():
+            rm = replay_memory.ReplayMemory(batch_size=1, capacity=10, eviction=name)
+            for idx in range(100):
+                index = rm.store((np.zeros(1), 0, idx, np.zeros(1), idx % 7 == 0))
+                self.assertTrue(index is None or 0 <= index < 10)
+            self.assertEquals(rm.size, 10)
+            self.assertTrue(isinstance(rm.eviction_policy, policy_class))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import theano
+import unittest
+import warnings
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
+
+import function_cache
+
+def build_function(cache, value, settings={'network': 'test'}):
+    # a function reading and updating a shared variable of its own, like a network's train
+    x = theano.shared(np.ones(2, dtype=theano.config.floatX) * value, name='x')
+    fn = function_cache.compile_function(cache, settings, 'double', [], x * 2, updates={x: x + 1})
+    return fn, x
+
+class TestCompiledFunctionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_identical_function_is_reused_with_its_own_shared_variables(self):
+        cache = function_cache.CompiledFunctionCache()
+        first_fn, first_x = build_function(cache, 1)
+        second_fn, second_x = build_function(cache, 5)
+
+        self.assertEquals(second_fn().tolist(), [10, 10])
+        self.assertEquals(second_x.get_value().tolist(), [6, 6])
+        self.assertEquals(first_x.get_value().tolist(), [1, 1])
+        self.assertEquals(first_fn().tolist(), [2, 2])
+        self.assertEquals(cache.summary()['compiled'][0], 1)
+        self.assertEquals(cache.summary()['memory'][0], 1)
+
+    def test_function_is_loaded_from_disk(self):
+        build_function(function_cache.CompiledFunctionCache(self.directory), 1)
+        cache = function_cache.CompiledFunctionCache(self.directory)
+        fn, x = build_function(cache, 3)
+
+        self.assertEquals(fn().tolist(), [6, 6])
+        self.assertEquals(x.get_value().tolist(), [4, 4])
+        self.assertEquals(cache.summary().keys(), ['disk'])
+
+    def test_unreadable_function_warns_and_compiles(self):
+        cache = function_cache.CompiledFunctionCache(self.directory)
+        key = function_cache.cache_key({'network': 'test'}, 'double')
+        with open(cache.filepath(key), 'wb') as f:
+            f.write('not a pickle')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            fn, x = build_function(cache, 1)
+        self.assertEquals(fn().tolist(), [2, 2])
+        self.assertTrue(any('unable to load' in str(w.message) for w in caught))
+
+    def test_reused_functions_return_outputs_as_the_template_does(self):
+        cache = function_cache.CompiledFunctionCache(self.directory)
+        first_fn, _ = build_function(cache, 1)
+        second_fn, _ = build_function(cache, 1)
+        loaded_fn, _ = build_function(function_cache.CompiledFunctionCache(self.directory), 1)
+        self.assertTrue(isinstance(first_fn(), np.ndarray))
+        self.assertEquals(second_fn().shape, first_fn().shape)
+        self.assertEquals(loaded_fn().shape, first_fn().shape)
+
+        x = theano.shared(np.ones(2, dtype=theano.config.floatX), name='x')
+        outputs = [function_cache.compile_function(cache, {'network': 'test'}, 'list', [], [x * 2])() 
+            for _ in range(2)]
+        self.assertTrue(all(isinstance(output, list) and len(output) == 1 for output in outputs))
+
+    def test_different_settings_compile_again(self):
+        cache = function_cache.CompiledFunctionCache()
+        build_function(cache, 1)
+        build_function(cache, 1, settings={'network': 'other'})
+        self.assertEquals(cache.summary()['compiled'][0], 2)
+        self.assertTrue('compiled 2 functions' in cache.report())
+
+    def test_compile_without_cache(self):
+        fn, x = build_function(None, 2)
+        self.assertEquals(fn().tolist(), [4, 4])
+
+if __name__ == '__main__':
+    unittest.main()
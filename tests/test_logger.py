@@ -1,3 +1,4 @@
+import collections
 import matplotlib.pyplot as plt
 import numpy as np
 import os
@@ -75,6 +76,16 @@ class testLoggerGraphing(unittest.TestCase):
         self.assertTrue(os.path.isfile(os.path.join(log_dir, 'rewards_graph.png')))
         shutil.rmtree(log_dir)
         
+class TestNeuralLoggerFunctionCache(unittest.TestCase):
+
+    def test_log_function_cache_writes_report(self):
+        l = logger.NeuralLogger(agent_name='test', verbose=False)
+        report = 'compiled 2 functions in 1.00s, memory 3 functions in 0.01s, disk 0 functions in 0.00s'
+        l.log_function_cache(collections.namedtuple('Cache', ['report'])(lambda: report))
+        with open(os.path.join(l.log_dir, 'function_cache.txt')) as f:
+            self.assertEquals(f.read().strip(), report)
+        shutil.rmtree(l.log_dir)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -39,5 +39,35 @@ class TestNeuralAgent(unittest.TestCase):
         e = experiment.Experiment(mdp, a, num_epochs, epoch_length, test_epoch_length, max_steps, run_tests, value_logging=False)
         e.run()
 
+class TestObservationWindow(unittest.TestCase):
+
+    def test_window_holds_last_states_oldest_first(self):
+        window = agent.ObservationWindow(3, (2, ))
+        self.assertEquals(window.window().shape, (1, 3, 2))
+        for idx in range(1, 6):
+            window.push(np.ones(2) * idx)
+            expected = [max(step, 0) for step in range(idx - 2, idx + 1)]
+            self.assertEquals(window.window()[0, :, 0].tolist(), expected)
+            self.assertTrue(window.window().flags['C_CONTIGUOUS'])
+
+    def test_reset_zeros_window(self):
+        window = agent.ObservationWindow(2, (1, ))
+        window.push(np.ones(1))
+        window.reset()
+        window.push(np.ones(1) * 2)
+        self.assertEquals(window.window()[0, :, 0].tolist(), [0, 2])
+
+class TestSampleMinibatches(unittest.TestCase):
+
+    def test_memory_without_sample_batches_is_sampled_per_minibatch(self):
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=2, capacity=4)
+        for idx in range(4):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2) * idx, 0))
+        rewards = []
+        for minibatch in agent.sample_minibatches(rm, 3):
+            self.assertEquals(minibatch[2].shape, (2, 1))
+            rewards.append(minibatch[2].copy())
+        self.assertEquals(len(rewards), 3)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
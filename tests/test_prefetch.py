@@ -0,0 +1,73 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
+
+import prefetch
+import replay_memory
+
+class TestPrefetchingReplayMemory(unittest.TestCase):
+
+    def fill(self, rm, num_transitions):
+        for idx in range(num_transitions):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2) * (idx + 1), 0))
+
+    def test_sample_batch_returns_batches_of_wrapped_memory(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_memory.ReplayMemory(batch_size=5, capacity=10), 
+            queue_depth=2)
+        self.fill(rm, 10)
+        self.assertTrue(rm.is_full())
+        self.assertEquals(rm.batch_fields, replay_memory.ReplayMemory.batch_fields)
+        self.assertEquals(rm.capacity, 10)
+
+        for _ in range(20):
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+            self.assertEquals(states.shape, (5, 2))
+            self.assertEquals(states[:, 0].tolist(), rewards[:, 0].tolist())
+        rm.close()
+        self.assertEquals(rm.num_batches, 20)
+        self.assertTrue(rm.num_stalls <= rm.num_batches)
+        self.assertTrue(rm.batches.empty())
+
+    def test_sample_batches_stacks_prefetched_batches(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_memory.ReplayMemory(batch_size=5, capacity=10), 
+            queue_depth=2)
+        self.fill(rm, 10)
+
+        for _ in range(5):
+            states, actions, rewards, next_states, terminals = rm.sample_batches(4)
+            self.assertEquals(states.shape, (4, 5, 2))
+            self.assertEquals(states[:, :, 0].tolist(), rewards[:, :, 0].tolist())
+            self.assertEquals((next_states[:, :, 0] - 1).tolist(), rewards[:, :, 0].tolist())
+        rm.close()
+        self.assertEquals(rm.num_batches, 20)
+
+    def test_queue_depth_bounds_prefetched_batches(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_memory.ReplayMemory(batch_size=5, capacity=10), 
+            queue_depth=3)
+        self.fill(rm, 10)
+        rm.sample_batch()
+        while not rm.batches.full():
+            pass
+        self.assertEquals(rm.batches.qsize(), 3)
+        rm.close()
+
+    def test_sampling_error_is_raised_to_learner(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_memory.SequenceReplayMemory(2, 2, 5, 10))
+        self.assertRaises(Exception, rm.sample_batch)
+        rm.close()
+
+    def test_storing_while_prefetching(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_memory.ReplayMemory(batch_size=5, capacity=10, 
+            eviction='fifo'))
+        self.fill(rm, 10)
+        for idx in range(100):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2) * (idx + 1), 0))
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+            self.assertEquals(states[:, 0].tolist(), rewards[:, 0].tolist())
+        rm.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -107,6 +107,21 @@ class TestQNetworkGetQValues(unittest.TestCase):
             q_values = network.get_q_values(state) 
             self.assertTrue(max(abs(q_values)) < 2)
 
+    def test_get_q_values_batch_matches_single_states(self):
+        network = qnetwork.QNetwork(input_shape=2, batch_size=100, num_hidden_layers=1, 
+            num_actions=4, num_hidden=10, discount=1, learning_rate=1e-2, regularization=0, 
+            update_rule='adam', freeze_interval=1000, rng=None)
+        training_states = network.states_shared.get_value(borrow=True)
+
+        states = np.array([[1, 1], [-1, -1], [-1, 1]])
+        q_values = network.get_q_values_batch(states)
+        self.assertEquals(q_values.shape, (3, 4))
+        for state, values in zip(states, q_values):
+            self.assertTrue(np.allclose(network.get_q_values(state), values))
+
+        # inference never writes to the inputs of training
+        self.assertTrue(network.states_shared.get_value(borrow=True) is training_states)
+
 class TestQNetworkGetParams(unittest.TestCase):
 
     def test_params_retrievable(self):
@@ -239,6 +254,197 @@ class TestQNetworkTrain(unittest.TestCase):
                 Q['s1_a0'] = s1[0]
                 Q['s1_a1'] = s1[1]
 
+class TestQNetworkTargetCache(unittest.TestCase):
+
+    def build_network(self, target_cache_size=None):
+        return qnetwork.QNetwork(input_shape=2, batch_size=3, num_hidden_layers=1, num_actions=4, 
+            num_hidden=5, discount=.9, learning_rate=1e-2, regularization=0, update_rule='adam', 
+            freeze_interval=1000, rng=None, target_cache_size=target_cache_size)
+
+    def test_cached_target_values_match_computed_ones(self):
+        network = self.build_network()
+        cached_network = self.build_network(target_cache_size=10)
+        cached_network.set_params(network.get_params())
+
+        states = np.random.randn(3, 2).astype(theano.config.floatX)
+        actions = np.array([[0], [1], [2]], dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        next_states = np.random.randn(3, 2).astype(theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        transition_ids = np.arange(3)
+        for _ in range(3):
+            loss = network.train(states, actions, rewards, next_states, terminals)
+            cached_loss = cached_network.train(states, actions, rewards, next_states, terminals, 
+                transition_ids=transition_ids)
+            self.assertAlmostEqual(loss, cached_loss, places=5)
+
+        self.assertEquals(cached_network.target_cache.num_misses, 3)
+        self.assertEquals(cached_network.target_cache.num_hits, 6)
+
+    def test_reset_target_network_invalidates_cache(self):
+        network = self.build_network(target_cache_size=10)
+        next_states = np.random.randn(3, 2).astype(theano.config.floatX)
+        network.get_next_values(next_states, np.arange(3))
+        network.reset_target_network()
+        network.get_next_values(next_states, np.arange(3))
+        self.assertEquals(network.target_cache.num_misses, 6)
+
+class TestQNetworkTargetUpdates(unittest.TestCase):
+
+    def build_network(self, tau=None):
+        return qnetwork.QNetwork(input_shape=2, batch_size=3, num_hidden_layers=1, num_actions=4, 
+            num_hidden=5, discount=.9, learning_rate=1e-2, regularization=0, update_rule='adam', 
+            freeze_interval=1000, rng=None, tau=tau)
+
+    def train_once(self, network):
+        states = np.random.randn(3, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        network.train(states, actions, rewards, states, terminals)
+
+    def test_reset_target_network_copies_params(self):
+        network = self.build_network()
+        self.train_once(network)
+        self.train_once(network)
+        params = network.get_params()
+        target_params = lasagne.layers.helper.get_all_param_values(network.next_l_out)
+        self.assertFalse(all(np.allclose(p, t) for p, t in zip(params, target_params)))
+
+        network.reset_target_network()
+        target_params = lasagne.layers.helper.get_all_param_values(network.next_l_out)
+        self.assertTrue(all(np.allclose(p, t) for p, t in zip(params, target_params)))
+
+    def test_soft_update_moves_target_towards_params(self):
+        tau = .1
+        network = self.build_network(tau=tau)
+        self.train_once(network)
+        params = network.get_params()
+        target_params = lasagne.layers.helper.get_all_param_values(network.next_l_out)
+
+        # the soft update in train uses the params from before the update
+        self.train_once(network)
+        expected = [tau * p + (1 - tau) * t for p, t in zip(params, target_params)]
+        target_params = lasagne.layers.helper.get_all_param_values(network.next_l_out)
+        self.assertTrue(all(np.allclose(e, t, atol=1e-6) for e, t in zip(expected, target_params)))
+
+    def test_soft_updates_exclude_target_cache(self):
+        self.assertRaises(ValueError, qnetwork.QNetwork, 2, 3, 1, 4, 5, .9, 1e-2, 0, 'adam', 1000, 
+            None, target_cache_size=10, tau=.1)
+
+class TestQNetworkTrainBatches(unittest.TestCase):
+
+    def build_network(self, tau=None, target_cache_size=None, freeze_interval=2):
+        return qnetwork.QNetwork(input_shape=2, batch_size=3, num_hidden_layers=1, num_actions=4, 
+            num_hidden=5, discount=.9, learning_rate=1e-2, regularization=1e-4, update_rule='adam', 
+            freeze_interval=freeze_interval, rng=None, tau=tau, target_cache_size=target_cache_size)
+
+    def sample_batches(self, num_batches):
+        states = np.random.randn(num_batches, 3, 2).astype(theano.config.floatX)
+        actions = np.random.randint(0, 4, (num_batches, 3, 1)).astype('int32')
+        rewards = np.random.randn(num_batches, 3, 1).astype(theano.config.floatX)
+        next_states = np.random.randn(num_batches, 3, 2).astype(theano.config.floatX)
+        terminals = np.zeros((num_batches, 3, 1), dtype='int32')
+        return states, actions, rewards, next_states, terminals
+
+    def assert_matches_sequential_updates(self, network, batch_network, **kwargs):
+        batch_network.set_params(network.get_params())
+        batches = self.sample_batches(5)
+        losses = []
+        for k in range(5):
+            losses.append(network.train(*[values[k] for values in batches]))
+        batch_losses = batch_network.train_batches(*batches, **kwargs)
+
+        self.assertEquals(batch_losses.shape, (5, ))
+        self.assertTrue(np.allclose(losses, batch_losses, atol=1e-5))
+        self.assertEquals(batch_network.td_errors.shape, (5, 3))
+        self.assertEquals(batch_network.update_counter, 5)
+        self.assertTrue(all(np.allclose(p, b, atol=1e-5) 
+            for p, b in zip(network.get_params(), batch_network.get_params())))
+
+    def test_train_batches_matches_sequential_updates(self):
+        # with a freeze interval of 2, the target network is reset within the stack
+        self.assert_matches_sequential_updates(self.build_network(), self.build_network())
+
+    def test_train_batches_with_float_freeze_interval(self):
+        self.assert_matches_sequential_updates(self.build_network(freeze_interval=2.), 
+            self.build_network(freeze_interval=2.))
+
+    def test_train_batches_matches_sequential_soft_updates(self):
+        self.assert_matches_sequential_updates(self.build_network(tau=.1), 
+            self.build_network(tau=.1))
+
+    def test_train_batches_with_target_cache(self):
+        network = self.build_network(target_cache_size=20)
+        self.assert_matches_sequential_updates(self.build_network(), network, 
+            transition_ids=np.arange(15).reshape(5, 3))
+        self.assertEquals(network.target_cache.num_misses, 15)
+
+class TestQNetworkLazyCompilation(unittest.TestCase):
+
+    def build_network(self, inference_only=False):
+        return qnetwork.QNetwork(input_shape=2, batch_size=3, num_hidden_layers=1, num_actions=4, 
+            num_hidden=5, discount=.9, learning_rate=1e-2, regularization=0, update_rule='adam', 
+            freeze_interval=1000, rng=None, inference_only=inference_only)
+
+    def test_functions_are_compiled_on_first_call(self):
+        network = self.build_network()
+        self.assertFalse(network.compiled('_get_q_values'))
+        self.assertFalse(network.compiled('_train'))
+
+        network.get_q_values(np.ones(2))
+        self.assertTrue(network.compiled('_get_q_values'))
+        self.assertFalse(network.compiled('_train'))
+
+        states = np.random.randn(3, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        network.train(states, actions, rewards, states, terminals)
+        self.assertTrue(network.compiled('_train'))
+
+    def test_target_network_starts_from_params(self):
+        network = self.build_network()
+        target_params = lasagne.layers.helper.get_all_param_values(network.next_l_out)
+        self.assertTrue(all(np.allclose(p, t) for p, t in zip(network.get_params(), target_params)))
+
+    def test_inference_only_network_matches_trained_network(self):
+        network = self.build_network()
+        inference_network = self.build_network(inference_only=True)
+        inference_network.set_params(network.get_params())
+        states = np.random.randn(5, 2).astype(theano.config.floatX)
+        self.assertTrue(np.allclose(network.get_q_values_batch(states), 
+            inference_network.get_q_values_batch(states)))
+        self.assertFalse(hasattr(inference_network, 'next_l_out'))
+
+    def test_inference_only_network_cannot_be_trained(self):
+        network = self.build_network(inference_only=True)
+        states = np.random.randn(3, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        self.assertRaises(ValueError, network.train, states, actions, rewards, states, terminals)
+        self.assertRaises(ValueError, qnetwork.QNetwork, 2, 3, 1, 4, 5, .9, 1e-2, 0, 'adam', 1000, 
+            None, target_cache_size=10, inference_only=True)
+
+class TestConvQNetworkTrain(unittest.TestCase):
+
+    def test_train_accepts_the_fields_of_every_replay_memory(self):
+        network = qnetwork.ConvQNetwork(input_shape=(2, 2), batch_size=3, num_actions=4, 
+            num_hidden=5, discount=.9, learning_rate=1e-2, regularization=0, update_rule='adam', 
+            freeze_interval=1000, rng=None)
+        states = np.random.randn(3, 1, 2, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        weights = np.zeros((3, 1), dtype=theano.config.floatX)
+        discounts = np.ones((3, 1), dtype=theano.config.floatX)
+
+        loss = network.train(states, actions, rewards, states, terminals, weights=weights, 
+            discounts=discounts, transition_ids=np.arange(3))
+        self.assertEquals(loss, 0)
+        self.assertEquals(network.td_errors.shape, (3, ))
+
 @unittest.skipIf(__name__ != '__main__', "this test class does not run unless this file is called directly")
 class TestQNetworkFullOperationFlattnedState(unittest.TestCase):
 
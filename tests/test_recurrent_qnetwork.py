@@ -176,8 +176,169 @@ class TestRecurrentQNetworkTrain(unittest.TestCase):
 
         self.assertEquals(loss_before_q_values, loss_after_q_values)
 
+class TestRecurrentQNetworkStoredState(unittest.TestCase):
+
+    def build_network(self, network_type='single_layer_gru', burn_in=2):
+        input_shape = 2
+        batch_size = 3
+        sequence_length = 2
+        num_actions = 4
+        num_hidden = 5
+        discount = 1
+        learning_rate = 1e-2 
+        update_rule = 'adam'
+        freeze_interval = 1000
+        regularization = 1e-4
+        rng = None
+        return recurrent_qnetwork.RecurrentQNetwork(input_shape, 
+                    sequence_length, batch_size, num_actions, num_hidden, 
+                    discount, learning_rate, regularization, update_rule, 
+                    freeze_interval, network_type, rng, burn_in=burn_in, stored_state=True)
+
+    def test_train_windows_include_burn_in_steps(self):
+        network = self.build_network()
+        states = np.ones((3, 4, 2), dtype=theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        hid_init = np.ones((3, 5), dtype=theano.config.floatX)
+
+        loss = network.train(states, actions, rewards, states, terminals, hid_init=hid_init, 
+            next_hid_init=hid_init)
+        self.assertTrue(np.isfinite(loss))
+
+    def test_step_advances_hidden_state(self):
+        network = self.build_network(network_type='single_layer_rnn')
+        hidden = np.zeros(5, dtype=theano.config.floatX)
+        q_values, next_hidden = network.step(np.ones(2), hidden)
+        self.assertEquals(q_values.shape, (4, ))
+        self.assertEquals(next_hidden.shape, (5, ))
+        other_q_values, _ = network.step(np.ones(2), next_hidden)
+        self.assertFalse(np.allclose(q_values, other_q_values))
+
+    def test_lstm_steps_hidden_and_cell_state(self):
+        network = self.build_network(network_type='single_layer_lstm')
+        self.assertEquals(network.state_size, 10)
+        q_values, next_hidden = network.step(np.ones(2), np.zeros(10, dtype=theano.config.floatX))
+        self.assertEquals(next_hidden.shape, (10, ))
+        self.assertFalse(np.allclose(next_hidden[5:], 0))
+
+        # the hidden state computed along with the cell state matches that of the lstm layer
+        sequences = np.random.randn(3, 4, 2).astype(theano.config.floatX)
+        hid_init = np.random.randn(3, 10).astype(theano.config.floatX)
+        states, hid_init_var = T.tensor3('states'), T.matrix('hid_init')
+        l_in, l_recurrent = recurrent_qnetwork.recurrent_layers(network.l_out)
+        hidden, final_state = theano.function([states, hid_init_var], 
+            [lasagne.layers.get_output(l_recurrent, network.window_inputs(network.l_out, states, 
+            hid_init_var)), network.get_final_state(network.l_out, states, hid_init_var)])(
+            sequences, hid_init)
+        self.assertTrue(np.allclose(hidden, final_state[:, :5], atol=1e-5))
+
+    def test_lstm_train_windows_include_burn_in_steps(self):
+        network = self.build_network(network_type='single_layer_lstm')
+        states = np.ones((3, 4, 2), dtype=theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        hid_init = np.ones((3, 10), dtype=theano.config.floatX)
+
+        loss = network.train(states, actions, rewards, states, terminals, hid_init=hid_init, 
+            next_hid_init=hid_init)
+        self.assertTrue(np.isfinite(loss))
+
+    def test_unsupported_network_type_raises(self):
+        self.assertRaises(ValueError, self.build_network, network_type='stacked_lstm')
+
+    def test_burn_in_requires_stored_state(self):
+        self.assertRaises(ValueError, recurrent_qnetwork.RecurrentQNetwork, 2, 2, 3, 4, 5, 1, 
+            1e-2, 1e-4, 'adam', 1000, 'single_layer_rnn', None, burn_in=2)
+
+class TestRecurrentQNetworkTargetCache(unittest.TestCase):
+
+    def build_network(self, target_cache_size=None):
+        return recurrent_qnetwork.RecurrentQNetwork(input_shape=2, sequence_length=3, 
+            batch_size=3, num_actions=4, num_hidden=5, discount=.9, learning_rate=1e-2, 
+            regularization=0, update_rule='adam', freeze_interval=1000, 
+            network_type='single_layer_rnn', rng=None, target_cache_size=target_cache_size)
+
+    def test_cached_target_values_match_computed_ones(self):
+        network = self.build_network()
+        cached_network = self.build_network(target_cache_size=10)
+        cached_network.set_params(network.get_params())
+
+        states = np.random.randn(3, 3, 2).astype(theano.config.floatX)
+        actions = np.array([[0], [1], [2]], dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        next_states = np.random.randn(3, 3, 2).astype(theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        for transition_ids in [np.arange(3), np.array([0, 3, 4])]:
+            loss = network.train(states, actions, rewards, next_states, terminals)
+            cached_loss = cached_network.train(states, actions, rewards, next_states, terminals, 
+                transition_ids=transition_ids)
+            self.assertAlmostEqual(loss, cached_loss, places=5)
+
+        # the second minibatch only forwards the two windows it did not share with the first
+        self.assertEquals(cached_network.target_cache.num_misses, 5)
+
+class TestRecurrentQNetworkLazyCompilation(unittest.TestCase):
+
+    def build_network(self, stored_state=False, inference_only=False):
+        return recurrent_qnetwork.RecurrentQNetwork(input_shape=2, sequence_length=3, 
+            batch_size=3, num_actions=4, num_hidden=5, discount=.9, learning_rate=1e-2, 
+            regularization=0, update_rule='adam', freeze_interval=1000, 
+            network_type='single_layer_rnn', rng=None, stored_state=stored_state, 
+            inference_only=inference_only)
+
+    def test_functions_are_compiled_on_first_call(self):
+        network = self.build_network()
+        self.assertFalse(network.compiled('_get_q_values'))
+        self.assertFalse(network.compiled('_train'))
+
+        network.get_q_values(np.ones((1, 3, 2), dtype=theano.config.floatX))
+        self.assertTrue(network.compiled('_get_q_values'))
+        self.assertFalse(network.compiled('_train'))
+
+        states = np.random.randn(3, 3, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        network.train(states, actions, rewards, states, terminals)
+        self.assertTrue(network.compiled('_train'))
+
+    def test_inference_only_network_matches_trained_network(self):
+        for stored_state in [False, True]:
+            network = self.build_network(stored_state=stored_state)
+            inference_network = self.build_network(stored_state=stored_state, inference_only=True)
+            inference_network.set_params(network.get_params())
+            sequences = np.random.randn(4, 3, 2).astype(theano.config.floatX)
+            self.assertTrue(np.allclose(network.get_q_values_batch(sequences), 
+                inference_network.get_q_values_batch(sequences)))
+            self.assertFalse(hasattr(inference_network, 'next_l_out'))
+
+    def test_inference_only_network_cannot_be_trained(self):
+        network = self.build_network(inference_only=True)
+        states = np.random.randn(3, 3, 2).astype(theano.config.floatX)
+        actions = np.zeros((3, 1), dtype='int32')
+        rewards = np.ones((3, 1), dtype=theano.config.floatX)
+        terminals = np.zeros((3, 1), dtype='int32')
+        self.assertRaises(ValueError, network.train, states, actions, rewards, states, terminals)
+
 class TestRecurrentQNetworkGetQValues(unittest.TestCase):
     
+    def test_get_q_values_batch_matches_single_sequences(self):
+        network = recurrent_qnetwork.RecurrentQNetwork(input_shape=2, sequence_length=3, 
+            batch_size=10, num_actions=4, num_hidden=5, discount=1, learning_rate=1e-2, 
+            regularization=0, update_rule='adam', freeze_interval=1000, 
+            network_type='single_layer_gru', rng=None)
+        training_states = network.states_shared.get_value(borrow=True)
+
+        sequences = np.random.randn(4, 3, 2).astype(theano.config.floatX)
+        q_values = network.get_q_values_batch(sequences)
+        self.assertEquals(q_values.shape, (4, 4))
+        for sequence, values in zip(sequences, q_values):
+            self.assertTrue(np.allclose(network.get_q_values(sequence[np.newaxis]), values))
+        self.assertTrue(network.states_shared.get_value(borrow=True) is training_states)
+
     def test_get_q_values_hid_init_impacts_q_values(self):
         input_shape = 2
         batch_size = 10
@@ -1,11 +1,17 @@
+import multiprocessing
 import numpy as np
 import os
+import shutil
 import sys
+import tempfile
+import threading
 import unittest
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
 
 import replay_memory
+import replay_stats
+import state_adapters
 
 class TestReplayMemorySampleBatch(unittest.TestCase):
 
@@ -71,6 +77,51 @@ class TestReplayMemorySampleBatch(unittest.TestCase):
         self.assertEquals(next_states.shape, expected_states_shape)
         self.assertEquals(terminals.shape, (batch_size, 1))
 
+class TestReplayMemoryStorage(unittest.TestCase):
+
+    def test_sampled_transitions_match_stored_transitions(self):
+        batch_size = 50
+        state_shape = 3
+        rm = replay_memory.ReplayMemory(batch_size, capacity=100)
+        for idx in range(100):
+            state = np.ones(state_shape) * idx
+            next_state = np.ones(state_shape) * (idx + 1)
+            rm.store((state, idx % 4, idx, next_state, idx % 2))
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        for state, action, reward, next_state, terminal in zip(states, actions, rewards, next_states, terminals):
+            idx = int(state[0])
+            self.assertEquals(next_state.tolist(), (np.ones(state_shape) * (idx + 1)).tolist())
+            self.assertEquals(action[0], idx % 4)
+            self.assertEquals(reward[0], idx)
+            self.assertEquals(terminal[0], idx % 2)
+
+    def test_fifo_eviction_keeps_most_recent_transitions(self):
+        batch_size = 10
+        capacity = 20
+        rm = replay_memory.ReplayMemory(batch_size, capacity=capacity, eviction='fifo')
+        for idx in range(55):
+            rm.store((np.ones(1) * idx, 0, 0, np.ones(1) * idx, 0))
+
+        self.assertTrue(rm.is_full())
+        self.assertEquals(rm.size, capacity)
+        self.assertEquals(sorted(rm.states[:, 0].tolist()), list(range(35, 55)))
+
+    def test_random_eviction_keeps_capacity_and_newest_transition(self):
+        batch_size = 10
+        capacity = 20
+        rm = replay_memory.ReplayMemory(batch_size, capacity=capacity)
+        for idx in range(55):
+            rm.store((np.ones(1) * idx, 0, 0, np.ones(1) * idx, idx % 3 == 0))
+            self.assertTrue(idx in rm.states[:, 0].tolist())
+
+        self.assertEquals(rm.size, capacity)
+        self.assertEquals(rm.last_index + 1 - rm.first_index, capacity)
+        self.assertEquals(rm.terminal_count, rm.terminals.sum())
+
+    def test_invalid_eviction_raises(self):
+        self.assertRaises(ValueError, replay_memory.ReplayMemory, 10, 20, 'lifo')
+
 class TestSequenceReplayMemorySampleBatch(unittest.TestCase):
 
     def test_minibatch_sample_shapes_1D_state_sequence_length_1(self):
@@ -207,6 +258,136 @@ class TestSequenceReplayMemorySampleBatch(unittest.TestCase):
         self.assertEquals(next_states.shape, expected_states_shape)
         self.assertEquals(terminals.shape, (batch_size, 1))
 
+class TestSequenceReplayMemoryStoredState(unittest.TestCase):
+
+    def test_sample_batch_includes_hidden_states_at_window_starts(self):
+        sequence_length = 3
+        rm = replay_memory.SequenceReplayMemory(1, sequence_length, batch_size=6, capacity=20, 
+            hidden_size=2)
+        self.assertEquals(rm.batch_fields, replay_memory.ReplayMemory.batch_fields + 
+            ('hid_init', 'next_hid_init'))
+        for idx in range(20):
+            rm.store(np.array([idx]), 0, idx, False, hidden=np.ones(2) * idx)
+
+        states, actions, rewards, next_states, terminals, hid_init, next_hid_init = rm.sample_batch()
+        self.assertEquals(hid_init.shape, (6, 2))
+        self.assertEquals(hid_init[:, 0].tolist(), states[:, 0, 0].tolist())
+        self.assertEquals(next_hid_init[:, 1].tolist(), next_states[:, 0, 0].tolist())
+
+    def test_n_step_next_hidden_state_follows_shifted_window(self):
+        rm = replay_memory.SequenceReplayMemory(1, 2, batch_size=8, capacity=20, n_step=3, 
+            discount=.5, hidden_size=1)
+        self.assertEquals(rm.batch_fields[-3:], ('discounts', 'hid_init', 'next_hid_init'))
+        for idx in range(20):
+            rm.store(np.array([idx]), 0, 1, idx % 7 == 6, hidden=np.ones(1) * idx)
+
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        self.assertEquals(batch['next_hid_init'][:, 0].tolist(), 
+            batch['next_states'][:, 0, 0].tolist())
+
+class TestSequenceReplayMemoryMirroredTail(unittest.TestCase):
+
+    def test_store_mirrors_first_slots(self):
+        rm = replay_memory.SequenceReplayMemory(1, 3, batch_size=2, capacity=6)
+        for idx in range(8):
+            rm.store(np.array([idx]), 0, 0, False)
+        self.assertEquals(rm.mirrored_states[:, 0].tolist(), [6, 7, 2, 3, 4, 5, 6, 7, 2])
+
+    def test_window_views_wrap_around_the_ring(self):
+        rm = replay_memory.SequenceReplayMemory(1, 3, batch_size=2, capacity=6)
+        for idx in range(8):
+            rm.store(np.array([idx]), 0, 0, False)
+        windows = rm.window_views(4)
+        self.assertEquals(windows[4, :, 0].tolist(), [4, 5, 6, 7])
+        self.assertEquals(windows[5, :, 0].tolist(), [5, 6, 7, 2])
+        self.assertRaises(ValueError, rm.window_views, 5)
+
+    def test_sampled_windows_wrapping_around_are_contiguous_steps(self):
+        rm = replay_memory.SequenceReplayMemory(1, 4, batch_size=32, capacity=10)
+        for idx in range(23):
+            rm.store(np.array([idx]), 0, idx, False)
+
+        for _ in range(5):
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+            self.assertTrue(np.all(np.diff(states[:, :, 0], axis=1) == 1))
+            self.assertEquals(states[:, -1, 0].tolist(), rewards[:, 0].tolist())
+            self.assertEquals(next_states[:, :, 0].tolist(), (states[:, :, 0] + 1).tolist())
+
+    def test_make_last_sequence_across_the_end_of_the_ring(self):
+        rm = replay_memory.SequenceReplayMemory(1, 4, batch_size=2, capacity=6)
+        for idx in range(7):
+            rm.store(np.array([idx]), 0, 0, False)
+        self.assertEquals(rm.make_last_sequence(np.array([7]))[:, 0].tolist(), [4, 5, 6, 7])
+
+    def test_make_last_sequence_of_one_step(self):
+        rm = replay_memory.SequenceReplayMemory(1, 1, batch_size=2, capacity=6)
+        for idx in range(8):
+            rm.store(np.array([idx + 1]), 0, 0, False)
+        self.assertEquals(rm.make_last_sequence(np.array([9])).tolist(), [[9]])
+
+    def test_snapshot_restores_mirrored_tail(self):
+        rm = replay_memory.SequenceReplayMemory(1, 3, batch_size=2, capacity=6)
+        for idx in range(4):
+            rm.store(np.array([idx + 1]), 0, 0, False)
+        directory = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(directory, 'snapshot')
+            replay_memory.save_snapshot(rm, filepath)
+            loaded = replay_memory.SequenceReplayMemory(1, 3, batch_size=2, capacity=6)
+            replay_memory.load_snapshot(loaded, filepath)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals(loaded.mirrored_states[6:, 0].tolist(), [1, 2, 3])
+
+class TestSequenceReplayMemoryValidEnds(unittest.TestCase):
+
+    def brute_force_valid_ends(self, rm):
+        valid = set()
+        for offset in range(rm.sequence_length - 1, rm.size - 1):
+            window = [(rm.bottom + offset - step) % rm.capacity for step in range(1, rm.sequence_length)]
+            if not any(rm.terminals[index] for index in window):
+                valid.add((rm.bottom + offset) % rm.capacity)
+        return valid
+
+    def test_incremental_index_matches_brute_force(self):
+        state_shape = 2
+        capacity = 37
+        for sequence_length in [1, 2, 5]:
+            rm = replay_memory.SequenceReplayMemory(state_shape, sequence_length, 10, capacity)
+            for idx in range(120):
+                rm.store(np.ones(state_shape) * idx, 0, 0, np.random.random() < .2)
+                actual = set(rm.valid_ends[:rm.num_valid].tolist())
+                self.assertEquals(actual, self.brute_force_valid_ends(rm))
+
+    def test_rebuild_matches_incremental_index(self):
+        state_shape = 2
+        sequence_length = 4
+        capacity = 50
+        rm = replay_memory.SequenceReplayMemory(state_shape, sequence_length, 10, capacity)
+        for idx in range(173):
+            rm.store(np.ones(state_shape) * idx, 0, 0, np.random.random() < .15)
+        expected = set(rm.valid_ends[:rm.num_valid].tolist())
+        expected_run = rm.nonterminal_run
+
+        rm.rebuild_valid_ends()
+        self.assertEquals(set(rm.valid_ends[:rm.num_valid].tolist()), expected)
+        self.assertEquals(rm.nonterminal_run, expected_run)
+
+    def test_short_episodes_long_sequences_sample_valid_windows(self):
+        batch_size = 500
+        state_shape = 1
+        sequence_length = 8
+        capacity = 1000
+        rm = replay_memory.SequenceReplayMemory(state_shape, sequence_length, batch_size, capacity)
+        for idx in range(1500):
+            rm.store(np.ones(state_shape) * idx, 0, 0, idx % 9 == 8)
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        steps = states[:, :, 0]
+        self.assertTrue(np.all(np.diff(steps, axis=1) == 1))
+        self.assertTrue(np.all(steps[:, :-1] % 9 != 8))
+        self.assertEquals(next_states[:, -1, 0].tolist(), (steps[:, -1] + 1).tolist())
+
 class TestSequenceReplayMemoryMakeLastSequence(unittest.TestCase):
 
     def test_make_last_sequence_basic_operation(self):
@@ -390,5 +571,731 @@ class TestSequenceReplayMemoryMakeLastSequence(unittest.TestCase):
         self.assertEquals(actual, expected)
         
 
+class TestMemmapSequenceReplayMemory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = os.path.join(tempfile.mkdtemp(), 'replay_memory')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.directory))
+
+    def test_minibatch_sample_shapes(self):
+        batch_size = 10
+        state_shape = 2
+        sequence_length = 2
+        capacity = 100
+        rm = replay_memory.MemmapSequenceReplayMemory(state_shape, sequence_length, batch_size, capacity, self.directory)
+        for idx in range(150):
+            rm.store(np.ones(state_shape) * idx, 0, 0, False)
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertEquals(states.shape, (batch_size, sequence_length, state_shape))
+        self.assertEquals(next_states.shape, (batch_size, sequence_length, state_shape))
+        self.assertEquals((next_states - states).sum(), batch_size * sequence_length * state_shape)
+
+    def test_reopen_restores_contents_and_pointers(self):
+        batch_size = 10
+        state_shape = 2
+        sequence_length = 3
+        capacity = 50
+        rm = replay_memory.MemmapSequenceReplayMemory(state_shape, sequence_length, batch_size, capacity, self.directory)
+        for idx in range(75):
+            rm.store(np.ones(state_shape) * idx, idx % 4, idx, False)
+        rm.close()
+        del rm
+
+        rm = replay_memory.MemmapSequenceReplayMemory(state_shape, sequence_length, batch_size, capacity, self.directory)
+        self.assertTrue(rm.is_full())
+        self.assertEquals((rm.bottom, rm.top, rm.size), (25, 25, 50))
+        self.assertEquals(rm.states[24].tolist(), [74, 74])
+        self.assertEquals(rm.actions[24], 74 % 4)
+        self.assertTrue(rm.terminals[24])
+
+        rm.store(np.ones(state_shape) * 75, 0, 0, False)
+        self.assertEquals(rm.states[25].tolist(), [75, 75])
+        self.assertEquals(rm.bottom, 26)
+
+    def test_reopen_with_different_layout_raises(self):
+        rm = replay_memory.MemmapSequenceReplayMemory(2, 2, 10, 50, self.directory)
+        rm.close()
+        self.assertRaises(ValueError, replay_memory.MemmapSequenceReplayMemory, 3, 2, 10, 50, self.directory)
+
+class TestSumTree(unittest.TestCase):
+
+    def test_total_after_updates(self):
+        tree = replay_memory.SumTree(5)
+        tree.update(0, 1.)
+        tree.update(3, 2.)
+        tree.update_batch(np.array([1, 4]), np.array([.5, .5]))
+        self.assertEquals(tree.total(), 4.)
+        tree.update(3, 0.)
+        self.assertEquals(tree.total(), 2.)
+
+    def test_find_returns_leaf_containing_value(self):
+        tree = replay_memory.SumTree(4)
+        tree.update_batch(np.arange(4), np.array([1., 0., 2., 1.]))
+        actual = tree.find(np.array([0., .5, 1.5, 2.9, 3.5])).tolist()
+        expected = [0, 0, 2, 2, 3]
+        self.assertEquals(actual, expected)
+
+    def test_find_never_returns_zero_priority_leaf(self):
+        tree = replay_memory.SumTree(7)
+        tree.update_batch(np.arange(7), np.array([0., 1., 0., 0., 1., 0., 0.]))
+        indices = tree.find(np.linspace(0, tree.total(), 100))
+        self.assertEquals(set(indices.tolist()), set([1, 4]))
+
+class TestPrioritizedReplayMemory(unittest.TestCase):
+
+    def test_minibatch_sample_shapes(self):
+        batch_size = 32
+        state_shape = 2
+        rm = replay_memory.PrioritizedReplayMemory(batch_size, capacity=100)
+        for idx in range(150):
+            rm.store((np.ones(state_shape), 0, 0, np.ones(state_shape), 0))
+
+        states, actions, rewards, next_states, terminals, weights, indices = rm.sample_batch()
+        self.assertEquals(states.shape, (batch_size, state_shape))
+        self.assertEquals(actions.shape, (batch_size, 1))
+        self.assertEquals(weights.shape, (batch_size, 1))
+        self.assertEquals(indices.shape, (batch_size,))
+        self.assertTrue(np.all(weights <= 1))
+
+    def test_high_td_error_transition_sampled_more_often(self):
+        batch_size = 10
+        rm = replay_memory.PrioritizedReplayMemory(batch_size, capacity=100, alpha=1.)
+        for idx in range(100):
+            rm.store((np.ones(1) * idx, 0, 0, np.ones(1) * idx, 0))
+
+        td_errors = np.zeros(100)
+        td_errors[7] = 100.
+        rm.update_priorities(np.arange(100), td_errors)
+        states = rm.sample_batch()[0]
+        self.assertTrue(np.sum(states[:, 0] == 7) > batch_size / 2)
+
+class TestPrioritizedSequenceReplayMemory(unittest.TestCase):
+
+    def test_sampled_windows_never_cross_episodes(self):
+        batch_size = 200
+        state_shape = 2
+        sequence_length = 3
+        capacity = 100
+        rm = replay_memory.PrioritizedSequenceReplayMemory(state_shape, sequence_length, batch_size, capacity)
+        for idx in range(250):
+            rm.store(np.ones(state_shape) * idx, 0, 0, idx % 7 == 6)
+
+        states, actions, rewards, next_states, terminals, weights, indices = rm.sample_batch()
+        self.assertEquals(states.shape, (batch_size, sequence_length, state_shape))
+        for state, next_state, terminal in zip(states, next_states, terminals):
+            steps = state[:, 0]
+            self.assertEquals(np.diff(steps).tolist(), [1] * (sequence_length - 1))
+            self.assertTrue(steps[0] >= 150)
+            self.assertTrue(all(step % 7 != 6 for step in steps[:-1]))
+            self.assertEquals(next_state[-1, 0], steps[-1] + 1)
+            self.assertEquals(terminal[0], steps[-1] % 7 == 6)
+
+    def test_update_priorities_changes_sampling(self):
+        batch_size = 10
+        state_shape = 1
+        sequence_length = 2
+        capacity = 50
+        rm = replay_memory.PrioritizedSequenceReplayMemory(state_shape, sequence_length, batch_size, capacity, alpha=1.)
+        for idx in range(50):
+            rm.store(np.ones(state_shape) * idx, 0, 0, False)
+
+        states, actions, rewards, next_states, terminals, weights, indices = rm.sample_batch()
+        td_errors = np.zeros(len(indices))
+        td_errors[0] = 1000.
+        rm.update_priorities(indices, td_errors)
+        states = rm.sample_batch()[0]
+        self.assertTrue(np.sum(states[:, -1, 0] == indices[0]) > batch_size / 2)
+
+class TestCompactReplayMemory(unittest.TestCase):
+
+    def test_sample_batch_decodes_raw_states(self):
+        adapter = state_adapters.CoordinatesToRowColAdapter(room_size=3, num_rooms=2)
+        rm = replay_memory.ReplayMemory(batch_size=8, capacity=10, state_adapter=adapter)
+        for idx in range(10):
+            rm.store((np.array([idx % 6, 0]), 0, idx, np.array([0, idx % 6]), 0))
+
+        self.assertEquals(rm.states.dtype, np.int32)
+        self.assertEquals(rm.states.shape, (10, 2))
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertEquals(states.shape, (8, 12))
+        self.assertEquals(states.dtype, replay_memory.theano.config.floatX)
+        for state, reward, next_state in zip(states, rewards, next_states):
+            expected = adapter.convert_state_to_agent_format((int(reward[0]) % 6, 0))
+            self.assertEquals(state.tolist(), expected.tolist())
+            expected = adapter.convert_state_to_agent_format((0, int(reward[0]) % 6))
+            self.assertEquals(next_state.tolist(), expected.tolist())
+
+    def test_sequence_sample_batch_decodes_raw_states(self):
+        adapter = state_adapters.CoordinatesToRowColAdapter(room_size=3, num_rooms=2)
+        sequence_length = 3
+        rm = replay_memory.SequenceReplayMemory(2, sequence_length, batch_size=5, capacity=20, 
+            state_adapter=adapter)
+        for idx in range(20):
+            rm.store(np.array([idx % 6, idx % 6]), 0, idx, False)
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertEquals(states.shape, (5, sequence_length, 12))
+        for sequence, reward in zip(states, rewards):
+            expected = adapter.convert_state_to_agent_format((int(reward[0]) % 6, ) * 2)
+            self.assertEquals(sequence[-1].tolist(), expected.tolist())
+
+    def test_make_last_sequence_decodes_raw_states(self):
+        adapter = state_adapters.CoordinatesToRowColAdapter(room_size=3, num_rooms=2)
+        rm = replay_memory.SequenceReplayMemory(2, 3, batch_size=1, capacity=10, 
+            state_adapter=adapter)
+        rm.store(np.array([1, 2]), 0, 0, False)
+        sequence = rm.make_last_sequence(np.array([3, 4]))
+
+        expected = np.zeros((3, 12))
+        expected[1] = adapter.convert_state_to_agent_format((1, 2))
+        expected[2] = adapter.convert_state_to_agent_format((3, 4))
+        self.assertEquals(sequence.tolist(), expected.tolist())
+
+class TestReplayMemorySnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'snapshot.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load_restores_transitions_and_pointers(self):
+        rm = replay_memory.ReplayMemory(batch_size=5, capacity=10, eviction='fifo')
+        for idx in range(25):
+            rm.store((np.ones(2) * idx, idx % 4, idx, np.ones(2) * (idx + 1), idx % 3 == 0))
+        rm.save(self.filepath)
+
+        loaded = replay_memory.ReplayMemory(batch_size=5, capacity=10, eviction='fifo')
+        loaded.load(self.filepath)
+        self.assertEquals(loaded.size, 10)
+        self.assertEquals(loaded.first_index, rm.first_index)
+        self.assertEquals(loaded.last_index, rm.last_index)
+        self.assertEquals(loaded.terminal_count, rm.terminal_count)
+        self.assertEquals(sorted(loaded.rewards[:, 0].tolist()), sorted(rm.rewards[:, 0].tolist()))
+
+        # the oldest transition is the next one evicted
+        loaded.store((np.ones(2) * 25, 0, 25, np.ones(2) * 26, 0))
+        self.assertEquals(sorted(loaded.rewards[:, 0].tolist()), list(range(16, 26)))
+
+    def test_streamed_snapshot_unaffected_by_stores_during_write(self):
+        sequence_length = 3
+        rm = replay_memory.SequenceReplayMemory(1, sequence_length, batch_size=5, capacity=20)
+        for idx in range(30):
+            rm.store(np.ones(1) * idx, 0, idx, idx % 7 == 6)
+
+        writer = replay_memory.snapshot_writer(rm, self.filepath, chunk_size=2)
+        for idx, written in enumerate(writer):
+            rm.store(np.ones(1) * (30 + idx), 0, 30 + idx, False)
+
+        loaded = replay_memory.SequenceReplayMemory(1, sequence_length, batch_size=5, capacity=20)
+        loaded.load(self.filepath)
+        self.assertEquals(loaded.size, 20)
+        self.assertEquals(loaded.rewards.tolist(), list(range(10, 30)))
+        self.assertTrue(loaded.terminals[-1])
+
+        states, actions, rewards, next_states, terminals = loaded.sample_batch()
+        for sequence in states:
+            steps = sequence[:, 0]
+            self.assertEquals(np.diff(steps).tolist(), [1] * (sequence_length - 1))
+            self.assertTrue(all(step % 7 != 6 for step in steps[:-1]))
+
+    def test_load_into_smaller_memory_raises(self):
+        rm = replay_memory.SequenceReplayMemory(1, 2, batch_size=5, capacity=20)
+        for idx in range(20):
+            rm.store(np.ones(1) * idx, 0, idx, False)
+        rm.save(self.filepath)
+
+        loaded = replay_memory.SequenceReplayMemory(1, 2, batch_size=5, capacity=10)
+        self.assertRaises(ValueError, loaded.load, self.filepath)
+
+class TestNStepReturns(unittest.TestCase):
+
+    def expected_n_step(self, rewards, terminals, start, n_step, discount, num_available):
+        total, steps = 0, 0
+        for step in range(n_step):
+            if step >= num_available:
+                break
+            total += discount ** step * rewards[start + step]
+            steps += 1
+            if terminals[start + step]:
+                break
+        return total, steps
+
+    def test_flat_memory_sums_rewards_within_episode(self):
+        n_step, discount = 3, .5
+        rm = replay_memory.ReplayMemory(batch_size=50, capacity=20, eviction='fifo', 
+            n_step=n_step, discount=discount)
+        self.assertEquals(rm.batch_fields[5], 'discounts')
+        rewards = [float(idx) for idx in range(30)]
+        terminals = [idx % 4 == 3 for idx in range(30)]
+        for idx in range(30):
+            rm.store((np.ones(1) * idx, 0, rewards[idx], np.ones(1) * (idx + 1), terminals[idx]))
+
+        states, actions, returns, next_states, batch_terminals, discounts = rm.sample_batch()
+        for state, ret, next_state, terminal, disc in zip(states, returns, next_states, 
+                batch_terminals, discounts):
+            start = int(state[0])
+            self.assertTrue(start >= 10)
+            expected, steps = self.expected_n_step(rewards, terminals, start, n_step, discount, 30 - start)
+            self.assertAlmostEqual(ret[0], expected, places=5)
+            self.assertEquals(next_state[0], start + steps)
+            self.assertEquals(terminal[0], terminals[start + steps - 1])
+            self.assertAlmostEqual(disc[0], discount ** steps, places=6)
+
+    def test_flat_memory_n_step_requires_fifo_and_discount(self):
+        self.assertRaises(ValueError, replay_memory.ReplayMemory, 5, 10, 'random', None, 3, .9)
+        self.assertRaises(ValueError, replay_memory.ReplayMemory, 5, 10, 'fifo', None, 3)
+
+    def test_sequence_memory_shifts_next_windows_by_steps_summed(self):
+        n_step, discount, sequence_length = 3, .9, 2
+        rm = replay_memory.SequenceReplayMemory(1, sequence_length, batch_size=50, capacity=20, 
+            n_step=n_step, discount=discount)
+        rewards = [float(idx) for idx in range(30)]
+        terminals = [idx % 5 == 4 for idx in range(30)]
+        for idx in range(30):
+            rm.store(np.ones(1) * idx, 0, rewards[idx], terminals[idx])
+
+        states, actions, returns, next_states, batch_terminals, discounts = rm.sample_batch()
+        self.assertEquals(next_states.shape, (50, sequence_length, 1))
+        for sequence, ret, next_sequence, terminal, disc in zip(states, returns, next_states, 
+                batch_terminals, discounts):
+            end = int(sequence[-1, 0])
+            expected, steps = self.expected_n_step(rewards, terminals, end, n_step, discount, 29 - end)
+            self.assertAlmostEqual(ret[0], expected, places=4)
+            self.assertEquals(next_sequence[:, 0].tolist(), (sequence[:, 0] + steps).tolist())
+            self.assertEquals(terminal[0], terminals[end + steps - 1])
+            self.assertAlmostEqual(disc[0], discount ** steps, places=6)
+
+    def test_newest_window_of_full_memory_does_not_sum_the_oldest_step(self):
+        rm = replay_memory.SequenceReplayMemory(1, 2, batch_size=1, capacity=6, n_step=3, 
+            discount=.9)
+        for idx in range(10):
+            rm.store(np.ones(1) * idx, 0, idx, False)
+
+        # the newest valid window ends at step 8, whose only following step 9 ends no window, 
+        # and the slot two steps after it holds the oldest step 4
+        states, actions, returns, next_states, terminals, discounts = rm.gather_windows(
+            np.array([7 % 6]))
+        self.assertEquals(states[0, :, 0].tolist(), [7, 8])
+        self.assertAlmostEqual(returns[0, 0], 8)
+        self.assertEquals(next_states[0, :, 0].tolist(), [8, 9])
+        self.assertAlmostEqual(discounts[0, 0], .9, places=6)
+
+class TestDeduplicatingReplayMemory(unittest.TestCase):
+
+    def store_cycle(self, rm, num_transitions, cycle_length):
+        for idx in range(num_transitions):
+            value = idx % cycle_length
+            rm.store((np.ones(2) * value, value % 4, value, np.ones(2) * (value + 1), 0))
+
+    def test_stores_repeated_transitions_once(self):
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=5, capacity=100)
+        self.store_cycle(rm, 100, 10)
+        self.assertTrue(rm.is_full())
+        self.assertEquals(rm.num_unique(), 10)
+        self.assertEquals(rm.counts.sum(), 100)
+        self.assertEquals(rm.compression_ratio(), 10.)
+
+    def test_counts_cover_only_the_last_capacity_transitions(self):
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=5, capacity=10)
+        self.store_cycle(rm, 10, 10)
+        self.store_cycle(rm, 10, 2)
+        self.assertEquals(rm.num_unique(), 2)
+        self.assertEquals(sorted(rm.counts[rm.counts > 0].tolist()), [5, 5])
+
+    def test_samples_in_proportion_to_counts(self):
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=1000, capacity=100)
+        for idx in range(100):
+            value = 0 if idx < 90 else 1
+            rm.store((np.ones(2) * value, 0, value, np.ones(2), 0))
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertTrue(800 < np.sum(rewards == 0) < 980)
+
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=1000, capacity=100, weighting='uniform')
+        for idx in range(100):
+            value = 0 if idx < 90 else 1
+            rm.store((np.ones(2) * value, 0, value, np.ones(2), 0))
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertTrue(400 < np.sum(rewards == 0) < 600)
+
+    def test_full_unique_storage_drops_oldest_transitions(self):
+        rm = replay_memory.DeduplicatingReplayMemory(batch_size=5, capacity=100, max_unique=5)
+        self.store_cycle(rm, 20, 20)
+        self.assertEquals(rm.num_unique(), 5)
+        self.assertEquals(rm.window_size, 5)
+        self.assertEquals(sorted(rm.rewards[:, 0].tolist()), list(range(15, 20)))
+
+class TestBatchBuffers(unittest.TestCase):
+
+    def test_sample_batch_reuses_buffers_of_network_layout(self):
+        rm = replay_memory.ReplayMemory(batch_size=4, capacity=10)
+        for idx in range(10):
+            rm.store((np.ones(2) * idx, idx % 3, idx, np.ones(2) * (idx + 1), idx % 2))
+
+        first = rm.sample_batch()
+        second = rm.sample_batch()
+        for values, reused in zip(first, second):
+            self.assertTrue(values is reused)
+        floatX = replay_memory.theano.config.floatX
+        self.assertEquals([(values.shape, values.dtype) for values in second], 
+            [((4, 2), floatX), ((4, 1), np.int32), ((4, 1), floatX), ((4, 2), floatX), ((4, 1), np.int32)])
+        states, actions, rewards, next_states, terminals = second
+        self.assertEquals(states[:, 0].tolist(), rewards[:, 0].tolist())
+        self.assertEquals((next_states[:, 0] - 1).tolist(), rewards[:, 0].tolist())
+        self.assertEquals(actions[:, 0].tolist(), (rewards[:, 0] % 3).astype(int).tolist())
+        self.assertEquals(terminals[:, 0].tolist(), (rewards[:, 0] % 2).astype(int).tolist())
+
+    def test_buffers_rotate_through_num_sets(self):
+        buffers = replay_memory.BatchBuffers(num_sets=2)
+        layout = [((3, 2), 'float32')]
+        first = buffers.get(layout)[0]
+        second = buffers.get(layout)[0]
+        self.assertFalse(first is second)
+        self.assertTrue(buffers.get(layout)[0] is first)
+        self.assertTrue(buffers.get(layout)[0] is second)
+        self.assertEquals(buffers.get([((5, 2), 'float32')])[0].shape, (5, 2))
+
+    def test_sequence_sample_batch_reuses_buffers(self):
+        adapter = state_adapters.CoordinatesToRowColAdapter(room_size=3, num_rooms=2)
+        rm = replay_memory.SequenceReplayMemory(2, 3, batch_size=5, capacity=20, 
+            state_adapter=adapter)
+        for idx in range(20):
+            rm.store(np.array([idx % 6, idx % 6]), idx % 4, idx, False)
+
+        first = rm.sample_batch()
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertTrue(states.base is first[0].base)
+        self.assertTrue(next_states.base is states.base)
+        self.assertEquals(states.shape, (5, 3, 12))
+        self.assertEquals(next_states.shape, (5, 3, 12))
+        self.assertEquals(terminals.dtype, np.int32)
+        self.assertEquals(actions[:, 0].tolist(), (rewards[:, 0] % 4).astype(int).tolist())
+        self.assertEquals(states[:, 1:].tolist(), next_states[:, :-1].tolist())
+
+class TestSampleBatches(unittest.TestCase):
+
+    def test_sample_batches_stacks_minibatches(self):
+        rm = replay_memory.ReplayMemory(batch_size=4, capacity=10)
+        for idx in range(10):
+            rm.store((np.ones(2) * idx, idx % 3, idx, np.ones(2) * (idx + 1), 0))
+
+        states, actions, rewards, next_states, terminals = rm.sample_batches(3)
+        self.assertEquals(states.shape, (3, 4, 2))
+        self.assertEquals(actions.shape, (3, 4, 1))
+        self.assertEquals(terminals.shape, (3, 4, 1))
+        self.assertEquals(states[:, :, 0].tolist(), rewards[:, :, 0].tolist())
+        self.assertEquals((next_states[:, :, 0] - 1).tolist(), rewards[:, :, 0].tolist())
+        self.assertTrue(states[1].flags['C_CONTIGUOUS'])
+
+    def test_sequence_sample_batches_stacks_minibatches(self):
+        rm = replay_memory.SequenceReplayMemory(1, 3, batch_size=5, capacity=20)
+        for idx in range(20):
+            rm.store(np.array([idx]), 0, idx, False)
+
+        states, actions, rewards, next_states, terminals = rm.sample_batches(2)
+        self.assertEquals(states.shape, (2, 5, 3, 1))
+        self.assertEquals(rewards.shape, (2, 5, 1))
+        self.assertEquals(states[:, :, -1, 0].tolist(), rewards[:, :, 0].tolist())
+        self.assertEquals(states[:, :, 1:].tolist(), next_states[:, :, :-1].tolist())
+
+    def test_prioritized_sample_batches_stratifies_each_minibatch(self):
+        rm = replay_memory.PrioritizedReplayMemory(batch_size=4, capacity=8)
+        for idx in range(8):
+            rm.store((np.ones(1) * idx, 0, idx, np.ones(1) * idx, 0))
+
+        batches = rm.sample_batches(2)
+        self.assertEquals(len(batches), len(rm.batch_fields))
+        indices = batches[-1]
+        weights = batches[-2]
+        self.assertEquals(indices.shape, (2, 4))
+        self.assertEquals(weights.shape, (2, 4, 1))
+        # with equal priorities, each minibatch holds one of every pair of consecutive slots
+        self.assertEquals((np.sort(indices, axis=1) // 2).tolist(), [list(range(4))] * 2)
+        self.assertEquals(batches[2][:, :, 0].tolist(), indices.tolist())
+
+class TestStratifiedReplayMemory(unittest.TestCase):
+
+    def fill(self, rm, num_transitions, rewarded):
+        for idx in range(num_transitions):
+            rm.store((np.ones(1) * idx, 0, float(idx in rewarded), np.ones(1), 0))
+
+    def test_sample_batch_includes_rare_fraction(self):
+        rm = replay_memory.StratifiedReplayMemory(batch_size=8, capacity=20, rare_fraction=.25)
+        self.fill(rm, 20, [3, 17])
+        self.assertEquals(rm.num_rare, 2)
+        self.assertEquals(sorted(rm.order[:rm.num_rare].tolist()), [3, 17])
+
+        for _ in range(10):
+            states, actions, rewards, next_states, terminals, weights = rm.sample_batch()
+            self.assertEquals(rewards[:2, 0].tolist(), [1, 1])
+            self.assertEquals(rewards[2:, 0].tolist(), [0] * 6)
+            self.assertTrue(np.allclose(weights[:2, 0], 2 * 8 / (20. * 2)))
+            self.assertTrue(np.allclose(weights[2:, 0], 18 * 8 / (20. * 6)))
+            self.assertTrue(np.allclose(np.mean(weights), 1))
+
+    def test_overwritten_slots_change_stratum(self):
+        rm = replay_memory.StratifiedReplayMemory(batch_size=4, capacity=5, eviction='fifo')
+        self.fill(rm, 5, [0, 1])
+        self.assertEquals(rm.num_rare, 2)
+        rm.store((np.ones(1), 0, 0, np.ones(1), 0))
+        rm.store((np.ones(1), 0, 0, np.ones(1), 1))
+        rm.store((np.ones(1), 0, -1, np.ones(1), 0))
+        self.assertEquals(sorted(rm.order[:rm.num_rare].tolist()), [1, 2])
+        self.assertEquals(sorted(rm.order.tolist()), list(range(5)))
+        self.assertEquals(rm.positions[rm.order].tolist(), list(range(5)))
+
+    def test_one_empty_stratum_uses_the_other(self):
+        rm = replay_memory.StratifiedReplayMemory(batch_size=4, capacity=10)
+        self.fill(rm, 10, [])
+        states, actions, rewards, next_states, terminals, weights = rm.sample_batch()
+        self.assertEquals(weights[:, 0].tolist(), [1] * 4)
+
+    def test_sample_batches_stratifies_each_minibatch(self):
+        rm = replay_memory.StratifiedReplayMemory(batch_size=4, capacity=10, rare_fraction=.5)
+        self.fill(rm, 10, [5])
+        batches = rm.sample_batches(3)
+        self.assertEquals(batches[-1].shape, (3, 4, 1))
+        self.assertEquals(batches[2][:, :, 0].tolist(), [[1, 1, 0, 0]] * 3)
+
+    def test_snapshot_restores_strata(self):
+        rm = replay_memory.StratifiedReplayMemory(batch_size=4, capacity=10)
+        self.fill(rm, 8, [2, 6])
+        directory = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(directory, 'snapshot')
+            replay_memory.save_snapshot(rm, filepath)
+            loaded = replay_memory.StratifiedReplayMemory(batch_size=4, capacity=10)
+            replay_memory.load_snapshot(loaded, filepath)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEquals(loaded.num_rare, 2)
+        self.assertEquals(sorted(loaded.states[loaded.order[:2], 0].tolist()), [2, 6])
+
+def store_consistent_transitions(memory, writer_id, num_steps):
+    memory.attach_writer(writer_id)
+    for step in range(num_steps):
+        value = writer_id * num_steps + step
+        memory.store((np.ones(2) * value, writer_id, value, np.ones(2) * (value + 1), 0))
+
+class TestSharedReplayMemory(unittest.TestCase):
+
+    def test_store_requires_attached_writer(self):
+        rm = replay_memory.SharedReplayMemory(5, 10, (2, ), num_writers=2)
+        self.assertRaises(Exception, rm.store, (np.zeros(2), 0, 0, np.zeros(2), 0))
+        self.assertRaises(ValueError, rm.attach_writer, 2)
+
+    def test_writers_fill_their_own_slots(self):
+        rm = replay_memory.SharedReplayMemory(5, 10, (2, ), num_writers=2)
+        rm.attach_writer(1)
+        for idx in range(7):
+            rm.store((np.ones(2) * idx, 1, idx, np.ones(2) * (idx + 1), 0))
+        self.assertEquals(rm.counts.tolist(), [0, 7])
+        self.assertEquals(rm.rewards[:5, 0].tolist(), [0] * 5)
+        self.assertEquals(rm.rewards[5:, 0].tolist(), [5, 6, 2, 3, 4])
+        self.assertFalse(rm.is_full())
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        self.assertEquals(states.shape, (5, 2))
+        self.assertTrue(all(reward in [2, 3, 4, 5, 6] for reward in rewards[:, 0]))
+
+    def test_batches_rotate_through_batch_buffers(self):
+        # a prefetcher sets the number of buffer sets so that queued batches stay intact
+        rm = replay_memory.SharedReplayMemory(5, 10, (2, ), num_writers=1)
+        rm.batch_buffers.num_sets = 2
+        rm.attach_writer(0)
+        for idx in range(10):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2) * (idx + 1), 0))
+        first = rm.sample_batch()
+        rewards = first[2].copy()
+        second = rm.sample_batch()
+        self.assertFalse(any(a is b for a, b in zip(first, second)))
+        self.assertEquals(first[2].tolist(), rewards.tolist())
+
+    def test_samples_consistent_while_actor_processes_store(self):
+        num_writers = 3
+        num_steps = 20000
+        rm = replay_memory.SharedReplayMemory(32, 300, (2, ), num_writers)
+        actors = [multiprocessing.Process(target=store_consistent_transitions, 
+            args=(rm, idx, num_steps)) for idx in range(num_writers)]
+        for actor in actors:
+            actor.start()
+
+        while any(actor.is_alive() for actor in actors):
+            if rm.is_empty():
+                continue
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+            self.assertEquals(states[:, 0].tolist(), rewards[:, 0].tolist())
+            self.assertEquals(states[:, 1].tolist(), rewards[:, 0].tolist())
+            self.assertEquals((next_states[:, 0] - 1).tolist(), rewards[:, 0].tolist())
+            self.assertEquals(actions[:, 0].tolist(), (rewards[:, 0] // num_steps).astype(int).tolist())
+
+        for actor in actors:
+            actor.join()
+        self.assertTrue(rm.is_full())
+        self.assertEquals(rm.counts.tolist(), [num_steps] * num_writers)
+
+def store_actor_steps(memory, actor_id, num_steps):
+    # stores steps numbered so that a window mixing two actors or skipping a step stands out
+    memory.attach_actor(actor_id)
+    for step in range(num_steps):
+        memory.store(np.array([actor_id * num_steps + step]), actor_id, step, False)
+
+class TestConcurrentReplayMemory(unittest.TestCase):
+
+    def test_statistics_cover_every_shard(self):
+        shards = [replay_stats.InstrumentedReplayMemory(replay_memory.SequenceReplayMemory(1, 2, 
+            batch_size=4, capacity=10)) for _ in range(2)]
+        rm = replay_memory.ConcurrentReplayMemory(shards)
+        for actor_id in range(2):
+            rm.attach_actor(actor_id)
+            for idx in range(6 + actor_id):
+                rm.store(np.ones(1) * idx, 0, idx, False)
+
+        # the statistics of a shard would only describe that shard
+        self.assertFalse(hasattr(rm, 'collect_stats'))
+        self.assertEquals(rm.sequence_length, 2)
+        self.assertEquals(rm.size, 13)
+        self.assertEquals(rm.num_valid, shards[0].num_valid + shards[1].num_valid)
+
+        stats = replay_stats.InstrumentedReplayMemory(rm).collect_stats()
+        self.assertEquals(stats['fill_level'], 13 / 20.)
+        self.assertEquals(stats['bytes_used'], shards[0].bytes_used() + shards[1].bytes_used())
+        self.assertEquals(stats['invalid_windows'], 13 - rm.num_valid)
+
+    def test_rejects_shards_that_are_not_sampled_uniformly(self):
+        self.assertRaises(ValueError, replay_memory.ConcurrentReplayMemory, 
+            [replay_memory.PrioritizedReplayMemory(4, 10)])
+        self.assertRaises(ValueError, replay_memory.ConcurrentReplayMemory, 
+            [replay_memory.StratifiedReplayMemory(4, 10)])
+        self.assertRaises(ValueError, replay_memory.ConcurrentReplayMemory, 
+            [replay_memory.DeduplicatingReplayMemory(4, 10)])
+
+    def test_store_requires_attached_actor(self):
+        rm = replay_memory.ConcurrentReplayMemory([replay_memory.ReplayMemory(4, 10)])
+        self.assertRaises(Exception, rm.store, (np.ones(2), 0, 0, np.ones(2), 0))
+
+    def test_sample_batch_draws_from_every_shard(self):
+        rm = replay_memory.ConcurrentReplayMemory([replay_memory.ReplayMemory(8, 10) 
+            for _ in range(2)])
+        for actor_id in range(2):
+            rm.attach_actor(actor_id)
+            for idx in range(10):
+                rm.store((np.ones(2) * idx, actor_id, idx, np.ones(2) * (idx + 1), 0))
+        self.assertTrue(rm.is_full())
+        self.assertEquals(rm.size, 20)
+        self.assertEquals(rm.capacity, 20)
+
+        actions = np.concatenate([rm.sample_batch()[1] for _ in range(20)])
+        self.assertEquals(sorted(set(actions[:, 0].tolist())), [0, 1])
+        states, actions, rewards, next_states, terminals = rm.sample_batches(3)
+        self.assertEquals(states.shape, (3, 8, 2))
+        self.assertEquals(states[:, :, 0].tolist(), rewards[:, :, 0].tolist())
+
+    def test_windows_never_mix_actors_while_threads_store(self):
+        num_actors = 3
+        num_steps = 3000
+        sequence_length = 4
+        rm = replay_memory.ConcurrentReplayMemory([replay_memory.SequenceReplayMemory(1, 
+            sequence_length, 16, 200) for _ in range(num_actors)])
+        actors = [threading.Thread(target=store_actor_steps, args=(rm, actor_id, num_steps)) 
+            for actor_id in range(num_actors)]
+        for actor in actors:
+            actor.start()
+
+        while any(actor.is_alive() for actor in actors):
+            if not rm.is_full():
+                continue
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+            steps = states[:, :, 0]
+            self.assertTrue(np.all(np.diff(steps, axis=1) == 1))
+            self.assertEquals((steps[:, -1] // num_steps).tolist(), actions[:, 0].tolist())
+            self.assertEquals((steps[:, -1] % num_steps).tolist(), rewards[:, 0].tolist())
+            self.assertEquals((next_states[:, -1, 0] - 1).tolist(), steps[:, -1].tolist())
+
+        for actor in actors:
+            actor.join()
+
+class TestTransitionIds(unittest.TestCase):
+
+    def test_sample_batch_includes_ids_of_sampled_transitions(self):
+        rm = replay_memory.ReplayMemory(batch_size=20, capacity=10, transition_ids=True)
+        for idx in range(6):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2) * (idx + 1), 0))
+        self.assertEquals(rm.batch_fields[-1], 'transition_ids')
+        states, actions, rewards, next_states, terminals, ids = rm.sample_batch()
+        self.assertEquals(ids.dtype, np.dtype('int64'))
+        self.assertEquals(ids.tolist(), rewards[:, 0].astype('int64').tolist())
+
+    def test_n_step_ids_are_those_of_the_last_transition_summed(self):
+        rm = replay_memory.ReplayMemory(batch_size=20, capacity=10, eviction='fifo', n_step=3, 
+            discount=.5, transition_ids=True)
+        for idx in range(14):
+            rm.store((np.ones(2) * idx, 0, 1, np.ones(2) * (idx + 1), idx == 8))
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        self.assertEquals(rm.batch_fields[-2:], ('discounts', 'transition_ids'))
+        self.assertEquals(batch['transition_ids'].tolist(), 
+            (batch['next_states'][:, 0] - 1).astype('int64').tolist())
+
+    def test_ids_precede_weights_and_indices(self):
+        rm = replay_memory.PrioritizedReplayMemory(batch_size=5, capacity=10, transition_ids=True)
+        for idx in range(10):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2), 0))
+        self.assertEquals(rm.batch_fields[-3:], ('transition_ids', 'weights', 'indices'))
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        self.assertEquals(batch['transition_ids'].tolist(), rm.stored_ids[batch['indices']].tolist())
+
+    def test_sequence_ids_are_those_of_the_last_step_of_next_windows(self):
+        rm = replay_memory.SequenceReplayMemory(1, 3, batch_size=20, capacity=10, hidden_size=2, 
+            transition_ids=True)
+        for idx in range(15):
+            rm.store(np.ones(1) * idx, 0, idx, False, hidden=np.zeros(2))
+        self.assertEquals(rm.batch_fields[-3:], ('hid_init', 'next_hid_init', 'transition_ids'))
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        self.assertEquals(batch['transition_ids'].tolist(), 
+            batch['next_states'][:, -1, 0].astype('int64').tolist())
+
+    def test_n_step_sequence_ids_follow_the_shifted_next_windows(self):
+        rm = replay_memory.SequenceReplayMemory(1, 2, batch_size=20, capacity=10, n_step=3, 
+            discount=.5, transition_ids=True)
+        for idx in range(15):
+            rm.store(np.ones(1) * idx, 0, idx, idx == 11)
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        self.assertEquals(batch['transition_ids'].tolist(), 
+            batch['next_states'][:, -1, 0].astype('int64').tolist())
+
+    def test_loaded_transitions_get_new_ids(self):
+        directory = tempfile.mkdtemp()
+        filepath = os.path.join(directory, 'snapshot.npy')
+        rm = replay_memory.ReplayMemory(batch_size=20, capacity=10, eviction='fifo', 
+            transition_ids=True)
+        for idx in range(25):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2), 0))
+        rm.save(filepath)
+
+        loaded = replay_memory.ReplayMemory(batch_size=20, capacity=10, eviction='fifo', 
+            transition_ids=True)
+        loaded.load(filepath)
+        shutil.rmtree(directory)
+        self.assertEquals(loaded.next_transition_id, 10)
+        batch = dict(zip(loaded.batch_fields, loaded.sample_batch()))
+        self.assertEquals(batch['transition_ids'].tolist(), 
+            (batch['rewards'][:, 0] - 15).astype('int64').tolist())
+
+    def test_concurrent_ids_are_unique_across_shards(self):
+        rm = replay_memory.ConcurrentReplayMemory([replay_memory.ReplayMemory(20, 4, 
+            transition_ids=True) for _ in range(2)])
+        for actor_id in range(2):
+            rm.attach_actor(actor_id)
+            for idx in range(4):
+                rm.store((np.ones(2), 0, actor_id * 10 + idx, np.ones(2), 0))
+        batch = dict(zip(rm.batch_fields, rm.sample_batch()))
+        rewards = batch['rewards'][:, 0].astype('int64')
+        self.assertEquals((batch['transition_ids'] % 2).tolist(), (rewards // 10).tolist())
+        self.assertEquals((batch['transition_ids'] // 2).tolist(), (rewards % 10).tolist())
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
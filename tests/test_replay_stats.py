@@ -0,0 +1,76 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
+
+import prefetch
+import replay_memory
+import replay_stats
+
+class TestInstrumentedReplayMemory(unittest.TestCase):
+
+    def test_collect_stats_of_sampled_transitions(self):
+        rm = replay_stats.InstrumentedReplayMemory(replay_memory.ReplayMemory(batch_size=4, 
+            capacity=8, eviction='fifo'))
+        for idx in range(6):
+            rm.store((np.ones(2) * idx, 0, idx % 2, np.ones(2), int(idx == 5)))
+        self.assertEquals(rm.fill_level(), .75)
+        self.assertEquals(rm.bytes_used(), sum(getattr(rm, name).nbytes for name in 
+            rm.snapshot_fields))
+
+        for _ in range(5):
+            states, actions, rewards, next_states, terminals = rm.sample_batch()
+        rm.sample_batches(2)
+        stats = rm.collect_stats()
+        self.assertEquals(stats['batches'], 7)
+        self.assertEquals(rm.age_counts.sum(), 0)
+        self.assertEquals(stats['age_histogram'].sum(), 28)
+        self.assertTrue(0 <= stats['terminal_fraction'] <= 1)
+        self.assertTrue(stats['mean_sample_ms'] <= stats['max_sample_ms'])
+        self.assertFalse('invalid_windows' in stats)
+
+    def test_ages_follow_stored_transitions(self):
+        rm = replay_stats.InstrumentedReplayMemory(replay_memory.ReplayMemory(batch_size=16, 
+            capacity=4, eviction='fifo'))
+        for idx in range(7):
+            rm.store((np.ones(1) * idx, 0, idx, np.ones(1), 0))
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        ages = 6 - rewards[:, 0]
+        expected = np.bincount(replay_stats.age_buckets(ages.astype(int)), 
+            minlength=replay_stats.NUM_AGE_BUCKETS)
+        self.assertEquals(rm.collect_stats()['age_histogram'].tolist(), expected.tolist())
+
+    def test_age_buckets_double_in_width(self):
+        self.assertEquals(replay_stats.age_buckets(np.array([0, 1, 2, 3, 6, 7, -1])).tolist(), 
+            [0, 1, 1, 2, 2, 3, 0])
+
+    def test_sequence_memory_reports_invalid_windows(self):
+        rm = replay_stats.InstrumentedReplayMemory(replay_memory.SequenceReplayMemory(1, 3, 
+            batch_size=5, capacity=10))
+        for idx in range(10):
+            rm.store(np.array([idx]), 0, 1, idx == 4)
+
+        states, actions, rewards, next_states, terminals = rm.sample_batch()
+        stats = rm.collect_stats()
+        self.assertEquals(stats['invalid_windows'], 10 - rm.num_valid)
+        self.assertEquals(stats['rewarded_fraction'], 1.)
+        ages = 9 - states[:, -1, 0]
+        expected = np.bincount(replay_stats.age_buckets(ages.astype(int)), 
+            minlength=replay_stats.NUM_AGE_BUCKETS)
+        self.assertEquals(stats['age_histogram'].tolist(), expected.tolist())
+
+    def test_instrumented_memory_inside_prefetcher(self):
+        rm = prefetch.PrefetchingReplayMemory(replay_stats.InstrumentedReplayMemory(
+            replay_memory.ReplayMemory(batch_size=4, capacity=8)), queue_depth=2)
+        for idx in range(8):
+            rm.store((np.ones(2) * idx, 0, idx, np.ones(2), 0))
+        for _ in range(3):
+            rm.sample_batch()
+        rm.close()
+        self.assertTrue(rm.collect_stats()['batches'] >= 3)
+
+if __name__ == '__main__':
+    unittest.main()
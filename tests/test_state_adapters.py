@@ -104,6 +104,27 @@ class TestCoordinatesToRowColRoomAdapter(unittest.TestCase):
         actual = adapter.convert_state_to_agent_format(mdp_formatted_state).tolist()
         self.assertEquals(actual, expected)
 
+class TestConvertStatesToAgentFormat(unittest.TestCase):
+
+    def assert_matches_single_state_conversion(self, adapter):
+        states = np.array([(r, c) for r in range(6) for c in range(6)])
+        expected = np.array([adapter.convert_state_to_agent_format(tuple(state)) for state in states])
+        actual = adapter.convert_states_to_agent_format(states, dtype='float32')
+        self.assertEquals(actual.dtype, np.float32)
+        self.assertEquals(actual.tolist(), expected.tolist())
+
+    def test_single_room_row_col_adapter(self):
+        adapter = state_adapters.CoordinatesToSingleRoomRowColAdapter(room_size=3)
+        self.assert_matches_single_state_conversion(adapter)
+
+    def test_row_col_adapter(self):
+        adapter = state_adapters.CoordinatesToRowColAdapter(room_size=3, num_rooms=2)
+        self.assert_matches_single_state_conversion(adapter)
+
+    def test_row_col_room_adapter(self):
+        adapter = state_adapters.CoordinatesToRowColRoomAdapter(room_size=3, num_rooms=2)
+        self.assert_matches_single_state_conversion(adapter)
+
 
 
 
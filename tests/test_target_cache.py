@@ -0,0 +1,54 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'scripts')))
+
+import target_cache
+
+class TestTargetValueCache(unittest.TestCase):
+
+    def compute_from(self, values, requested):
+        def compute_values(misses):
+            requested.append(list(misses))
+            return values[misses]
+        return compute_values
+
+    def test_cached_values_are_not_recomputed(self):
+        cache = target_cache.TargetValueCache(8)
+        requested = []
+        values = np.array([1., 2., 3.])
+        first = cache.get(np.array([0, 1, 2]), self.compute_from(values, requested))
+        second = cache.get(np.array([2, 0, 5]), self.compute_from(np.array([0., 0., 6.]), requested))
+        self.assertEquals(first.shape, (3, 1))
+        self.assertEquals(list(first.reshape(-1)), [1., 2., 3.])
+        self.assertEquals(list(second.reshape(-1)), [3., 1., 6.])
+        self.assertEquals(requested, [[0, 1, 2], [2]])
+        self.assertEquals(cache.hit_rate(), 2 / 6.)
+
+    def test_invalidate_recomputes_every_value(self):
+        cache = target_cache.TargetValueCache(8)
+        requested = []
+        cache.get(np.array([0, 1]), self.compute_from(np.array([1., 2.]), requested))
+        cache.invalidate()
+        values = cache.get(np.array([0, 1]), self.compute_from(np.array([3., 4.]), requested))
+        self.assertEquals(list(values.reshape(-1)), [3., 4.])
+        self.assertEquals(requested, [[0, 1], [0, 1]])
+
+    def test_ids_sharing_an_entry_keep_their_own_values(self):
+        cache = target_cache.TargetValueCache(4)
+        requested = []
+        values = cache.get(np.array([1, 5]), self.compute_from(np.array([1., 5.]), requested))
+        self.assertEquals(list(values.reshape(-1)), [1., 5.])
+
+        # the entry holds the id written last, so the other one misses
+        values = cache.get(np.array([1, 5]), self.compute_from(np.array([7., 8.]), requested))
+        self.assertEquals(list(values.reshape(-1)), [7., 5.])
+        self.assertEquals(requested, [[0, 1], [0]])
+
+    def test_hit_rate_without_requests(self):
+        self.assertEquals(target_cache.TargetValueCache(4).hit_rate(), 0.)
+
+if __name__ == '__main__':
+    unittest.main()